@@ -1,89 +1,255 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from app.models.prompt import OptimizationRequest, OptimizedPrompt, ComponentType, TaskType, BehaviorType
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from app.models.prompt import (
+    OptimizationRequest, OptimizedPrompt, ComponentType, TaskType, BehaviorType, BatchRequest, BatchOperation,
+    COMPONENT_TYPES, TASK_TYPES, BEHAVIOR_TYPES, TASK_VALUES, BEHAVIOR_VALUES
+)
 from app.services.prompt_optimizer import PromptOptimizer
-from app.models.database import get_db, SessionLocal, OptimizedPromptDB, Base, engine
-from typing import Dict, List, Any, Optional, Union
-from sqlalchemy.orm import Session
+from app.models.database import get_db, SessionLocal, OptimizedPromptDB
+from typing import Dict, List, Any, Optional, Tuple, Union
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, selectinload
 import os
 import datetime
 import logging
 import time
-import json
+import uuid
+import orjson
+import asyncio
+from functools import lru_cache
+import anyio
+from cachetools import LRUCache
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/v1")
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
-
-# In production, you would use proper dependency injection
-def get_optimizer():
+# The optimizer (and its ASP engine with preloaded efficacy tables) is built once
+# per process and shared across requests
+@lru_cache(maxsize=1)
+def get_optimizer_instance() -> PromptOptimizer:
     api_key = os.getenv("OPENAI_API_KEY", None)  # Or your preferred LLM provider
     return PromptOptimizer(api_key=api_key)
 
 
+async def get_optimizer() -> PromptOptimizer:
+    # Async so FastAPI resolves it inline instead of dispatching to the thread pool
+    return get_optimizer_instance()
+
+
+# Optimizations currently running, keyed by request contents so concurrent duplicates share one result
+_inflight_optimizations: Dict[tuple, "asyncio.Future[OptimizedPrompt]"] = {}
+
+# Maximum number of finished optimization responses kept for repeat requests
+OPTIMIZATION_RESPONSE_CACHE_SIZE = 256
+
+# Encoded response plus the result it came from, so cache hits can still be saved to the history
+_optimization_responses: "LRUCache[tuple, Tuple[bytes, OptimizedPrompt]]" = LRUCache(maxsize=OPTIMIZATION_RESPONSE_CACHE_SIZE)
+
+# Hit and miss counts of the response caches, reported by /health
+_cache_stats: Dict[str, Dict[str, int]] = {
+    "analyze": {"hits": 0, "misses": 0},
+    "optimize": {"hits": 0, "misses": 0},
+}
+
+
+def _normalize_prompt(text: str) -> str:
+    """Collapse whitespace so prompts differing only in spacing share cache entries"""
+    return " ".join(text.split())
+
+
+def _optimization_key(request: OptimizationRequest) -> tuple:
+    """Build a hashable key identifying an optimization request
+    
+    The prompt is used verbatim, since it is echoed in the generated content.
+    """
+    return (
+        request.user_prompt,
+        tuple(sorted([TASK_VALUES[t] for t in request.target_tasks])),
+        tuple(sorted([BEHAVIOR_VALUES[b] for b in request.target_behaviors])),
+        request.target_model,
+        request.domain,
+    )
+
+
+async def _coalesced_optimize(optimizer: PromptOptimizer, request: OptimizationRequest) -> OptimizedPrompt:
+    """Run optimizer.optimize_async, joining an identical in-flight run if there is one
+    
+    The shared run doesn't save its result; each caller saves it to the history itself. The run
+    is strict, so any failure raises instead of returning a degraded result.
+    """
+    key = _optimization_key(request)
+    future = _inflight_optimizations.get(key)
+    if future is None:
+        future = asyncio.ensure_future(optimizer.optimize_async(request, save=False, strict=True))
+        _inflight_optimizations[key] = future
+        future.add_done_callback(lambda _: _inflight_optimizations.pop(key, None))
+    # Shield so one client disconnecting doesn't cancel the run for the others
+    return await asyncio.shield(future)
+
+
+def _json_response(content: Any) -> Response:
+    """Encode a response body with orjson directly
+    
+    Returning a plain dict makes FastAPI walk it with jsonable_encoder before the orjson
+    response class encodes it; orjson handles the enums and datetimes in these payloads itself.
+    """
+    return Response(content=orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS), media_type="application/json")
+
+
+def _new_request_id() -> str:
+    """Short random id used to correlate the log lines of one request"""
+    return uuid.uuid4().hex[:12]
+
+
 @router.post("/optimize", response_model=OptimizedPrompt)
-async def optimize_prompt(request: OptimizationRequest, req: Request, optimizer: PromptOptimizer = Depends(get_optimizer)):
+async def optimize_prompt(request: OptimizationRequest, req: Request, background_tasks: BackgroundTasks,
+                          optimizer: PromptOptimizer = Depends(get_optimizer)):
     """Optimize a prompt based on the request parameters"""
-    start_time = time.time()
-    request_id = f"req_{int(start_time * 1000)}"
+    start_time = time.perf_counter()
+    request_id = _new_request_id()
     
-    # Log request details
-    logger.info(f"[{request_id}] Optimization request received: model={request.target_model}, tasks={len(request.target_tasks)}, behaviors={len(request.target_behaviors)}")
+    # Repeat requests are answered from the cache without being optimized again, but still go into the history
+    cache_key = (optimizer, _optimization_key(request))
+    cached = _optimization_responses.get(cache_key)
+    if cached is not None:
+        _cache_stats["optimize"]["hits"] += 1
+        logger.info("[%s] Optimization served from cache", request_id)
+        content, result = cached
+        background_tasks.add_task(optimizer.save_result, request, result)
+        return Response(content=content, media_type="application/json")
+    _cache_stats["optimize"]["misses"] += 1
     
     try:
-        # Process the request
-        result = optimizer.optimize(request)
-        
-        # Log success
-        processing_time = time.time() - start_time
-        logger.info(f"[{request_id}] Optimization completed in {processing_time:.2f}s with score: {result.effectiveness_score:.2f}")
-        
-        return result
+        result = await _coalesced_optimize(optimizer, request)
     except Exception as e:
-        # Log error details
-        logger.error(f"[{request_id}] Optimization failed: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Optimization failed: {str(e)}")
+        # Answer with the fallback prompt, but don't cache it or add it to the history
+        logger.error("[%s] Optimization failed, returning the fallback: %s", request_id, e, exc_info=True)
+        return Response(content=optimizer.fallback_result(request).model_dump_json(), media_type="application/json")
+    
+    # Log success
+    processing_time = time.perf_counter() - start_time
+    logger.info("[%s] Optimization completed in %.2fs with score: %.2f", request_id, processing_time, result.effectiveness_score)
+    
+    # Serialize straight to JSON bytes with pydantic; with the app's orjson default response
+    # class FastAPI would otherwise convert the model to a dict before encoding it
+    content = result.model_dump_json()
+    _optimization_responses[cache_key] = (content, result)
+    # Saving the result to the database runs after the response has been sent
+    background_tasks.add_task(optimizer.save_result, request, result)
+    return Response(content=content, media_type="application/json")
+
+
+@router.post("/optimize/stream")
+async def optimize_prompt_stream(request: OptimizationRequest, req: Request, background_tasks: BackgroundTasks,
+                                 optimizer: PromptOptimizer = Depends(get_optimizer)):
+    """Optimize a prompt, streaming progress as newline-delimited JSON events
+    
+    The solved structure is sent before the LLM calls finish; the final "result" event
+    carries the same OptimizedPrompt that /optimize returns.
+    """
+    request_id = _new_request_id()
+    
+    async def events():
+        start_time = time.perf_counter()
+        async for event, payload in optimizer.optimize_stream(request, background_tasks):
+            if event == "result":
+                logger.info("[%s] Streamed optimization completed in %.2fs with score: %.2f",
+                            request_id, time.perf_counter() - start_time, payload.effectiveness_score)
+                payload = {"result": payload.model_dump(mode="json")}
+            yield orjson.dumps({"event": event, **payload}) + b"\n"
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson", background=background_tasks)
+
+
+# Maximum number of distinct prompt texts whose analysis is kept
+ANALYSIS_CACHE_SIZE = 1024
+
+
+_analysis_responses: "LRUCache[tuple, Dict[str, Any]]" = LRUCache(maxsize=ANALYSIS_CACHE_SIZE)
+
+
+async def _analyze_cached(optimizer: PromptOptimizer, text: str) -> Dict[str, Any]:
+    """Analyze a prompt and build the response fields that only depend on its text"""
+    key = (optimizer, _normalize_prompt(text))
+    cached = _analysis_responses.get(key)
+    if cached is not None:
+        _cache_stats["analyze"]["hits"] += 1
+        return cached
+    _cache_stats["analyze"]["misses"] += 1
+    
+    # The analysis awaits the LLM on the event loop, so no worker thread is tied up while it waits
+    analysis = await optimizer.meta_llm.analyze_task_async(text)
+    response = {
+        "analysis": analysis,
+        "detected_tasks": [TASK_VALUES[task] for task in analysis["detected_tasks"]],
+        "detected_behaviors": [BEHAVIOR_VALUES[behavior] for behavior in analysis["detected_behaviors"]],
+        "domain": analysis.get("domain_hint"),
+    }
+    _analysis_responses[key] = response
+    return response
 
 
 @router.post("/analyze")
 async def analyze_prompt(prompt: Dict[str, str], req: Request, optimizer: PromptOptimizer = Depends(get_optimizer)):
     """Analyze a prompt without fully optimizing it"""
-    start_time = time.time()
-    request_id = f"req_{int(start_time * 1000)}"
+    start_time = time.perf_counter()
+    request_id = _new_request_id()
     
     # Input validation
     if not prompt.get("text"):
         raise HTTPException(status_code=400, detail="Text field is required")
     
-    logger.info(f"[{request_id}] Analysis request received: prompt_length={len(prompt.get('text', ''))}")
-    
     try:
-        # Analyze the prompt
-        analysis = optimizer.meta_llm.analyze_task(prompt.get("text", ""))
+        # Analyze the prompt (repeated texts are served from the cache)
+        analysis_response = await _analyze_cached(optimizer, prompt.get("text", ""))
         
         # Format the response
+        processing_time = time.perf_counter() - start_time
         response = {
-            "analysis": analysis,
-            "detected_tasks": [task.value for task in analysis["detected_tasks"]],
-            "detected_behaviors": [behavior.value for behavior in analysis["detected_behaviors"]],
-            "domain": analysis.get("domain_hint"),
-            "processing_time": f"{time.time() - start_time:.2f}s"
+            **analysis_response,
+            "processing_time": f"{processing_time:.2f}s"
         }
         
-        logger.info(f"[{request_id}] Analysis completed in {time.time() - start_time:.2f}s")
-        return response
+        logger.info("[%s] Analysis completed in %.2fs", request_id, processing_time)
+        return _json_response(response)
     except Exception as e:
-        logger.error(f"[{request_id}] Analysis failed: {str(e)}", exc_info=True)
+        logger.error("[%s] Analysis failed: %s", request_id, e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 
-@router.post("/feedback")
+def _lookup_enum(members: Dict[str, Any], value: Any, enum_name: str) -> Any:
+    """Map a raw request value to its enum member, raising ValueError like the Enum constructor"""
+    try:
+        return members[value]
+    except (KeyError, TypeError):
+        raise ValueError(f"{value!r} is not a valid {enum_name}")
+
+
+# Seconds between writes of buffered feedback, and the longest wait after repeated failures
+FEEDBACK_FLUSH_INTERVAL = 0.5
+FEEDBACK_MAX_BACKOFF = 30.0
+
+
+async def flush_feedback_periodically(optimizer: PromptOptimizer) -> None:
+    """Persist buffered feedback in the background, backing off while the database is failing"""
+    delay = FEEDBACK_FLUSH_INTERVAL
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            await anyio.to_thread.run_sync(optimizer.flush_feedback)
+            delay = FEEDBACK_FLUSH_INTERVAL
+        except Exception as e:
+            delay = min(delay * 2, FEEDBACK_MAX_BACKOFF)
+            logger.error(f"Failed to save feedback, retrying in {delay:.1f}s: {str(e)}")
+
+
+@router.post("/feedback", status_code=202)
 async def provide_feedback(feedback: Dict[str, Any], req: Request, optimizer: PromptOptimizer = Depends(get_optimizer)):
     """Provide feedback on component effectiveness to improve future optimizations"""
-    request_id = f"req_{int(time.time() * 1000)}"
+    request_id = _new_request_id()
     
     # Validate required fields
     required_fields = ["component_type", "effectiveness"]
@@ -98,20 +264,22 @@ async def provide_feedback(feedback: Dict[str, Any], req: Request, optimizer: Pr
     
     try:
         # Parse and validate input
-        component_type = ComponentType(feedback.get("component_type"))
+        component_type = _lookup_enum(COMPONENT_TYPES, feedback.get("component_type"), "ComponentType")
         
         # Handle both task and behavior feedback
         if feedback.get("task_type"):
-            task_or_behavior = TaskType(feedback.get("task_type"))
-            logger.info(f"[{request_id}] Feedback received for component={component_type.value}, task={task_or_behavior.value}")
+            task_or_behavior = _lookup_enum(TASK_TYPES, feedback.get("task_type"), "TaskType")
+            logger.info("[%s] Feedback received for component=%s, task=%s", request_id, component_type.value, task_or_behavior.value)
         else:
-            task_or_behavior = BehaviorType(feedback.get("behavior_type"))
-            logger.info(f"[{request_id}] Feedback received for component={component_type.value}, behavior={task_or_behavior.value}")
+            task_or_behavior = _lookup_enum(BEHAVIOR_TYPES, feedback.get("behavior_type"), "BehaviorType")
+            logger.info("[%s] Feedback received for component=%s, behavior=%s", request_id, component_type.value, task_or_behavior.value)
             
         effectiveness = float(feedback.get("effectiveness", 0.0))
         
-        # Update with feedback
-        if optimizer.provide_feedback(component_type, task_or_behavior, effectiveness):
+        # Apply the feedback now; it is written to the database by the background flush
+        if await anyio.to_thread.run_sync(optimizer.queue_feedback, component_type, task_or_behavior, effectiveness):
+            # Feedback changes component efficacies, so earlier optimizations may no longer be optimal
+            _optimization_responses.clear()
             return {
                 "status": "success", 
                 "message": "Feedback recorded successfully",
@@ -123,16 +291,71 @@ async def provide_feedback(feedback: Dict[str, Any], req: Request, optimizer: Pr
             
     except ValueError as e:
         # Handle validation errors
-        logger.error(f"[{request_id}] Invalid feedback data: {str(e)}")
+        logger.error("[%s] Invalid feedback data: %s", request_id, e)
         raise HTTPException(status_code=400, detail=f"Invalid input: {str(e)}")
     except Exception as e:
         # Handle other errors
-        logger.error(f"[{request_id}] Feedback processing failed: {str(e)}", exc_info=True)
+        logger.error("[%s] Feedback processing failed: %s", request_id, e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to process feedback: {str(e)}")
 
 
+# Characters of the user prompt shown in the history list
+HISTORY_PREVIEW_LENGTH = 100
+
+
+# Validators for each batch operation's body, matching the body type its endpoint declares
+_BATCH_BODY_ADAPTERS: Dict[str, TypeAdapter] = {
+    "optimize": TypeAdapter(OptimizationRequest),
+    "analyze": TypeAdapter(Dict[str, str]),
+    "feedback": TypeAdapter(Dict[str, Any]),
+}
+
+
+async def _run_batch_operation(operation: BatchOperation, req: Request, background_tasks: BackgroundTasks,
+                               optimizer: PromptOptimizer) -> bytes:
+    """Run one batch operation through its endpoint's handler and encode the outcome as JSON"""
+    try:
+        # Validate first, so a malformed body gets the 422 its endpoint would return
+        body = _BATCH_BODY_ADAPTERS[operation.op].validate_python(operation.body)
+        if operation.op == "optimize":
+            response = await optimize_prompt(body, req, background_tasks, optimizer)
+            status_code, body = response.status_code, response.body
+        elif operation.op == "analyze":
+            response = await analyze_prompt(body, req, optimizer)
+            status_code, body = response.status_code, response.body
+        else:
+            status_code, body = 202, orjson.dumps(await provide_feedback(body, req, optimizer))
+    except ValidationError as e:
+        status_code, body = 422, orjson.dumps({"detail": e.errors(include_url=False, include_context=False)})
+    except HTTPException as e:
+        status_code, body = e.status_code, orjson.dumps({"detail": e.detail})
+    except Exception as e:
+        # Fail only this operation, with the body the app returns for unhandled errors
+        logger.error("Batch %s operation failed: %s", operation.op, e, exc_info=True)
+        status_code, body = 500, orjson.dumps({"detail": "Internal server error"})
+    
+    # The handlers already produced JSON bytes, so they are spliced in rather than decoded and re-encoded
+    return b'{"op":"%s","status_code":%d,"body":%s}' % (operation.op.encode(), status_code, body)
+
+
+@router.post("/batch")
+async def run_batch(batch: BatchRequest, req: Request, background_tasks: BackgroundTasks,
+                    optimizer: PromptOptimizer = Depends(get_optimizer)):
+    """Run several optimize, analyze and feedback operations in one round trip
+    
+    The operations run concurrently through the same handlers as their own endpoints. Each result
+    carries the status code and body that endpoint would have returned, in request order.
+    """
+    results = await asyncio.gather(*[
+        _run_batch_operation(operation, req, background_tasks, optimizer) for operation in batch.ops
+    ])
+    return Response(content=b'{"results":[' + b",".join(results) + b"]}", media_type="application/json")
+
+
+# The history endpoints run blocking SQLAlchemy queries, so they are plain functions
+# that FastAPI dispatches to its thread pool instead of running on the event loop
 @router.get("/history")
-async def get_history(
+def get_history(
     limit: int = Query(10, ge=1, le=100),
     offset: int = Query(0, ge=0),
     model: Optional[str] = None,
@@ -140,49 +363,72 @@ async def get_history(
 ):
     """Get the history of optimized prompts"""
     try:
-        # Build query with filters
-        query = db.query(OptimizedPromptDB)
+        # Fetch the page and the total match count in one round-trip via a window function.
+        # Only one character past the preview length is read, which is enough to know it was cut.
+        stmt = select(
+            OptimizedPromptDB.id,
+            func.substr(OptimizedPromptDB.user_prompt, 1, HISTORY_PREVIEW_LENGTH + 1).label("preview"),
+            OptimizedPromptDB.target_model,
+            OptimizedPromptDB.effectiveness_score,
+            OptimizedPromptDB.created_at,
+            func.count().over().label("total"),
+        )
         
         if model:
-            query = query.filter(OptimizedPromptDB.target_model == model)
-            
-        # Get total count for pagination
-        total = query.count()
+            stmt = stmt.where(OptimizedPromptDB.target_model == model)
+        
+        prompts = db.execute(
+            stmt.order_by(OptimizedPromptDB.created_at.desc()).offset(offset).limit(limit)
+        ).all()
         
-        # Get paginated results
-        prompts = query.order_by(OptimizedPromptDB.created_at.desc()).offset(offset).limit(limit).all()
+        if prompts:
+            total = prompts[0].total
+        elif offset == 0:
+            total = 0
+        else:
+            # Offset past the last row: there is no row to carry the window count
+            count_stmt = select(func.count()).select_from(OptimizedPromptDB)
+            if model:
+                count_stmt = count_stmt.where(OptimizedPromptDB.target_model == model)
+            total = db.scalar(count_stmt)
         
         # Format the response
         result = []
-        for prompt in prompts:
+        for prompt_id, preview, target_model, effectiveness_score, created_at, _ in prompts:
             # Truncate long prompts in list view
-            user_prompt_preview = prompt.user_prompt[:100] + "..." if len(prompt.user_prompt) > 100 else prompt.user_prompt
+            if preview and len(preview) > HISTORY_PREVIEW_LENGTH:
+                preview = preview[:HISTORY_PREVIEW_LENGTH] + "..."
             
             result.append({
-                "id": prompt.id,
-                "user_prompt": user_prompt_preview,
-                "target_model": prompt.target_model,
-                "effectiveness_score": prompt.effectiveness_score,
-                "created_at": prompt.created_at
+                "id": prompt_id,
+                "user_prompt": preview,
+                "target_model": target_model,
+                "effectiveness_score": effectiveness_score,
+                "created_at": created_at
             })
             
-        return {
+        return _json_response({
             "total": total,
             "offset": offset,
             "limit": limit,
             "items": result
-        }
+        })
     except Exception as e:
         logger.error(f"Error retrieving history: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to retrieve history: {str(e)}")
 
 
 @router.get("/history/{prompt_id}")
-async def get_prompt_by_id(prompt_id: int, db: Session = Depends(get_db)):
+def get_prompt_by_id(prompt_id: int, db: Session = Depends(get_db)):
     """Get a specific optimized prompt by ID, including all components"""
     try:
-        # Query the specific prompt
-        prompt = db.query(OptimizedPromptDB).filter(OptimizedPromptDB.id == prompt_id).first()
+        # Query the specific prompt, loading its components (ordered by position) up front
+        prompt = (
+            db.query(OptimizedPromptDB)
+            .options(selectinload(OptimizedPromptDB.components))
+            .filter(OptimizedPromptDB.id == prompt_id)
+            .first()
+        )
         
         if not prompt:
             logger.warning(f"Prompt not found: id={prompt_id}")
@@ -198,7 +444,7 @@ async def get_prompt_by_id(prompt_id: int, db: Session = Depends(get_db)):
             })
             
         # Return the complete prompt details
-        return {
+        return _json_response({
             "id": prompt.id,
             "user_prompt": prompt.user_prompt,
             "optimized_prompt": prompt.optimized_prompt,
@@ -206,8 +452,8 @@ async def get_prompt_by_id(prompt_id: int, db: Session = Depends(get_db)):
             "effectiveness_score": prompt.effectiveness_score,
             "rationale": prompt.rationale,
             "created_at": prompt.created_at,
-            "components": sorted(components, key=lambda x: x["position"])
-        }
+            "components": components
+        })
     except HTTPException:
         # Re-raise HTTP exceptions
         raise
@@ -222,5 +468,9 @@ async def health_check():
     return {
         "status": "healthy",
         "version": "0.1.0",
-        "timestamp": datetime.datetime.now().isoformat()
+        "timestamp": datetime.datetime.now(),
+        "cache": {
+            "analyze": {**_cache_stats["analyze"], "size": len(_analysis_responses)},
+            "optimize": {**_cache_stats["optimize"], "size": len(_optimization_responses)},
+        }
     }
@@ -1,21 +1,164 @@
 import clingo
+import itertools
 import logging
-from typing import Dict, List, Tuple, Set, Optional, Any, Union, cast
-from functools import lru_cache
-from app.models.prompt import ComponentType, TaskType, BehaviorType, PromptComponent
-from app.models.database import SessionLocal, ComponentEfficacyDB, PositionEffectDB, ModelEfficacyDB, DomainEfficacyDB
+import os
+import threading
+from typing import Dict, List, Tuple, Set, Optional, Any, Union
+from app.models.prompt import (
+    ComponentType, TaskType, BehaviorType, PromptComponent,
+    COMPONENT_TYPES, TASK_TYPES, BEHAVIOR_TYPES
+)
+from app.models import database
+from app.models.database import ComponentEfficacyDB, PositionEffectDB, ModelDB, ModelEfficacyDB, DomainEfficacyDB
+from sqlalchemy import Integer, String, cast, insert, inspect, literal, null, select, union_all
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 import datetime
+from cachetools import TTLCache
 
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Maximum number of solved structures kept per engine, and how long each stays valid (seconds)
+SOLVE_CACHE_SIZE = 1024
+SOLVE_CACHE_TTL = 3600
 
-class ASPEngine:
-    def __init__(self, load_from_db: bool = True):
-        # ASP program that's compatible with all Clingo versions
-        self.base_program = """
+# Rows fetched per round-trip when loading efficacy tables
+LOAD_BATCH_SIZE = 1000
+
+# Maximum number of concurrent clingo solves, and of idle grounded solvers kept for them
+CLINGO_POOL_SIZE = 4
+
+
+# Dialects whose INSERT supports ON CONFLICT DO UPDATE for efficacy upserts
+_UPSERT_INSERTS = {
+    "sqlite": sqlite_insert,
+    "postgresql": postgresql_insert,
+}
+
+# Unique indexes the efficacy upserts name as their ON CONFLICT targets
+_UPSERT_CONFLICT_TARGETS = {("component_type", "task_type"), ("component_type", "behavior_type")}
+
+# Type strings to enums; rows written by the old Enum columns hold member names, so accept those too
+_COMPONENT_LOOKUP: Dict[str, ComponentType] = {**{m.name: m for m in ComponentType}, **COMPONENT_TYPES}
+_TASK_LOOKUP: Dict[str, TaskType] = {**{m.name: m for m in TaskType}, **TASK_TYPES}
+_BEHAVIOR_LOOKUP: Dict[str, BehaviorType] = {**{m.name: m for m in BehaviorType}, **BEHAVIOR_TYPES}
+
+# Tags identifying which efficacy table a row of the combined load query came from
+_COMPONENT_SOURCE = "component"
+_POSITION_SOURCE = "position"
+_MODEL_SOURCE = "model"
+_DOMAIN_SOURCE = "domain"
+
+
+def _efficacy_tables_query():
+    """Select every efficacy table in one UNION ALL, tagged by source
+    
+    Rows are (source, scope, component_type, task_type, behavior_type, position, value),
+    where scope is the model name or domain and columns a table lacks are NULL.
+    """
+    no_string = cast(null(), String)
+    no_integer = cast(null(), Integer)
+    return union_all(
+        select(
+            literal(_COMPONENT_SOURCE),
+            no_string,
+            ComponentEfficacyDB.component_type,
+            ComponentEfficacyDB.task_type,
+            ComponentEfficacyDB.behavior_type,
+            no_integer,
+            ComponentEfficacyDB.efficacy_value,
+        ),
+        select(
+            literal(_POSITION_SOURCE),
+            no_string,
+            PositionEffectDB.component_type,
+            no_string,
+            no_string,
+            PositionEffectDB.position,
+            PositionEffectDB.effect_value,
+        ),
+        # Join the model name instead of lazy-loading it per row
+        select(
+            literal(_MODEL_SOURCE),
+            ModelDB.name,
+            ModelEfficacyDB.component_type,
+            no_string,
+            ModelEfficacyDB.behavior_type,
+            no_integer,
+            ModelEfficacyDB.efficacy_value,
+        ).join(ModelDB, ModelEfficacyDB.model_id == ModelDB.id),
+        select(
+            literal(_DOMAIN_SOURCE),
+            DomainEfficacyDB.domain,
+            DomainEfficacyDB.component_type,
+            no_string,
+            DomainEfficacyDB.behavior_type,
+            no_integer,
+            DomainEfficacyDB.efficacy_value,
+        ),
+    )
+
+
+class _GroundedProgram:
+    """A grounded clingo solver plus the external atoms it was built with"""
+    __slots__ = ("control", "version", "models", "domains", "best_cost")
+    
+    def __init__(self,
+                 control: clingo.Control,
+                 version: int,
+                 models: Tuple[Tuple[str, clingo.Symbol], ...],
+                 domains: Tuple[Tuple[str, clingo.Symbol], ...],
+                 best_cost: List[int]):
+        self.control = control
+        # Program version the facts were grounded from; efficacy changes don't bump it
+        self.version = version
+        # (name, target external) pairs for every model and domain in the program
+        self.models = models
+        self.domains = domains
+        # Optimization cost of the ranked structure; no model can do better, so the search stops there
+        self.best_cost = best_cost
+
+# Solve with clingo instead of the equivalent Python ranking (useful for validating the ASP program)
+USE_CLINGO = os.getenv("ASP_USE_CLINGO", "false").lower() in ("1", "true", "yes")
+
+# Every way of placing the five components into positions 1-5, in ComponentType order
+_COMPONENT_ORDER: Tuple[ComponentType, ...] = tuple(ComponentType)
+_POSITION_ASSIGNMENTS: List[Tuple[int, ...]] = list(itertools.permutations(range(1, len(_COMPONENT_ORDER) + 1)))
+
+# Placeholder content for each component until real content is generated
+_PLACEHOLDER_CONTENT: Dict[ComponentType, str] = {comp: f"[{comp.value.upper()} CONTENT]" for comp in ComponentType}
+
+# This is our hardcoded "optimal" structure based on best practices
+_FALLBACK_STRUCTURE: Tuple[Tuple[ComponentType, int], ...] = (
+    (ComponentType.INSTRUCTION, 1),
+    (ComponentType.CONTEXT, 2),
+    (ComponentType.EXAMPLE, 3),
+    (ComponentType.CONSTRAINT, 4),
+    (ComponentType.OUTPUT_FORMAT, 5),
+)
+
+# Target externals for every task and behavior, so solves don't rebuild clingo symbols
+_TARGET_TASK_ATOMS: Dict[TaskType, clingo.Symbol] = {
+    task: clingo.Function("target_task", [clingo.Function(task.value)]) for task in TaskType
+}
+_TARGET_BEHAVIOR_ATOMS: Dict[BehaviorType, clingo.Symbol] = {
+    behavior: clingo.Function("target_behavior", [clingo.Function(behavior.value)]) for behavior in BehaviorType
+}
+
+# Effectiveness by (instruction_first, example_after_instruction), as in the ASP program
+_EFFECTIVENESS: Dict[Tuple[bool, bool], int] = {
+    (True, True): 100,
+    (True, False): 80,
+    (False, True): 60,
+    (False, False): 40,
+}
+
+
+# ASP program that's compatible with all Clingo versions
+_BASE_PROGRAM = """
             % Define prompt components
             component(instruction).
             component(context).
@@ -37,11 +180,25 @@ class ASPEngine:
             behavior(conciseness).
             behavior(error_checking).
             
+            % Request targets are flipped per solve instead of being re-grounded
+            #external target_task(T) : task(T).
+            #external target_behavior(B) : behavior(B).
+            #external target_model(M) : model_specific_efficacy(M, _, _, _).
+            #external target_domain(D) : domain_efficacy(D, _, _, _).
+            
+            % Define positions
+            position(1..5).
+            
+            % Position effects and weights come from the efficacy tables and may be empty
+            #defined position_effect/3.
+            #defined weight/2.
+            
             % Each component must be assigned exactly one position (1-5)
-            1 { prompt_position(C, P) : P = 1..5 } 1 :- component(C).
+            1 { prompt_position(C, P) : position(P) } 1 :- component(C).
             
-            % No two components can share the same position
-            :- prompt_position(C1, P), prompt_position(C2, P), C1 != C2.
+            % No two components can share the same position (counted per position, as
+            % rewritten by ngo, instead of grounding every pair of components)
+            :- position(P), 2 { prompt_position(C, P) : component(C) }.
             
             % An example requires an instruction
             :- prompt_position(example, _), not prompt_position(instruction, _).
@@ -65,13 +222,41 @@ class ASPEngine:
             effectiveness(60) :- not instruction_first, example_after_instruction.
             effectiveness(40) :- not instruction_first, not example_after_instruction.
             
-            % Optimize for highest effectiveness
-            #maximize { S : effectiveness(S) }.
+            % Optimize for highest effectiveness, then for the weighted position effects
+            #maximize { S@7 : effectiveness(S) }.
+            #maximize { W * E@6,C,P : prompt_position(C, P), position_effect(C, P, E), weight(position, W) }.
+            
+            % Break remaining ties toward the earliest positions, taking components in this order
+            component_rank(instruction, 5).
+            component_rank(context, 4).
+            component_rank(example, 3).
+            component_rank(constraint, 2).
+            component_rank(output_format, 1).
+            #minimize { P@R,C : prompt_position(C, P), component_rank(C, R) }.
             
             % Show results
             #show prompt_position/2.
             #show effectiveness/1.
         """
+
+
+def _asp_number(value: float) -> int:
+    """Scale a 0-1 value to an integer percentage, since clingo only supports integer terms"""
+    return int(round(value * 100))
+
+
+def _asp_string(value: str) -> str:
+    """Quote a free-form name (e.g. "gpt-4") so it is a valid ASP term"""
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+class ASPEngine:
+    def __init__(self, load_from_db: bool = True, use_clingo: Optional[bool] = None):
+        self.use_clingo = USE_CLINGO if use_clingo is None else use_clingo
+        
+        # Shared by every engine; the program text never changes
+        self.base_program = _BASE_PROGRAM
         
         # Default efficacy values - these would be learned over time
         self.component_efficacy: Dict[Tuple[ComponentType, Union[TaskType, BehaviorType]], float] = {
@@ -132,6 +317,24 @@ class ASPEngine:
             }
         }
         
+        # Guards the efficacy tables, which are shared when the engine is reused across requests
+        self._lock = threading.Lock()
+        
+        # Bounds concurrent clingo solves so at most CLINGO_POOL_SIZE grounded solvers are ever alive
+        self._solver_slots = threading.BoundedSemaphore(CLINGO_POOL_SIZE)
+        
+        # LRU cache of solved structures with expiry, keyed by the program version they were solved with
+        self._solve_cache: "TTLCache[tuple, Tuple[List[PromptComponent], float]]" = TTLCache(
+            maxsize=SOLVE_CACHE_SIZE, ttl=SOLVE_CACHE_TTL
+        )
+        self._program_version = 0
+        
+        # Whether the upsert conflict targets exist; checked on the first write
+        self._conflict_targets_exist: Optional[bool] = None
+        
+        # Render the facts that don't depend on the request once up front
+        self._rebuild_static_facts()
+        
         # Load values from database if requested
         if load_from_db:
             try:
@@ -139,104 +342,149 @@ class ASPEngine:
             except Exception as e:
                 logger.warning(f"Could not load efficacy values from database: {str(e)}")
     
-    @lru_cache(maxsize=32)
-    def generate_asp_facts(self, 
-                          tasks_tuple: Tuple[TaskType, ...], 
-                          behaviors_tuple: Tuple[BehaviorType, ...],
-                          target_model: Optional[str] = None,
-                          domain: Optional[str] = None) -> str:
-        """Generate ASP facts based on the optimization request with LRU caching
-        
-        Note: Converting lists to tuples for hashability in the cache
+    def _rebuild_static_facts(self) -> None:
+        """Render the grounded program facts, which only change when the efficacy tables are reloaded
+        
+        Must be called with the lock held (or before the engine is shared).
         """
-        facts = []
+        self._rebuild_fact_lines()
+        self._rank_assignments()
         
-        # Add target tasks and behaviors
-        for task in tasks_tuple:
-            facts.append(f"target_task({task.value})")
+        # The ASP program carries every model/domain adjustment; the active ones are selected via externals.
+        # No rule reads component efficacies, so they are left out and feedback never invalidates a solver.
+        facts = self._position_lines + self._weight_lines
+        for lines in self._model_lines.values():
+            facts.extend(lines)
+        for lines in self._domain_lines.values():
+            facts.extend(lines)
         
-        for behavior in behaviors_tuple:
-            facts.append(f"target_behavior({behavior.value})")
-            
-        # Add component efficacy facts
-        for (comp, task_or_behavior), efficacy in self.component_efficacy.items():
-            # Handle both task and behavior efficacy
-            if isinstance(task_or_behavior, TaskType):
-                facts.append(f"component_efficacy({comp.value}, {task_or_behavior.value}, {efficacy})")
-            else:  # BehaviorType
-                facts.append(f"component_efficacy({comp.value}, {task_or_behavior.value}, {efficacy})")
+        self._base_plus_static = "\n".join([self.base_program] + facts)
+        
+        # Model/domain externals that the grounded program will declare, built once per program
+        self._external_models = tuple(
+            (model, clingo.Function("target_model", [clingo.String(model)])) for model in self.model_adjustments
+        )
+        self._external_domains = tuple(
+            (domain, clingo.Function("target_domain", [clingo.String(domain)])) for domain in self.domain_adjustments
+        )
         
+        # Grounded programs embed these facts, so idle ones are discarded and rebuilt on demand
+        self._program_version += 1
+        self._idle_controls: List[_GroundedProgram] = []
+    
+    def _rebuild_fact_lines(self) -> None:
+        """Pre-render each group of program facts"""
         # Add position effect facts
-        for (comp, pos), effect in self.position_effects.items():
-            facts.append(f"position_effect({comp.value}, {pos}, {effect})")
+        self._position_lines: List[str] = [
+            f"position_effect({comp.value}, {pos}, {_asp_number(effect)})."
+            for (comp, pos), effect in self.position_effects.items()
+        ]
         
         # Add weight facts
+        self._weight_lines: List[str] = []
         for key, weight in self.weights.items():
-            if isinstance(key, str):
-                facts.append(f"weight({key}, {weight})")
-            else:  # TaskType or BehaviorType
-                facts.append(f"weight({key.value}, {weight})")
-        
-        # Add model-specific adjustments if applicable
-        if target_model and target_model in self.model_adjustments:
-            facts.append(f"target_model({target_model})")
-            for (comp, behavior), efficacy in self.model_adjustments[target_model].items():
-                facts.append(f"model_specific_efficacy({target_model}, {comp.value}, {behavior.value}, {efficacy})")
-        
-        # Add domain-specific adjustments if applicable
-        if domain and domain in self.domain_adjustments:
-            facts.append(f"target_domain({domain})")
-            for (comp, behavior), efficacy in self.domain_adjustments[domain].items():
-                facts.append(f"domain_efficacy({domain}, {comp.value}, {behavior.value}, {efficacy})")
-        
-        return "\n".join(facts)
+            # TaskType/BehaviorType are str enums, so check for them before plain strings
+            if isinstance(key, (TaskType, BehaviorType)):
+                self._weight_lines.append(f"weight({key.value}, {_asp_number(weight)}).")
+            else:
+                self._weight_lines.append(f"weight({key}, {_asp_number(weight)}).")
+        
+        # Add model- and domain-specific adjustments
+        self._model_lines: Dict[str, List[str]] = {}
+        for model, adjustments in self.model_adjustments.items():
+            self._model_lines[model] = [
+                f"model_specific_efficacy({_asp_string(model)}, {comp.value}, {behavior.value}, {_asp_number(efficacy)})."
+                for (comp, behavior), efficacy in adjustments.items()
+            ]
+        
+        self._domain_lines: Dict[str, List[str]] = {}
+        for domain, adjustments in self.domain_adjustments.items():
+            self._domain_lines[domain] = [
+                f"domain_efficacy({_asp_string(domain)}, {comp.value}, {behavior.value}, {_asp_number(efficacy)})."
+                for (comp, behavior), efficacy in adjustments.items()
+            ]
+    
+    def _checkout_control(self) -> _GroundedProgram:
+        """Take an idle grounded solver for the current program, grounding a new one if none is free"""
+        with self._lock:
+            version = self._program_version
+            pooled = None
+            while self._idle_controls:
+                candidate = self._idle_controls.pop()
+                if candidate.version == version:
+                    pooled = candidate
+                    break
+            if pooled is None:
+                program = self._base_plus_static
+                models = self._external_models
+                domains = self._external_domains
+                best_cost = self._best_cost
+        
+        if pooled is None:
+            # Ground outside the lock so other solves can proceed meanwhile
+            control = clingo.Control(["--opt-strategy=usc", "--opt-mode=opt"])
+            control.add("base", [], program)
+            control.ground([("base", [])])
+            pooled = _GroundedProgram(control, version, models, domains, best_cost)
+        return pooled
+    
+    def _checkin_control(self, pooled: _GroundedProgram) -> None:
+        """Return a solver to the pool unless its program is outdated or the pool is full"""
+        with self._lock:
+            if pooled.version == self._program_version and len(self._idle_controls) < CLINGO_POOL_SIZE:
+                self._idle_controls.append(pooled)
+    
+    def _assign_targets(self,
+                        pooled: _GroundedProgram,
+                        target_tasks: List[TaskType],
+                        target_behaviors: List[BehaviorType],
+                        target_model: Optional[str] = None,
+                        domain: Optional[str] = None) -> None:
+        """Switch the target externals on for this request and off for everything else"""
+        control = pooled.control
+        for task, atom in _TARGET_TASK_ATOMS.items():
+            control.assign_external(atom, task in target_tasks)
+        for behavior, atom in _TARGET_BEHAVIOR_ATOMS.items():
+            control.assign_external(atom, behavior in target_behaviors)
+        for model, atom in pooled.models:
+            control.assign_external(atom, model == target_model)
+        for known_domain, atom in pooled.domains:
+            control.assign_external(atom, known_domain == domain)
     
     def solve(self, 
               target_tasks: List[TaskType], 
               target_behaviors: List[BehaviorType],
               target_model: Optional[str] = None,
               domain: Optional[str] = None) -> Tuple[List[PromptComponent], float]:
-        """Run the ASP solver and return optimized prompt components"""
+        """Run the ASP solver and return optimized prompt components, ordered by position"""
+        if not self.use_clingo:
+            # The ranked structure doesn't depend on the request, so no per-request caching is needed
+            return self._solve_with_ranking()
+        
+        solve_key = (
+            # str enums hash like their values, so the members can be used directly
+            frozenset(target_tasks),
+            frozenset(target_behaviors),
+            target_model,
+            domain,
+            self._program_version,
+        )
+        with self._lock:
+            cached = self._solve_cache.get(solve_key)
+        if cached is not None:
+            # Copy components so callers can fill in content without touching the cache
+            cached_components, cached_score = cached
+            return [comp.model_copy() for comp in cached_components], cached_score
+        
         try:
-            # Convert lists to tuples for cache key
-            tasks_tuple = tuple(target_tasks)
-            behaviors_tuple = tuple(target_behaviors)
-            
-            facts = self.generate_asp_facts(tasks_tuple, behaviors_tuple, target_model, domain)
-            full_program = f"{self.base_program}\n{facts}"
-            
-            # Initialize clingo solver with optimization settings
-            control = clingo.Control(["--opt-strategy=usc", "--opt-mode=opt"])
-            control.add("base", [], full_program)
-            control.ground([("base", [])])
-            
-            # Solve and get the best model
-            models = []
-            control.solve(on_model=lambda model: models.append(model.symbols(shown=True)))
-            
-            if not models:
+            result = self._solve_with_clingo(target_tasks, target_behaviors, target_model, domain)
+            if result is None:
                 logger.info("No ASP solution found, falling back to hardcoded approach")
                 return self._fallback_solve(target_tasks, target_behaviors, target_model, domain)
+            components, effectiveness_score = result
             
-            # Get the best model (last one)
-            best_model = models[-1]
-            
-            # Extract prompt components and their positions
-            components = []
-            effectiveness_score = 0.0
-            
-            for atom in best_model:
-                if atom.name == "prompt_position" and len(atom.arguments) == 2:
-                    comp_type = ComponentType(str(atom.arguments[0]))
-                    position = int(str(atom.arguments[1]))
-                    # We'd need content generation here in a real system
-                    placeholder_content = f"[{comp_type.value.upper()} CONTENT]"
-                    components.append(PromptComponent(type=comp_type, content=placeholder_content, position=position))
-                elif atom.name == "effectiveness" and len(atom.arguments) == 1:
-                    effectiveness_score = float(str(atom.arguments[0]))
-            
-            # Sort components by position
-            components.sort(key=lambda x: x.position)
+            with self._lock:
+                self._solve_cache[solve_key] = ([comp.model_copy() for comp in components], effectiveness_score)
             
             return components, effectiveness_score
             
@@ -245,27 +493,111 @@ class ASPEngine:
             logger.error(f"Error in ASP solver: {str(e)}")
             return self._fallback_solve(target_tasks, target_behaviors, target_model, domain)
     
+    def _solve_with_ranking(self) -> Tuple[List[PromptComponent], float]:
+        """Build the components for the precomputed best assignment"""
+        assignment, effectiveness_score = self._ranked_structure
+        components = [
+            PromptComponent(type=comp_type, content=_PLACEHOLDER_CONTENT[comp_type], position=position)
+            for comp_type, position in assignment
+        ]
+        return components, effectiveness_score
+    
+    def _rank_assignments(self) -> None:
+        """Rank every assignment of the five components to the five positions
+        
+        This mirrors the ASP program: the effectiveness score is maximized first, then
+        the weighted position effects (in the same integer percentages), and remaining
+        ties go to the earliest positions in ComponentType order. Task, behavior, model
+        and domain efficacies don't influence the ordering because every component is
+        always placed exactly once, so the result only changes with the position
+        effects and weights.
+        
+        Must be called with the lock held (or before the engine is shared).
+        """
+        position_weight = _asp_number(self.weights.get("position", 0.0))
+        
+        best_key = None
+        best_assignment: Tuple[int, ...] = ()
+        for assignment in _POSITION_ASSIGNMENTS:
+            positions = dict(zip(_COMPONENT_ORDER, assignment))
+            instruction_first = positions[ComponentType.INSTRUCTION] == 1
+            example_after_instruction = positions[ComponentType.EXAMPLE] > positions[ComponentType.INSTRUCTION]
+            effectiveness = _EFFECTIVENESS[(instruction_first, example_after_instruction)]
+            position_score = sum(
+                position_weight * _asp_number(self.position_effects.get((comp, pos), 0.0))
+                for comp, pos in positions.items()
+            )
+            # Assignments come in lexicographic order, so strict comparison keeps the earliest positions among ties
+            key = (effectiveness, position_score)
+            if best_key is None or key > best_key:
+                best_key = key
+                best_assignment = assignment
+        
+        ordered = sorted(zip(_COMPONENT_ORDER, best_assignment), key=lambda item: item[1])
+        self._ranked_structure: Tuple[Tuple[Tuple[ComponentType, int], ...], float] = (
+            tuple(ordered), float(best_key[0])
+        )
+        # clingo minimizes, reporting maximized sums negated, one entry per priority level
+        self._best_cost: List[int] = [-best_key[0], -best_key[1], *best_assignment]
+    
+    def _solve_with_clingo(self,
+                           target_tasks: List[TaskType],
+                           target_behaviors: List[BehaviorType],
+                           target_model: Optional[str] = None,
+                           domain: Optional[str] = None) -> Optional[Tuple[List[PromptComponent], float]]:
+        """Solve with the grounded ASP program, returning None if there is no model"""
+        # Optimization reports improving models, so only the last one needs to be kept
+        best_model = None
+        
+        def on_model(model: clingo.Model) -> bool:
+            nonlocal best_model
+            best_model = model.symbols(shown=True)
+            # Returning False ends the search without proving optimality
+            return model.cost != pooled.best_cost
+        
+        # Each solver is used by one request at a time; one that raises is not returned to the pool.
+        # Waiting for a slot keeps requests on already-grounded solvers instead of grounding more.
+        with self._solver_slots:
+            pooled = self._checkout_control()
+            self._assign_targets(pooled, target_tasks, target_behaviors, target_model, domain)
+            pooled.control.solve(on_model=on_model)
+            self._checkin_control(pooled)
+        
+        if best_model is None:
+            return None
+        
+        # Extract prompt components and their positions
+        components = []
+        effectiveness_score = 0.0
+        
+        for atom in best_model:
+            # Read constants and numbers through clingo's typed accessors rather than str() round-trips
+            if atom.name == "prompt_position" and len(atom.arguments) == 2:
+                comp_type = COMPONENT_TYPES[atom.arguments[0].name]
+                position = atom.arguments[1].number
+                # We'd need content generation here in a real system
+                components.append(PromptComponent(type=comp_type, content=_PLACEHOLDER_CONTENT[comp_type], position=position))
+            elif atom.name == "effectiveness" and len(atom.arguments) == 1:
+                effectiveness_score = float(atom.arguments[0].number)
+        
+        # Sort components by position
+        components.sort(key=lambda x: x.position)
+        
+        return components, effectiveness_score
+    
     def _fallback_solve(self, 
                       target_tasks: List[TaskType], 
                       target_behaviors: List[BehaviorType],
                       target_model: Optional[str] = None,
                       domain: Optional[str] = None) -> Tuple[List[PromptComponent], float]:
         """Fallback method that returns a hardcoded optimal prompt structure"""
-        # This is our hardcoded "optimal" structure based on best practices
-        hardcoded_structure = [
-            (ComponentType.INSTRUCTION, 1),
-            (ComponentType.CONTEXT, 2),
-            (ComponentType.EXAMPLE, 3),
-            (ComponentType.CONSTRAINT, 4),
-            (ComponentType.OUTPUT_FORMAT, 5)
+        # Callers fill in content, so each call gets new components; with pydantic 2
+        # constructing them is cheaper than copying prebuilt ones
+        components = [
+            PromptComponent(type=comp_type, content=_PLACEHOLDER_CONTENT[comp_type], position=position)
+            for comp_type, position in _FALLBACK_STRUCTURE
         ]
         
-        # Generate placeholder components
-        components = []
-        for comp_type, position in hardcoded_structure:
-            placeholder_content = f"[{comp_type.value.upper()} CONTENT]"
-            components.append(PromptComponent(type=comp_type, content=placeholder_content, position=position))
-        
         # Always return the same hardcoded effectiveness score
         effectiveness_score = 100.0
         
@@ -273,109 +605,152 @@ class ASPEngine:
 
     def update_efficacy(self, component: ComponentType, task_or_behavior: Union[TaskType, BehaviorType], new_value: float) -> None:
         """Update the efficacy values based on feedback (learning)"""
-        # Update in-memory cache
-        self.component_efficacy[(component, task_or_behavior)] = new_value
+        self.bulk_update_efficacy([(component, task_or_behavior, new_value)])
+    
+    def bulk_update_efficacy(self, items: List[Tuple[ComponentType, Union[TaskType, BehaviorType], float]]) -> None:
+        """Apply several efficacy updates in memory and persist them in a single transaction"""
+        self.apply_efficacy(items)
+        self.persist_efficacy(items)
+    
+    def apply_efficacy(self, items: List[Tuple[ComponentType, Union[TaskType, BehaviorType], float]]) -> None:
+        """Apply efficacy updates to the in-memory tables only"""
+        if not items:
+            return
         
-        # Clear the facts cache to regenerate with new values
-        self.generate_asp_facts.cache_clear()
+        # The program doesn't read component efficacies, so grounded solvers and cached solves stay valid
+        with self._lock:
+            for component, task_or_behavior, new_value in items:
+                self.component_efficacy[(component, task_or_behavior)] = new_value
+    
+    def persist_efficacy(self, items: List[Tuple[ComponentType, Union[TaskType, BehaviorType], float]]) -> None:
+        """Write efficacy updates to the database in a single transaction"""
+        if not items:
+            return
         
-        # Update in database
-        db = SessionLocal()
-        try:
+        # Update in database; begin() commits on success and rolls back on error
+        with database.SessionLocal.begin() as db:
+            upsert_insert = self._upsert_insert_for(db)
+            if upsert_insert is not None:
+                self._upsert_efficacy(db, upsert_insert, items)
+            else:
+                self._lookup_and_write_efficacy(db, items)
+    
+    def _upsert_insert_for(self, db: Session) -> Optional[Any]:
+        """Return the dialect's ON CONFLICT insert, or None if the dialect or the table can't support it"""
+        upsert_insert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+        if upsert_insert is None:
+            return None
+        
+        if self._conflict_targets_exist is None:
+            # Tables created before the unique indexes were added lack the conflict targets
+            indexes = inspect(db.connection()).get_indexes(ComponentEfficacyDB.__tablename__)
+            unique_columns = {tuple(index["column_names"]) for index in indexes if index["unique"]}
+            self._conflict_targets_exist = _UPSERT_CONFLICT_TARGETS <= unique_columns
+            if not self._conflict_targets_exist:
+                logger.warning("Efficacy unique indexes are missing; writing efficacy with lookups instead of upserts")
+        return upsert_insert if self._conflict_targets_exist else None
+    
+    def _upsert_efficacy(self,
+                         db: Session,
+                         upsert_insert: Any,
+                         items: List[Tuple[ComponentType, Union[TaskType, BehaviorType], float]]) -> None:
+        """Write efficacy rows with INSERT ... ON CONFLICT, one statement per task/behavior kind"""
+        # Keyed so a repeated update in the batch keeps only its latest value
+        task_rows: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        behavior_rows: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for component, task_or_behavior, new_value in items:
+            if isinstance(task_or_behavior, TaskType):
+                task_rows[(component.value, task_or_behavior.value)] = {
+                    "component_type": component.value,
+                    "task_type": task_or_behavior.value,
+                    "efficacy_value": new_value,
+                }
+            else:
+                behavior_rows[(component.value, task_or_behavior.value)] = {
+                    "component_type": component.value,
+                    "behavior_type": task_or_behavior.value,
+                    "efficacy_value": new_value,
+                }
+        
+        for conflict_columns, rows in ((["component_type", "task_type"], task_rows),
+                                       (["component_type", "behavior_type"], behavior_rows)):
+            if not rows:
+                continue
+            stmt = upsert_insert(ComponentEfficacyDB)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=conflict_columns,
+                set_={"efficacy_value": stmt.excluded.efficacy_value},
+            )
+            db.execute(stmt, list(rows.values()))
+    
+    def _lookup_and_write_efficacy(self,
+                                   db: Session,
+                                   items: List[Tuple[ComponentType, Union[TaskType, BehaviorType], float]]) -> None:
+        """Write efficacy rows on databases without ON CONFLICT support"""
+        # Fetch every existing row for the affected components in one query
+        component_values = {component.value for component, _, _ in items}
+        existing_rows = db.execute(
+            select(ComponentEfficacyDB).where(ComponentEfficacyDB.component_type.in_(component_values))
+        ).scalars().all()
+        existing = {
+            (row.component_type, row.task_type, row.behavior_type): row
+            for row in existing_rows
+        }
+        
+        new_rows: Dict[Tuple[str, Optional[str], Optional[str]], Dict[str, Any]] = {}
+        for component, task_or_behavior, new_value in items:
             # Determine if this is a task or behavior type
-            is_task = isinstance(task_or_behavior, TaskType)
-            
-            # Look for existing record
-            if is_task:
-                task_value = cast(TaskType, task_or_behavior).value
-                db_efficacy = db.query(ComponentEfficacyDB).filter(
-                    ComponentEfficacyDB.component_type == component.value,
-                    ComponentEfficacyDB.task_type == task_value
-                ).first()
+            if isinstance(task_or_behavior, TaskType):
+                key = (component.value, task_or_behavior.value, None)
             else:
-                behavior_value = cast(BehaviorType, task_or_behavior).value
-                db_efficacy = db.query(ComponentEfficacyDB).filter(
-                    ComponentEfficacyDB.component_type == component.value,
-                    ComponentEfficacyDB.behavior_type == behavior_value
-                ).first()
+                key = (component.value, None, task_or_behavior.value)
             
             # Create or update record
-            if db_efficacy:
+            db_efficacy = existing.get(key)
+            if db_efficacy is not None:
                 db_efficacy.efficacy_value = new_value
             else:
-                if is_task:
-                    task_value = cast(TaskType, task_or_behavior).value
-                    db_efficacy = ComponentEfficacyDB(
-                        component_type=component.value,
-                        task_type=task_value,
-                        efficacy_value=new_value
-                    )
-                else:
-                    behavior_value = cast(BehaviorType, task_or_behavior).value
-                    db_efficacy = ComponentEfficacyDB(
-                        component_type=component.value,
-                        behavior_type=behavior_value,
-                        efficacy_value=new_value
-                    )
-                db.add(db_efficacy)
-            
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            raise e
-        finally:
-            db.close()
-            
+                new_rows[key] = {
+                    "component_type": key[0],
+                    "task_type": key[1],
+                    "behavior_type": key[2],
+                    "efficacy_value": new_value,
+                }
+        
+        if new_rows:
+            db.execute(insert(ComponentEfficacyDB), list(new_rows.values()))
+    
     def load_efficacy_from_db(self) -> None:
         """Load efficacy values from the database"""
-        db = SessionLocal()
-        try:
-            # Load component efficacy values
-            db_efficacies = db.query(ComponentEfficacyDB).all()
-            for efficacy in db_efficacies:
-                if efficacy.task_type:
-                    self.component_efficacy[(
-                        ComponentType(efficacy.component_type), 
-                        TaskType(efficacy.task_type)
-                    )] = efficacy.efficacy_value
-                elif efficacy.behavior_type:
-                    self.component_efficacy[(
-                        ComponentType(efficacy.component_type), 
-                        BehaviorType(efficacy.behavior_type)
-                    )] = efficacy.efficacy_value
-            
-            # Load position effects
-            db_positions = db.query(PositionEffectDB).all()
-            for position in db_positions:
-                self.position_effects[(
-                    ComponentType(position.component_type), 
-                    position.position
-                )] = position.effect_value
-            
-            # Load model adjustments
-            model_efficacies = db.query(ModelEfficacyDB).all()
-            for model_efficacy in model_efficacies:
-                model_name = model_efficacy.model.name
-                if model_name not in self.model_adjustments:
-                    self.model_adjustments[model_name] = {}
-                
-                self.model_adjustments[model_name][(
-                    ComponentType(model_efficacy.component_type),
-                    BehaviorType(model_efficacy.behavior_type)
-                )] = model_efficacy.efficacy_value
+        component_efficacy: Dict[Tuple[ComponentType, Union[TaskType, BehaviorType]], float] = {}
+        position_effects: Dict[Tuple[ComponentType, int], float] = {}
+        model_adjustments: Dict[str, Dict[Tuple[ComponentType, BehaviorType], float]] = {}
+        domain_adjustments: Dict[str, Dict[Tuple[ComponentType, BehaviorType], float]] = {}
+        
+        # Read plain column tuples instead of hydrating ORM objects
+        with database.SessionLocal() as db:
+            rows = db.execute(_efficacy_tables_query().execution_options(yield_per=LOAD_BATCH_SIZE))
+            for source, scope, component_type, task_type, behavior_type, position, value in rows:
+                component = _COMPONENT_LOOKUP[component_type]
+                if source == _COMPONENT_SOURCE:
+                    if task_type:
+                        component_efficacy[(component, _TASK_LOOKUP[task_type])] = value
+                    elif behavior_type:
+                        component_efficacy[(component, _BEHAVIOR_LOOKUP[behavior_type])] = value
+                elif source == _POSITION_SOURCE:
+                    position_effects[(component, position)] = value
+                elif source == _MODEL_SOURCE:
+                    model_adjustments.setdefault(scope, {})[(component, _BEHAVIOR_LOOKUP[behavior_type])] = value
+                else:
+                    domain_adjustments.setdefault(scope, {})[(component, _BEHAVIOR_LOOKUP[behavior_type])] = value
+        
+        with self._lock:
+            self.component_efficacy.update(component_efficacy)
+            self.position_effects.update(position_effects)
+            for model_name, adjustments in model_adjustments.items():
+                self.model_adjustments.setdefault(model_name, {}).update(adjustments)
+            for domain, adjustments in domain_adjustments.items():
+                self.domain_adjustments.setdefault(domain, {}).update(adjustments)
             
-            # Load domain adjustments
-            domain_efficacies = db.query(DomainEfficacyDB).all()
-            for domain_efficacy in domain_efficacies:
-                domain = domain_efficacy.domain
-                if domain not in self.domain_adjustments:
-                    self.domain_adjustments[domain] = {}
-                
-                self.domain_adjustments[domain][(
-                    ComponentType(domain_efficacy.component_type),
-                    BehaviorType(domain_efficacy.behavior_type)
-                )] = domain_efficacy.efficacy_value
-        except Exception as e:
-            raise e
-        finally:
-            db.close()
\ No newline at end of file
+            self._rebuild_static_facts()
+            self._solve_cache.clear()
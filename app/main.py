@@ -2,12 +2,25 @@ from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from app.api import optimizer
+from app.models.database import init_db
+from app.services.meta_llm import DEFAULT_LLM_MODEL
 import os
+import atexit
 import logging
 import logging.config
+import queue
 import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from contextlib import asynccontextmanager, suppress
+import asyncio
+import anyio.to_thread
+import orjson
+from typing import Any, List
 from dotenv import load_dotenv
 
+# Worker threads available for blocking optimizer calls (clingo solves, LLM requests)
+THREAD_POOL_SIZE = 64
+
 # Configure logging
 logging_config = {
     "version": 1,
@@ -31,7 +44,8 @@ logging_config = {
             "filename": "inferprompt.log",
             "maxBytes": 10485760,  # 10MB
             "backupCount": 5,
-            "encoding": "utf8"
+            "encoding": "utf8",
+            "delay": True  # Open the file on the first record rather than at import
         }
     },
     "loggers": {
@@ -55,15 +69,93 @@ logging_config = {
 
 # Setup logging
 logging.config.dictConfig(logging_config)
+
+
+def _queue_file_logging() -> QueueListener:
+    """Move the log file handler behind a queue drained by a background thread
+    
+    Handlers attached to several loggers are shared instances, so each file handler
+    is wrapped once and requests only pay for an in-memory put.
+    """
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    file_handlers: List[logging.Handler] = []
+    for name in ("", "app", "uvicorn"):
+        target = logging.getLogger(name)
+        for handler in list(target.handlers):
+            if isinstance(handler, RotatingFileHandler):
+                target.removeHandler(handler)
+                if handler not in file_handlers:
+                    file_handlers.append(handler)
+                if queue_handler not in target.handlers:
+                    target.addHandler(queue_handler)
+    
+    listener = QueueListener(log_queue, *file_handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+log_listener = _queue_file_logging()
+# Stopping the listener flushes any queued records to the log file
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson, which is much faster than the stdlib encoder"""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create database tables and log server start up and shut down"""
+    # Runs once per worker process instead of on every import of the API module
+    init_db()
+    
+    # Allow more blocking optimizer calls to run in parallel than anyio's default of 40
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREAD_POOL_SIZE
+    
+    # Build the shared optimizer (loads efficacy tables) before the first request needs it
+    shared_optimizer = await anyio.to_thread.run_sync(optimizer.get_optimizer_instance)
+    
+    # Write feedback to the database in batches instead of once per request
+    flush_task = asyncio.create_task(optimizer.flush_feedback_periodically(shared_optimizer))
+    
+    logger.info("==================================================")
+    logger.info("InferPrompt API server starting up")
+    logger.info(f"Environment: {os.getenv('ENVIRONMENT', 'development')}")
+    logger.info(f"Using OpenAI API: {bool(os.getenv('OPENAI_API_KEY'))}")
+    logger.info(f"Default LLM model: {os.getenv('LLM_MODEL', DEFAULT_LLM_MODEL)}")
+    logger.info("==================================================")
+    
+    yield
+    
+    logger.info("InferPrompt API server shutting down")
+    flush_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await flush_task
+    
+    # Save feedback received since the last flush
+    try:
+        await anyio.to_thread.run_sync(shared_optimizer.flush_feedback)
+    except Exception as e:
+        logger.error(f"Failed to save pending feedback on shutdown: {str(e)}")
+    
+    # Release the LLM clients' keep-alive connections
+    await shared_optimizer.meta_llm.close()
+
+
 app = FastAPI(
     title="InferPrompt API",
     description="ASP-based LLM prompt optimization framework",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -78,18 +170,18 @@ app.add_middleware(
 # Performance monitoring middleware
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
+    start_time = time.perf_counter()
     try:
         response = await call_next(request)
-        process_time = time.time() - start_time
+        process_time = time.perf_counter() - start_time
         response.headers["X-Process-Time"] = str(process_time)
-        # Log request details for non-static resources
-        if not request.url.path.startswith(("/static/", "/docs", "/redoc", "/openapi.json")):
-            logger.info(f"Request: {request.method} {request.url.path} - Completed in {process_time:.3f}s - Status: {response.status_code}")
+        # Log request details for non-static resources; skip the work entirely when INFO is filtered out
+        if logger.isEnabledFor(logging.INFO) and not request.url.path.startswith(("/static/", "/docs", "/redoc", "/openapi.json")):
+            logger.info("Request: %s %s - Completed in %.3fs - Status: %s", request.method, request.url.path, process_time, response.status_code)
         return response
     except Exception as e:
-        logger.error(f"Error processing request {request.method} {request.url.path}: {str(e)}")
-        process_time = time.time() - start_time
+        logger.error("Error processing request %s %s: %s", request.method, request.url.path, e)
+        process_time = time.perf_counter() - start_time
         return JSONResponse(
             status_code=500,
             content={"detail": "Internal server error"},
@@ -110,23 +202,6 @@ async def root():
     }
 
 
-@app.on_event("startup")
-async def startup_event():
-    """Log when the server starts up"""
-    logger.info("==================================================")
-    logger.info("InferPrompt API server starting up")
-    logger.info(f"Environment: {os.getenv('ENVIRONMENT', 'development')}")
-    logger.info(f"Using OpenAI API: {bool(os.getenv('OPENAI_API_KEY'))}")
-    logger.info(f"Default LLM model: {os.getenv('LLM_MODEL', 'gpt-3.5-turbo')}")
-    logger.info("==================================================")
-
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Log when the server shuts down"""
-    logger.info("InferPrompt API server shutting down")
-
-
 if __name__ == "__main__":
     import uvicorn
     # Use environment variables or default values
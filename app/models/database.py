@@ -1,14 +1,58 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Enum, ForeignKey, Text
+from sqlalchemy import create_engine, event, case, update, CheckConstraint, Column, Integer, String, Float, ForeignKey, Text, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+import logging
 import os
 from enum import Enum as PyEnum
 
+# Configure logging
+logger = logging.getLogger(__name__)
+
 # Get database URL from environment or use SQLite by default
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./inferprompt.db")
 
+# Connection pool settings; sized for the API's worker thread pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "25"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "25"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds
+
+# Applied to every new SQLite connection: WAL lets reads proceed during feedback writes,
+# and synchronous=NORMAL is durable under WAL without an fsync per commit
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",  # 64 MiB
+    "PRAGMA mmap_size=268435456",  # 256 MiB
+)
+
+
+def _engine_options(url: str) -> dict:
+    """Build create_engine keyword arguments suited to the database URL"""
+    options = {"pool_pre_ping": True, "pool_recycle": DB_POOL_RECYCLE}
+    if url.startswith("sqlite"):
+        options["connect_args"] = {"check_same_thread": False}
+    # In-memory SQLite uses a per-thread pool that has no size limits
+    if ":memory:" not in url:
+        options["pool_size"] = DB_POOL_SIZE
+        options["max_overflow"] = DB_MAX_OVERFLOW
+    return options
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Tune a freshly opened SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
 # Create SQLAlchemy engine and session
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+if DATABASE_URL.startswith("sqlite"):
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Create base class for declarative models
@@ -17,11 +61,19 @@ Base = declarative_base()
 
 # Database dependency injection
 def get_db():
-    db = SessionLocal()
-    try:
+    # The context manager closes the session even if the request handler raises
+    with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+# Type columns are plain strings holding the enum values, so loading rows needs no Enum conversion
+ENUM_COLUMN_LENGTH = 32
+
+
+def _enum_check(table: str, column: str, enum_class: type) -> CheckConstraint:
+    """Restrict a string column to the values of an enum"""
+    values = ", ".join(f"'{member.value}'" for member in enum_class)
+    return CheckConstraint(f"{column} IN ({values})", name=f"ck_{table}_{column}")
 
 
 # Model definitions
@@ -62,22 +114,34 @@ class ComponentEfficacyDB(Base):
     __tablename__ = "component_efficacy"
     
     id = Column(Integer, primary_key=True, index=True)
-    component_type = Column(Enum(ComponentTypeEnum), index=True)
-    task_type = Column(Enum(TaskTypeEnum), nullable=True, index=True)
-    behavior_type = Column(Enum(BehaviorTypeEnum), nullable=True, index=True)
+    component_type = Column(String(ENUM_COLUMN_LENGTH), index=True)
+    task_type = Column(String(ENUM_COLUMN_LENGTH), nullable=True, index=True)
+    behavior_type = Column(String(ENUM_COLUMN_LENGTH), nullable=True, index=True)
     efficacy_value = Column(Float, default=0.5)
     
     # Ensure either task_type or behavior_type is set, but not both
     # This would be handled in application logic
+    __table_args__ = (
+        # Conflict targets for efficacy upserts; NULLs never collide, so each index only covers its own kind
+        Index("uq_component_efficacy_component_task", "component_type", "task_type", unique=True),
+        Index("uq_component_efficacy_component_behavior", "component_type", "behavior_type", unique=True),
+        _enum_check("component_efficacy", "component_type", ComponentTypeEnum),
+        _enum_check("component_efficacy", "task_type", TaskTypeEnum),
+        _enum_check("component_efficacy", "behavior_type", BehaviorTypeEnum),
+    )
 
 
 class PositionEffectDB(Base):
     __tablename__ = "position_effects"
     
     id = Column(Integer, primary_key=True, index=True)
-    component_type = Column(Enum(ComponentTypeEnum), index=True)
+    component_type = Column(String(ENUM_COLUMN_LENGTH), index=True)
     position = Column(Integer)
     effect_value = Column(Float, default=0.5)
+    
+    __table_args__ = (
+        _enum_check("position_effects", "component_type", ComponentTypeEnum),
+    )
 
 
 class ModelEfficacyDB(Base):
@@ -85,11 +149,17 @@ class ModelEfficacyDB(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     model_id = Column(Integer, ForeignKey("models.id"))
-    component_type = Column(Enum(ComponentTypeEnum), index=True)
-    behavior_type = Column(Enum(BehaviorTypeEnum), index=True)
+    component_type = Column(String(ENUM_COLUMN_LENGTH), index=True)
+    behavior_type = Column(String(ENUM_COLUMN_LENGTH), index=True)
     efficacy_value = Column(Float, default=0.5)
     
-    model = relationship("ModelDB", back_populates="efficacy_values")
+    # Joined eagerly so reading efficacy rows never issues a query per model
+    model = relationship("ModelDB", back_populates="efficacy_values", lazy="joined")
+    
+    __table_args__ = (
+        _enum_check("model_efficacy", "component_type", ComponentTypeEnum),
+        _enum_check("model_efficacy", "behavior_type", BehaviorTypeEnum),
+    )
 
 
 class DomainEfficacyDB(Base):
@@ -97,9 +167,14 @@ class DomainEfficacyDB(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     domain = Column(String, index=True)
-    component_type = Column(Enum(ComponentTypeEnum), index=True)
-    behavior_type = Column(Enum(BehaviorTypeEnum), index=True)
+    component_type = Column(String(ENUM_COLUMN_LENGTH), index=True)
+    behavior_type = Column(String(ENUM_COLUMN_LENGTH), index=True)
     efficacy_value = Column(Float, default=0.5)
+    
+    __table_args__ = (
+        _enum_check("domain_efficacy", "component_type", ComponentTypeEnum),
+        _enum_check("domain_efficacy", "behavior_type", BehaviorTypeEnum),
+    )
 
 
 class OptimizedPromptDB(Base):
@@ -113,7 +188,12 @@ class OptimizedPromptDB(Base):
     rationale = Column(Text, nullable=True)
     created_at = Column(String)  # Store ISO timestamp
     
-    components = relationship("PromptComponentDB", back_populates="prompt")
+    components = relationship("PromptComponentDB", back_populates="prompt", order_by="PromptComponentDB.position")
+    
+    # Serves the /history listing: optional model filter, newest first
+    __table_args__ = (
+        Index("ix_optimized_prompts_target_model_created_at", "target_model", created_at.desc()),
+    )
 
 
 class PromptComponentDB(Base):
@@ -121,8 +201,64 @@ class PromptComponentDB(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     prompt_id = Column(Integer, ForeignKey("optimized_prompts.id"))
-    component_type = Column(Enum(ComponentTypeEnum))
+    component_type = Column(String(ENUM_COLUMN_LENGTH))
     content = Column(Text)
     position = Column(Integer)
     
     prompt = relationship("OptimizedPromptDB", back_populates="components")
+    
+    __table_args__ = (
+        _enum_check("prompt_components", "component_type", ComponentTypeEnum),
+    )
+
+
+# Every type column and the enum whose values it holds
+_ENUM_COLUMNS = (
+    (ComponentEfficacyDB.component_type, ComponentTypeEnum),
+    (ComponentEfficacyDB.task_type, TaskTypeEnum),
+    (ComponentEfficacyDB.behavior_type, BehaviorTypeEnum),
+    (PositionEffectDB.component_type, ComponentTypeEnum),
+    (ModelEfficacyDB.component_type, ComponentTypeEnum),
+    (ModelEfficacyDB.behavior_type, BehaviorTypeEnum),
+    (DomainEfficacyDB.component_type, ComponentTypeEnum),
+    (DomainEfficacyDB.behavior_type, BehaviorTypeEnum),
+    (PromptComponentDB.component_type, ComponentTypeEnum),
+)
+
+
+def migrate_enum_names(bind) -> int:
+    """Rewrite type columns still holding enum member names to the enum values
+    
+    The type columns used to be SQLAlchemy Enum columns, which store member names
+    (e.g. "INSTRUCTION"). Returns the number of rows updated.
+    """
+    updated = 0
+    with bind.begin() as conn:
+        for column, enum_class in _ENUM_COLUMNS:
+            names = {member.name: member.value for member in enum_class}
+            stmt = (
+                update(column.table)
+                .where(column.in_(list(names)))
+                .values({column.key: case(names, value=column)})
+            )
+            updated += conn.execute(stmt).rowcount
+    return updated
+
+
+def init_db(bind=None) -> None:
+    """Create missing tables and indexes and bring rows written by older schemas up to date"""
+    bind = bind if bind is not None else engine
+    Base.metadata.create_all(bind=bind)
+    
+    # create_all skips tables that already exist, so indexes added since are created one by one
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind, checkfirst=True)
+            except Exception as e:
+                # e.g. duplicate rows blocking a unique index; efficacy writes fall back to lookups
+                logger.error(f"Could not create index {index.name}: {str(e)}")
+    
+    migrated = migrate_enum_names(bind)
+    if migrated:
+        logger.info(f"Migrated {migrated} rows from enum names to enum values")
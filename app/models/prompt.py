@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import List, Dict, Optional, Union, Any
+from typing import List, Dict, Literal, Optional, Union, Any
 from pydantic import BaseModel, Field
 
 
@@ -27,6 +27,17 @@ class BehaviorType(str, Enum):
     ERROR_CHECKING = "error_checking"
 
 
+# Value -> member lookups, cheaper than calling the Enum class in hot paths
+COMPONENT_TYPES: Dict[str, ComponentType] = {member.value: member for member in ComponentType}
+TASK_TYPES: Dict[str, TaskType] = {member.value: member for member in TaskType}
+BEHAVIOR_TYPES: Dict[str, BehaviorType] = {member.value: member for member in BehaviorType}
+
+# Member -> value lookups; indexing these is several times faster than the Enum .value property
+COMPONENT_VALUES: Dict[ComponentType, str] = {member: member.value for member in ComponentType}
+TASK_VALUES: Dict[TaskType, str] = {member: member.value for member in TaskType}
+BEHAVIOR_VALUES: Dict[BehaviorType, str] = {member: member.value for member in BehaviorType}
+
+
 class OptimizationRequest(BaseModel):
     user_prompt: str = Field(..., description="The original user prompt")
     target_tasks: List[TaskType] = Field(default=[], description="Target reasoning tasks")
@@ -46,3 +57,16 @@ class OptimizedPrompt(BaseModel):
     full_prompt: str = Field(..., description="Assembled prompt text")
     rationale: str = Field(..., description="Explanation of optimization choices")
     effectiveness_score: float = Field(..., description="Predicted effectiveness score")
+
+
+# Maximum number of operations accepted in one batch request
+BATCH_MAX_OPS = 16
+
+
+class BatchOperation(BaseModel):
+    op: Literal["optimize", "analyze", "feedback"] = Field(..., description="Endpoint to run")
+    body: Dict[str, Any] = Field(default={}, description="Request body for that endpoint")
+
+
+class BatchRequest(BaseModel):
+    ops: List[BatchOperation] = Field(..., min_length=1, max_length=BATCH_MAX_OPS, description="Operations to run")
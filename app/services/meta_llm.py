@@ -1,14 +1,25 @@
-from typing import List, Dict, Any, Optional, cast
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple, cast
 import logging
 import os
-import json
-from openai import OpenAI, OpenAIError
-from app.models.prompt import TaskType, BehaviorType, OptimizationRequest, PromptComponent, OptimizedPrompt
+import orjson
+import hashlib
+import threading
+import time
+import anyio
+import openai
+from cachetools import TTLCache
+from app.services.semantic_cache import SemanticCache
+from app.services.rate_limiter import RateLimiter
+from app.models.prompt import (
+    TaskType, BehaviorType, OptimizationRequest, PromptComponent, OptimizedPrompt,
+    COMPONENT_VALUES, TASK_VALUES, BEHAVIOR_VALUES
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Define system prompts for each task
+# Define system prompts for each task. These are sent verbatim as the first message so the
+# provider can reuse its cached prefix; request-specific data only goes in the user message.
 ANALYSIS_PROMPT = """Analyze the following user prompt to identify:
 1. The primary reasoning tasks required (deduction, induction, abduction, comparison, counterfactual)
 2. The desired output behaviors (precision, creativity, step_by_step, conciseness, error_checking)
@@ -34,22 +45,130 @@ These should include limitations, rules, or guidelines that shape the response."
 This should detail how the response should be organized, what sections to include, etc."""
 }
 
+DEFAULT_LLM_MODEL = "gpt-4o-mini"
+
+# Per-attempt timeout in seconds. The clients retry connection errors, timeouts, 429s and 5xx
+# responses with exponential backoff and jitter before a call falls back to the defaults.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "15"))
+LLM_MAX_RETRIES = 2
+
+# Output token budgets; decode time grows with output length, so these bound tail latency
+ANALYSIS_MAX_TOKENS = 128
+COMPONENT_MAX_TOKENS = 256
+RATIONALE_MAX_TOKENS = 256
+
+# Structured output schema for the task analysis, so the response always parses
+ANALYSIS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "task_analysis",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "reasoning_tasks": {
+                    "type": "array",
+                    "items": {"type": "string", "enum": [t.value for t in TaskType]},
+                },
+                "output_behaviors": {
+                    "type": "array",
+                    "items": {"type": "string", "enum": [b.value for b in BehaviorType]},
+                },
+                "domain": {"type": ["string", "null"]},
+            },
+            "required": ["reasoning_tasks", "output_behaviors", "domain"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# Models that predate structured outputs and only support JSON mode
+LEGACY_JSON_MODE_MODELS = ("gpt-3.5", "gpt-4-")
+
+# Sampling temperatures. Component contents are generated in one call that always includes the
+# example, so they stay warm for variety; rationales are deterministic and served from the chat cache.
+COMPONENT_TEMPERATURE = 0.7
+RATIONALE_TEMPERATURE = 0.0
+
+# One spec covering every component type, sent as the system message of every component generation call
+COMPONENT_SPEC_PROMPT = """Generate content for components of a prompt.
+The component types are specified below:
+
+""" + "\n\n".join(
+    f"{number}. {component_type}: {instructions}"
+    for number, (component_type, instructions) in enumerate(COMPONENT_GENERATION_PROMPTS.items(), start=1)
+)
+
 RATIONALE_PROMPT = """Explain why the chosen prompt structure is optimal for the given task.
 Reference the specific reasoning tasks, behaviors, and domain context.
 Explain how each component contributes to the overall effectiveness."""
 
+# System messages are identical for every request, so each call reuses the same dict
+_ANALYSIS_SYSTEM_MESSAGE = {"role": "system", "content": ANALYSIS_PROMPT}
+_COMPONENT_SYSTEM_MESSAGE = {"role": "system", "content": COMPONENT_SPEC_PROMPT}
+_RATIONALE_SYSTEM_MESSAGE = {"role": "system", "content": RATIONALE_PROMPT}
+
+
+# Exact-match cache of chat completions. Only low-temperature requests are cached, since
+# replaying a sampled answer would make higher-temperature generations repeat themselves.
+CHAT_CACHE_SIZE = 1024
+CHAT_CACHE_TTL = int(os.getenv("CHAT_CACHE_TTL", "1800"))
+CHAT_CACHE_MAX_TEMPERATURE = 0.3
+
+# Batch API settings for offline bulk optimization. Batched requests cost less and have their own
+# rate limits, but results only arrive within the completion window.
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_INTERVAL = 30
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Embeddings used to recognize paraphrased prompts in the analysis cache; shortened vectors keep lookups cheap
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = 128
+
+# Analysis used when there is no API key or the analysis call fails
+DEFAULT_ANALYSIS_TASKS = [TaskType.DEDUCTION]
+DEFAULT_ANALYSIS_BEHAVIORS = [BehaviorType.PRECISION, BehaviorType.STEP_BY_STEP]
+
+# Mock content for demo/testing, by component type
+MOCK_COMPONENT_CONTENT = {
+    "context": "Consider all relevant information and constraints before responding.",
+    "example": "Here's an example of a good response: [Example response that demonstrates desired qualities]",
+    "constraint": "Important: Your response must be factual, precise, and include step-by-step reasoning.",
+    "output_format": "Format your response as follows: 1) Initial analysis, 2) Step-by-step reasoning, 3) Final answer",
+}
+
+
+def _canonical_json(value: Any) -> str:
+    """Serialize request data the same way every time so identical inputs give byte-identical messages"""
+    # orjson output is already compact; sorting the keys makes it canonical
+    return orjson.dumps(value, option=orjson.OPT_SORT_KEYS).decode()
+
+def _estimate_tokens(request: Dict[str, Any]) -> int:
+    """Rough token count of a chat request for the rate limiter: ~4 characters per prompt token plus the output budget"""
+    prompt_chars = sum(len(message["content"]) for message in request["messages"])
+    return prompt_chars // 4 + request.get("max_tokens", 0)
 
 class MetaLLMAnalyzer:
     def __init__(self, api_key: Optional[str] = None):
         """Initialize with OpenAI or other LLM provider"""
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
-        self.model = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+        self.model = os.getenv("LLM_MODEL", DEFAULT_LLM_MODEL)
         self.use_mock = not self.api_key  # Use mock responses if no API key
+        self.analysis_cache: SemanticCache[Dict[str, Any]] = SemanticCache()
+        self.chat_cache: TTLCache = TTLCache(maxsize=CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL)
+        self._chat_cache_lock = threading.Lock()
+        # Shared by every call from this process so bursts queue up instead of hitting 429s
+        self.rate_limiter = RateLimiter()
         
-        # Initialize OpenAI client if API key is available
+        # Initialize OpenAI clients if API key is available; the async one lets requests fan out LLM calls.
+        # The API shares one optimizer per process, so every request reuses these clients' connection pools.
         if self.api_key:
             try:
-                self.client = OpenAI(api_key=self.api_key)
+                self.client = openai.OpenAI(api_key=self.api_key, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES)
+                self.async_client = openai.AsyncOpenAI(
+                    api_key=self.api_key, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES
+                )
                 logger.info(f"Initialized OpenAI client with model: {self.model}")
             except Exception as e:
                 logger.error(f"Failed to initialize OpenAI client: {str(e)}")
@@ -58,147 +177,489 @@ class MetaLLMAnalyzer:
             logger.warning("No API key provided, using mock responses")
             self.use_mock = True
     
+    async def close(self) -> None:
+        """Close the OpenAI clients and their pooled connections"""
+        if self.use_mock:
+            return
+        self.client.close()
+        await self.async_client.close()
+    
     def analyze_task(self, user_prompt: str) -> Dict[str, Any]:
         """Analyze the user's task to determine optimal reasoning approach"""
         if self.use_mock:
             # Return mock analysis for demo/testing
-            return {
-                "detected_tasks": [TaskType.DEDUCTION],
-                "detected_behaviors": [BehaviorType.PRECISION, BehaviorType.STEP_BY_STEP],
-                "domain_hint": None,
-            }
+            return self._default_analysis()
+        
+        # A repeated prompt is answered from the chat cache, needing neither the embedding nor the LLM call
+        request = self._analysis_request(user_prompt)
+        cached = self._cached_chat_analysis(request)
+        if cached is not None:
+            return cached
+        
+        # Reuse the analysis of a semantically equivalent prompt if there is one
+        embedding = self._embed(user_prompt)
+        cached = self._cached_analysis(embedding)
+        if cached is not None:
+            return cached
         
         try:
             # Call the LLM API to analyze the task
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": ANALYSIS_PROMPT},
-                    {"role": "user", "content": user_prompt}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.1
-            )
-            
-            # Parse the response
-            analysis_text = response.choices[0].message.content
-            analysis = json.loads(analysis_text)
-            
-            # Convert string lists to enum lists
-            detected_tasks = [TaskType(task) for task in analysis.get("reasoning_tasks", [])]
-            detected_behaviors = [BehaviorType(behavior) for behavior in analysis.get("output_behaviors", [])]
-            
-            return {
-                "detected_tasks": detected_tasks or [TaskType.DEDUCTION],  # Default if empty
-                "detected_behaviors": detected_behaviors or [BehaviorType.PRECISION],  # Default if empty
-                "domain_hint": analysis.get("domain"),
-            }
-            
-        except (OpenAIError, json.JSONDecodeError, ValueError) as e:
+            analysis = self._parse_analysis(self._chat(request))
+        except Exception as e:
             # Log and return defaults on error
             logger.error(f"Error analyzing task: {str(e)}")
-            return {
-                "detected_tasks": [TaskType.DEDUCTION],
-                "detected_behaviors": [BehaviorType.PRECISION, BehaviorType.STEP_BY_STEP],
-                "domain_hint": None,
-            }
-    
-    def generate_component_content(self, component_type: str, task_analysis: Dict[str, Any], 
-                                 original_prompt: str) -> str:
-        """Generate content for a specific prompt component"""
+            return self._default_analysis()
+        self._cache_analysis(embedding, analysis)
+        return analysis
+    
+    async def analyze_task_async(self, user_prompt: str, strict: bool = False) -> Dict[str, Any]:
+        """Async variant of analyze_task
+        
+        With strict=True a failed call raises instead of returning the default analysis.
+        """
         if self.use_mock:
-            # Return mock content for demo/testing
-            if component_type == "instruction":
-                return f"Follow these instructions carefully to answer the query: {original_prompt}"
-            elif component_type == "context":
-                return "Consider all relevant information and constraints before responding."
-            elif component_type == "example":
-                return "Here's an example of a good response: [Example response that demonstrates desired qualities]"
-            elif component_type == "constraint":
-                return "Important: Your response must be factual, precise, and include step-by-step reasoning."
-            elif component_type == "output_format":
-                return "Format your response as follows: 1) Initial analysis, 2) Step-by-step reasoning, 3) Final answer"
-            else:
-                return "[Content for this component type]"
+            return self._default_analysis()
+        
+        request = self._analysis_request(user_prompt)
+        cached = self._cached_chat_analysis(request)
+        if cached is not None:
+            return cached
+        
+        embedding = await self._embed_async(user_prompt)
+        # The similarity scan is CPU-bound, so keep it off the event loop
+        cached = await anyio.to_thread.run_sync(self._cached_analysis, embedding)
+        if cached is not None:
+            return cached
         
         try:
-            # Construct a system prompt for the specific component type
-            system_prompt = COMPONENT_GENERATION_PROMPTS.get(component_type, 
-                                                          "Generate appropriate content for this prompt component.")
-            
-            # Format task information for the component
-            task_info = {
-                "reasoning_tasks": [t.value for t in task_analysis["detected_tasks"]],
-                "behaviors": [b.value for b in task_analysis["detected_behaviors"]],
-                "domain": task_analysis.get("domain_hint", "general")
-            }
-            
-            # Call the LLM API to generate component content
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Original prompt: {original_prompt}\n\nTask analysis: {json.dumps(task_info)}"}
-                ],
-                temperature=0.7
+            analysis = self._parse_analysis(await self._chat_async(request))
+        except Exception as e:
+            logger.error(f"Error analyzing task: {str(e)}")
+            if strict:
+                raise
+            return self._default_analysis()
+        self._cache_analysis(embedding, analysis)
+        return analysis
+    
+    def _chat(self, request: Dict[str, Any]) -> str:
+        """Return the completion text for a chat request, reusing a cached answer for identical requests"""
+        key = self._chat_cache_key(request)
+        content = self._cached_chat(key)
+        if content is not None:
+            return content
+        
+        self.rate_limiter.acquire(_estimate_tokens(request))
+        response = self.client.chat.completions.create(**request)
+        content = response.choices[0].message.content
+        self._cache_chat(key, content)
+        return content
+    
+    async def _chat_async(self, request: Dict[str, Any]) -> str:
+        """Async variant of _chat"""
+        key = self._chat_cache_key(request)
+        content = self._cached_chat(key)
+        if content is not None:
+            return content
+        
+        await self.rate_limiter.acquire_async(_estimate_tokens(request))
+        response = await self.async_client.chat.completions.create(**request)
+        content = response.choices[0].message.content
+        self._cache_chat(key, content)
+        return content
+    
+    def _chat_cache_key(self, request: Dict[str, Any]) -> Optional[str]:
+        """Hash the full request (model, messages, temperature, format), or None if it shouldn't be cached"""
+        if request.get("temperature", 1.0) > CHAT_CACHE_MAX_TEMPERATURE:
+            return None
+        return hashlib.sha256(orjson.dumps(request, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    
+    def _cached_chat(self, key: Optional[str]) -> Optional[str]:
+        """Return the cached completion text for a request key, if any"""
+        if key is None:
+            return None
+        with self._chat_cache_lock:
+            return self.chat_cache.get(key)
+    
+    def _cache_chat(self, key: Optional[str], content: Optional[str]) -> None:
+        if key is not None and content is not None:
+            with self._chat_cache_lock:
+                self.chat_cache[key] = content
+    
+    def _embed(self, text: str) -> Optional[List[float]]:
+        """Embed text for the semantic cache, or return None if the embedding call fails"""
+        # Embeddings count against the same account budgets as chat calls
+        self.rate_limiter.acquire(len(text) // 4)
+        try:
+            response = self.client.embeddings.create(
+                model=EMBEDDING_MODEL, input=text, dimensions=EMBEDDING_DIMENSIONS
             )
-            
-            return response.choices[0].message.content
-            
-        except OpenAIError as e:
-            # Log and return fallback content on error
-            logger.error(f"Error generating {component_type} content: {str(e)}")
-            return f"[{component_type.upper()} CONTENT FOR: {original_prompt}]"
-
+            return [float(x) for x in response.data[0].embedding]
+        except Exception as e:
+            logger.warning(f"Error embedding prompt, skipping the analysis cache: {str(e)}")
+            return None
+    
+    async def _embed_async(self, text: str) -> Optional[List[float]]:
+        """Async variant of _embed"""
+        await self.rate_limiter.acquire_async(len(text) // 4)
+        try:
+            response = await self.async_client.embeddings.create(
+                model=EMBEDDING_MODEL, input=text, dimensions=EMBEDDING_DIMENSIONS
+            )
+            return [float(x) for x in response.data[0].embedding]
+        except Exception as e:
+            logger.warning(f"Error embedding prompt, skipping the analysis cache: {str(e)}")
+            return None
+    
+    def _cached_analysis(self, embedding: Optional[List[float]]) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached analysis for a similar prompt, if any"""
+        if embedding is None:
+            return None
+        analysis = self.analysis_cache.get(embedding)
+        if analysis is None:
+            return None
+        logger.info("Semantic cache hit for task analysis")
+        return self._copy_analysis(analysis)
+    
+    def _cached_chat_analysis(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return the analysis for a request whose answer is in the chat cache, if any"""
+        content = self._cached_chat(self._chat_cache_key(request))
+        if content is None:
+            return None
+        try:
+            return self._parse_analysis(content)
+        except Exception:
+            return None
+    
+    def _cache_analysis(self, embedding: Optional[List[float]], analysis: Dict[str, Any]) -> None:
+        """Store a successful analysis under its prompt embedding"""
+        if embedding is not None:
+            self.analysis_cache.put(embedding, self._copy_analysis(analysis))
+    
+    def _copy_analysis(self, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy an analysis so callers can't modify the cached lists"""
+        return {
+            **analysis,
+            "detected_tasks": list(analysis["detected_tasks"]),
+            "detected_behaviors": list(analysis["detected_behaviors"]),
+        }
+    
+    def _analysis_request(self, user_prompt: str) -> Dict[str, Any]:
+        """Build the chat completion arguments for a task analysis"""
+        return {
+            "model": self.model,
+            "messages": [
+                _ANALYSIS_SYSTEM_MESSAGE,
+                {"role": "user", "content": user_prompt}
+            ],
+            "response_format": self._analysis_response_format(),
+            "temperature": 0.1,
+            "max_tokens": ANALYSIS_MAX_TOKENS,
+        }
+    
+    def _analysis_response_format(self) -> Dict[str, Any]:
+        """Structured outputs where the model supports them, JSON mode otherwise"""
+        if self.model == "gpt-4" or self.model.startswith(LEGACY_JSON_MODE_MODELS):
+            return {"type": "json_object"}
+        return ANALYSIS_RESPONSE_FORMAT
+    
+    def _parse_analysis(self, analysis_text: str) -> Dict[str, Any]:
+        """Parse the LLM's JSON analysis into enum lists"""
+        analysis = orjson.loads(analysis_text)
+        
+        # Convert string lists to enum lists
+        detected_tasks = [TaskType(task) for task in analysis.get("reasoning_tasks", [])]
+        detected_behaviors = [BehaviorType(behavior) for behavior in analysis.get("output_behaviors", [])]
+        
+        return {
+            "detected_tasks": detected_tasks or [TaskType.DEDUCTION],  # Default if empty
+            "detected_behaviors": detected_behaviors or [BehaviorType.PRECISION],  # Default if empty
+            "domain_hint": analysis.get("domain"),
+        }
+    
+    def _default_analysis(self) -> Dict[str, Any]:
+        """Analysis returned without an API key or when the analysis call fails"""
+        return {
+            "detected_tasks": list(DEFAULT_ANALYSIS_TASKS),
+            "detected_behaviors": list(DEFAULT_ANALYSIS_BEHAVIORS),
+            "domain_hint": None,
+        }
+    
+    def generate_all_components(self, task_analysis: Dict[str, Any], original_prompt: str,
+                                needed_types: List[str]) -> Dict[str, str]:
+        """Generate content for several prompt components with one LLM call"""
+        if self.use_mock:
+            return {t: self._mock_component_content(t, original_prompt) for t in needed_types}
+        
+        try:
+            contents_text = self._chat(self._component_batch_request(task_analysis, original_prompt, needed_types))
+            return self._parse_component_batch(contents_text, needed_types, original_prompt)
+        except Exception as e:
+            logger.error(f"Error generating component contents: {str(e)}")
+            return {t: f"[{t.upper()} CONTENT FOR: {original_prompt}]" for t in needed_types}
+    
+    async def generate_all_components_async(self, task_analysis: Dict[str, Any], original_prompt: str,
+                                            needed_types: List[str], strict: bool = False) -> Dict[str, str]:
+        """Async variant of generate_all_components
+        
+        With strict=True a failed call raises instead of returning placeholder contents.
+        """
+        if self.use_mock:
+            return {t: self._mock_component_content(t, original_prompt) for t in needed_types}
+        
+        try:
+            contents_text = await self._chat_async(
+                self._component_batch_request(task_analysis, original_prompt, needed_types)
+            )
+            return self._parse_component_batch(contents_text, needed_types, original_prompt)
+        except Exception as e:
+            logger.error(f"Error generating component contents: {str(e)}")
+            if strict:
+                raise
+            return {t: f"[{t.upper()} CONTENT FOR: {original_prompt}]" for t in needed_types}
+    
+    def _component_batch_request(self, task_analysis: Dict[str, Any], original_prompt: str,
+                                 needed_types: List[str]) -> Dict[str, Any]:
+        """Build the chat completion arguments for generating several components"""
+        return {
+            "model": self.model,
+            "messages": self._component_messages(task_analysis, original_prompt, (
+                f"Now produce these components: {_canonical_json(needed_types)}\n"
+                "Respond with a JSON object mapping each component type to its content as a string."
+            )),
+            "response_format": {"type": "json_object"},
+            "temperature": COMPONENT_TEMPERATURE,
+            "max_tokens": COMPONENT_MAX_TOKENS * max(len(needed_types), 1),
+        }
+    
+    def _component_messages(self, task_analysis: Dict[str, Any], original_prompt: str,
+                            directive: str) -> List[Dict[str, str]]:
+        """Shared spec and context messages (a cacheable prefix) followed by the call's own directive"""
+        return [
+            _COMPONENT_SYSTEM_MESSAGE,
+            {"role": "user", "content": (
+                f"Original prompt: {original_prompt}\n\n"
+                f"Task analysis: {_canonical_json(self._task_info(task_analysis))}"
+            )},
+            {"role": "user", "content": directive}
+        ]
+    
+    def _parse_component_batch(self, contents_text: str, needed_types: List[str],
+                               original_prompt: str) -> Dict[str, str]:
+        """Pick each needed component out of the batched JSON response"""
+        contents = orjson.loads(contents_text)
+        result = {}
+        for component_type in needed_types:
+            content = contents.get(component_type)
+            if not isinstance(content, str):
+                logger.warning(f"No {component_type} content in batched response")
+                content = f"[{component_type.upper()} CONTENT FOR: {original_prompt}]"
+            result[component_type] = content
+        return result
+    
+    def _task_info(self, task_analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Summarize a task analysis for a user message, with lists sorted so equal analyses serialize equally"""
+        return {
+            "reasoning_tasks": sorted([TASK_VALUES[t] for t in task_analysis["detected_tasks"]]),
+            "behaviors": sorted([BEHAVIOR_VALUES[b] for b in task_analysis["detected_behaviors"]]),
+            "domain": task_analysis.get("domain_hint", "general")
+        }
+    
+    def _mock_component_content(self, component_type: str, original_prompt: str) -> str:
+        """Return mock content for demo/testing"""
+        if component_type == "instruction":
+            return f"Follow these instructions carefully to answer the query: {original_prompt}"
+        return MOCK_COMPONENT_CONTENT.get(component_type, "[Content for this component type]")
+    
     def generate_rationale(self, components: List[PromptComponent], 
                           task_analysis: Dict[str, Any], 
                           effectiveness_score: float) -> str:
         """Generate an explanation for why this prompt structure was chosen"""
         if self.use_mock:
-            # Return mock rationale for demo/testing
-            ordered_types = [comp.type.value for comp in components]
-            return (
-                f"This prompt structure (ordering: {', '.join(ordered_types)}) was chosen because it optimizes for "
-                f"the detected reasoning tasks and desired behaviors. The effectiveness score is {effectiveness_score:.2f}."
-            )
+            return self._mock_rationale(components, effectiveness_score)
             
         try:
-            # Prepare component information
-            components_info = [{"type": comp.type.value, "position": comp.position} for comp in components]
-            
-            # Format task information
-            task_info = {
-                "reasoning_tasks": [t.value for t in task_analysis["detected_tasks"]],
-                "behaviors": [b.value for b in task_analysis["detected_behaviors"]],
-                "domain": task_analysis.get("domain_hint", "general"),
-                "effectiveness_score": effectiveness_score
-            }
-            
             # Call the LLM API to generate rationale
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": RATIONALE_PROMPT},
-                    {"role": "user", "content": f"Components: {json.dumps(components_info)}\n\nTask analysis: {json.dumps(task_info)}"}
-                ],
-                temperature=0.3
-            )
-            
-            return response.choices[0].message.content
-            
-        except OpenAIError as e:
+            return self._chat(self._rationale_request(components, task_analysis, effectiveness_score))
+        except Exception as e:
             # Log and return fallback rationale on error
             logger.error(f"Error generating rationale: {str(e)}")
-            ordered_types = [comp.type.value for comp in components]
-            return (
-                f"This prompt structure (ordering: {', '.join(ordered_types)}) was chosen to optimize for "
-                f"the detected reasoning tasks and behaviors. Effectiveness score: {effectiveness_score:.2f}."
-            )
+            return self._fallback_rationale(components, effectiveness_score)
+    
+    async def stream_rationale(self, components: List[PromptComponent],
+                               task_analysis: Dict[str, Any],
+                               effectiveness_score: float, strict: bool = False) -> AsyncIterator[str]:
+        """Yield the rationale in pieces as the LLM generates it
+        
+        The joined pieces are the same text generate_rationale returns. If the
+        call fails before anything was yielded, the fallback rationale is yielded instead;
+        with strict=True any failure raises.
+        """
+        if self.use_mock:
+            yield self._mock_rationale(components, effectiveness_score)
+            return
+        
+        request = self._rationale_request(components, task_analysis, effectiveness_score)
+        key = self._chat_cache_key(request)
+        if key is not None:
+            with self._chat_cache_lock:
+                content = self.chat_cache.get(key)
+            if content is not None:
+                yield content
+                return
+        
+        parts: List[str] = []
+        try:
+            await self.rate_limiter.acquire_async(_estimate_tokens(request))
+            stream = await self.async_client.chat.completions.create(**request, stream=True)
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            logger.error(f"Error streaming rationale: {str(e)}")
+            if strict:
+                raise
+            if not parts:
+                yield self._fallback_rationale(components, effectiveness_score)
+            return
+        self._cache_chat(key, "".join(parts))
+    
+    def _rationale_request(self, components: List[PromptComponent],
+                           task_analysis: Dict[str, Any],
+                           effectiveness_score: float) -> Dict[str, Any]:
+        """Build the chat completion arguments for a rationale"""
+        # Prepare component information
+        components_info = [{"type": COMPONENT_VALUES[comp.type], "position": comp.position} for comp in components]
+        
+        # Format task information
+        task_info = self._task_info(task_analysis)
+        task_info["effectiveness_score"] = effectiveness_score
+        
+        return {
+            "model": self.model,
+            "messages": [
+                _RATIONALE_SYSTEM_MESSAGE,
+                {"role": "user", "content": f"Components: {_canonical_json(components_info)}\n\nTask analysis: {_canonical_json(task_info)}"}
+            ],
+            "temperature": RATIONALE_TEMPERATURE,
+            "max_tokens": RATIONALE_MAX_TOKENS,
+        }
+    
+    def _mock_rationale(self, components: List[PromptComponent], effectiveness_score: float) -> str:
+        """Return mock rationale for demo/testing"""
+        ordered_types = [COMPONENT_VALUES[comp.type] for comp in components]
+        return (
+            f"This prompt structure (ordering: {', '.join(ordered_types)}) was chosen because it optimizes for "
+            f"the detected reasoning tasks and desired behaviors. The effectiveness score is {effectiveness_score:.2f}."
+        )
+    
+    def _fallback_rationale(self, components: List[PromptComponent], effectiveness_score: float) -> str:
+        """Rationale used when the rationale call fails"""
+        ordered_types = [COMPONENT_VALUES[comp.type] for comp in components]
+        return (
+            f"This prompt structure (ordering: {', '.join(ordered_types)}) was chosen to optimize for "
+            f"the detected reasoning tasks and behaviors. Effectiveness score: {effectiveness_score:.2f}."
+        )
 
-    def assemble_prompt(self, components: List[PromptComponent]) -> str:
-        """Assemble the full prompt from components"""
+    def analyze_tasks_batch(self, user_prompts: List[str]) -> List[Dict[str, Any]]:
+        """Analyze many prompts with one Batch API job; prompts whose analysis fails get the defaults"""
+        if self.use_mock:
+            return [self._default_analysis() for _ in user_prompts]
+        
+        try:
+            results = self._run_batch({str(i): self._analysis_request(prompt) for i, prompt in enumerate(user_prompts)})
+        except Exception as e:
+            logger.error(f"Error running analysis batch: {str(e)}")
+            results = {}
+        
+        analyses = []
+        for i in range(len(user_prompts)):
+            try:
+                analyses.append(self._parse_analysis(results[str(i)]))
+            except Exception as e:
+                logger.error(f"Error analyzing task {i} of batch: {str(e)}")
+                analyses.append(self._default_analysis())
+        return analyses
+    
+    def generate_batch(self, jobs: List[Tuple[List[PromptComponent], Dict[str, Any], str, float]]
+                       ) -> List[Tuple[Dict[str, str], str]]:
+        """Generate component contents and rationales for many prompts with one Batch API job
+        
+        Each job is (components, task_analysis, original_prompt, effectiveness_score); each
+        result is (contents by component type, rationale), with fallbacks for failed requests.
+        """
+        if self.use_mock:
+            return [
+                ({COMPONENT_VALUES[c.type]: self._mock_component_content(COMPONENT_VALUES[c.type], prompt)
+                  for c in components}, self._mock_rationale(components, score))
+                for components, _, prompt, score in jobs
+            ]
+        
+        requests = {}
+        for i, (components, task_analysis, prompt, score) in enumerate(jobs):
+            needed_types = [COMPONENT_VALUES[c.type] for c in components]
+            requests[f"{i}:components"] = self._component_batch_request(task_analysis, prompt, needed_types)
+            requests[f"{i}:rationale"] = self._rationale_request(components, task_analysis, score)
+        try:
+            results = self._run_batch(requests)
+        except Exception as e:
+            logger.error(f"Error running generation batch: {str(e)}")
+            results = {}
+        
+        generated = []
+        for i, (components, _, prompt, score) in enumerate(jobs):
+            needed_types = [COMPONENT_VALUES[c.type] for c in components]
+            try:
+                contents = self._parse_component_batch(results[f"{i}:components"], needed_types, prompt)
+            except Exception as e:
+                logger.error(f"Error generating component contents {i} of batch: {str(e)}")
+                contents = {t: f"[{t.upper()} CONTENT FOR: {prompt}]" for t in needed_types}
+            rationale = results.get(f"{i}:rationale") or self._fallback_rationale(components, score)
+            generated.append((contents, rationale))
+        return generated
+    
+    def _run_batch(self, requests: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+        """Run chat requests as a Batch API job and return the completion text by custom_id
+        
+        Blocks until the job reaches a final status. Requests that failed or didn't finish
+        within the completion window are missing from the result.
+        """
+        lines = b"\n".join(
+            orjson.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body})
+            for custom_id, body in requests.items()
+        )
+        input_file = self.client.files.create(file=("requests.jsonl", lines), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window=BATCH_COMPLETION_WINDOW
+        )
+        logger.info(f"Submitted batch {batch.id} with {len(requests)} requests")
+        while batch.status not in BATCH_FINAL_STATUSES:
+            time.sleep(BATCH_POLL_INTERVAL)
+            batch = self.client.batches.retrieve(batch.id)
+        logger.info(f"Batch {batch.id} finished with status {batch.status}")
+        
+        # Expired and cancelled jobs still have output for the requests that completed
+        results = {}
+        if batch.output_file_id:
+            for line in self.client.files.content(batch.output_file_id).content.splitlines():
+                if not line.strip():
+                    continue
+                record = orjson.loads(line)
+                response = record.get("response") or {}
+                if response.get("status_code") == 200:
+                    results[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        return results
+    
+    def assemble_prompt(self, components: List[PromptComponent], presorted: bool = False) -> str:
+        """Assemble the full prompt from components
+        
+        Pass presorted=True when the components are already ordered by position, as
+        ASPEngine.solve returns them, to skip the sort.
+        """
         # Sort components by position to ensure correct order
-        sorted_components = sorted(components, key=lambda x: x.position)
+        if not presorted:
+            components = sorted(components, key=lambda x: x.position)
         
         # Join with double newlines for clear separation
-        return "\n\n".join([comp.content for comp in sorted_components])
+        return "\n\n".join([comp.content for comp in components])
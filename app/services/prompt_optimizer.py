@@ -1,10 +1,19 @@
-from typing import List, Dict, Any, Optional, Union, Tuple
+from typing import List, Dict, Any, AsyncIterator, Optional, Set, Union, Tuple, Deque
+import asyncio
+import copy
 import datetime
 import logging
 import functools
+import threading
+from collections import deque
+import anyio
+from cachetools import LRUCache
+from fastapi import BackgroundTasks
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
 from app.models.prompt import (
     TaskType, BehaviorType, OptimizationRequest, 
-    PromptComponent, OptimizedPrompt, ComponentType
+    PromptComponent, OptimizedPrompt, ComponentType, COMPONENT_VALUES
 )
 from app.core.asp_engine import ASPEngine
 from app.services.meta_llm import MetaLLMAnalyzer
@@ -15,15 +24,35 @@ from app.models.database import (
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Define a simple LRU cache for optimization requests
+# LRU cache of solved prompt structures, shared by worker threads under its lock
 OPTIMIZATION_CACHE_SIZE = 32
-optimization_cache: Dict[str, Tuple[List[PromptComponent], float]] = {}
+optimization_cache: "LRUCache[str, Tuple[List[PromptComponent], float]]" = LRUCache(maxsize=OPTIMIZATION_CACHE_SIZE)
+optimization_cache_lock = threading.RLock()
+
+# One bit per enum member, so a set of tasks or behaviors folds into a single int for cache keys
+TASK_BITS: Dict[TaskType, int] = {task: 1 << i for i, task in enumerate(TaskType)}
+BEHAVIOR_BITS: Dict[BehaviorType, int] = {behavior: 1 << i for i, behavior in enumerate(BehaviorType)}
+
+# Feedback waiting to be persisted; the oldest entries are dropped if writes fall this far behind
+FEEDBACK_BUFFER_SIZE = 10000
+# Maximum feedback entries written per database transaction
+FEEDBACK_BATCH_SIZE = 100
+# Entries from failed writes awaiting another attempt; kept apart so retries never push out new feedback
+FEEDBACK_RETRY_SIZE = 1000
+
+# Rationale of the result returned when optimization fails
+FALLBACK_RATIONALE = "Fallback optimization due to error in processing."
+
+FeedbackItem = Tuple[ComponentType, Union[TaskType, BehaviorType], float]
 
 
 class PromptOptimizer:
     def __init__(self, api_key: Optional[str] = None):
         self.asp_engine = ASPEngine()
         self.meta_llm = MetaLLMAnalyzer(api_key=api_key)
+        self._pending_feedback: Deque[FeedbackItem] = deque(maxlen=FEEDBACK_BUFFER_SIZE)
+        self._retry_feedback: Deque[FeedbackItem] = deque(maxlen=FEEDBACK_RETRY_SIZE)
+        self._feedback_lock = threading.Lock()
     
     def optimize(self, request: OptimizationRequest) -> OptimizedPrompt:
         """Optimize a prompt based on the request"""
@@ -31,41 +60,18 @@ class PromptOptimizer:
             # Step 1: Analyze the task using Meta-LLM
             task_analysis = self.meta_llm.analyze_task(request.user_prompt)
             
-            # Use provided tasks/behaviors or detected ones if not specified
-            target_tasks = request.target_tasks or task_analysis["detected_tasks"]
-            target_behaviors = request.target_behaviors or task_analysis["detected_behaviors"]
-            domain = request.domain or task_analysis.get("domain_hint")
-            
-            # Step 2: Check cache for similar structure requests
-            cache_key = self._generate_cache_key(target_tasks, target_behaviors, request.target_model, domain)
-            if cache_key in optimization_cache:
-                logger.info(f"Cache hit for structure optimization: {cache_key}")
-                components, effectiveness_score = optimization_cache[cache_key]
-                # Need to deep copy components to avoid modifying cached values
-                components = [PromptComponent(type=comp.type, content=comp.content, position=comp.position) 
-                             for comp in components]
-            else:
-                # Use ASP Engine to get optimal prompt structure
-                components, effectiveness_score = self.asp_engine.solve(
-                    target_tasks=target_tasks,
-                    target_behaviors=target_behaviors,
-                    target_model=request.target_model,
-                    domain=domain
-                )
-                # Cache the result
-                if len(optimization_cache) >= OPTIMIZATION_CACHE_SIZE:
-                    # Simple LRU: remove a random item when full
-                    optimization_cache.pop(next(iter(optimization_cache)))
-                optimization_cache[cache_key] = (components, effectiveness_score)
+            # Step 2: Get the optimal prompt structure (cached or from the ASP engine)
+            components, effectiveness_score = self._solve_structure(request, task_analysis)
             
-            # Step 3: Generate content for each component
+            # Step 3: Generate content for all components in one call
+            contents = self.meta_llm.generate_all_components(
+                task_analysis, request.user_prompt, [COMPONENT_VALUES[component.type] for component in components]
+            )
             for component in components:
-                component.content = self.meta_llm.generate_component_content(
-                    component.type.value, task_analysis, request.user_prompt
-                )
+                component.content = contents[COMPONENT_VALUES[component.type]]
             
             # Step 4: Assemble the full prompt
-            full_prompt = self.meta_llm.assemble_prompt(components)
+            full_prompt = self.meta_llm.assemble_prompt(components, presorted=True)
             
             # Step 5: Generate rationale
             rationale = self.meta_llm.generate_rationale(
@@ -90,18 +96,222 @@ class PromptOptimizer:
             )
         except Exception as e:
             logger.error(f"Error in prompt optimization: {str(e)}")
-            # Return a simplified fallback response
-            fallback_component = PromptComponent(
-                type=ComponentType.INSTRUCTION,
-                content=f"Please respond to the following query: {request.user_prompt}",
-                position=1
+            return self.fallback_result(request)
+    
+    async def optimize_async(self, request: OptimizationRequest,
+                             background_tasks: Optional[BackgroundTasks] = None,
+                             save: bool = True, strict: bool = False) -> OptimizedPrompt:
+        """Optimize a prompt, issuing the component batch and rationale LLM calls concurrently
+        
+        The ASP solve and the database write are blocking, so they run in worker threads. With
+        background_tasks the write is queued there instead, so the result isn't held up by it.
+        With save=False nothing is written and the caller saves the result itself.
+        
+        Errors normally degrade the result to defaults or the fallback prompt. With strict=True
+        they raise instead, so a returned result always comes from a clean run.
+        """
+        async for event, payload in self.optimize_stream(request, background_tasks, save=save, strict=strict):
+            if event == "result":
+                return payload
+        raise RuntimeError("Optimization stream ended without a result")
+    
+    async def optimize_stream(self, request: OptimizationRequest,
+                              background_tasks: Optional[BackgroundTasks] = None,
+                              save: bool = True, strict: bool = False) -> AsyncIterator[Tuple[str, Any]]:
+        """Yield (event, payload) pairs as the optimization progresses
+        
+        "structure" comes as soon as the solve finishes. The rationale then arrives as
+        "rationale_delta" pieces followed by the full "rationale", interleaved with
+        "components" whenever the content call completes. "result" (the OptimizedPrompt)
+        comes last; on error it is the fallback prompt, unless strict=True, in which case
+        the error is raised (see optimize_async).
+        """
+        pending: Set["asyncio.Future[Any]"] = set()
+        rationale_stream: Optional[AsyncIterator[str]] = None
+        try:
+            analysis = self.meta_llm.analyze_task_async(request.user_prompt, strict=strict)
+            if request.target_tasks and request.target_behaviors and request.domain:
+                # Explicit targets fix the structure, so solve while the analysis call is in flight
+                task_analysis, (components, effectiveness_score) = await asyncio.gather(
+                    analysis, anyio.to_thread.run_sync(self._solve_structure, request, {})
+                )
+            else:
+                task_analysis = await analysis
+                components, effectiveness_score = await anyio.to_thread.run_sync(
+                    self._solve_structure, request, task_analysis
+                )
+            yield "structure", {
+                "components": [{"type": COMPONENT_VALUES[c.type], "position": c.position} for c in components],
+                "effectiveness_score": effectiveness_score,
+            }
+            
+            # The rationale only needs the component types and positions, so it streams alongside the contents
+            contents_task = asyncio.ensure_future(self.meta_llm.generate_all_components_async(
+                task_analysis, request.user_prompt, [COMPONENT_VALUES[component.type] for component in components],
+                strict=strict
+            ))
+            rationale_stream = self.meta_llm.stream_rationale(
+                components, task_analysis, effectiveness_score, strict=strict
             )
-            return OptimizedPrompt(
-                components=[fallback_component],
-                full_prompt=fallback_component.content,
-                rationale="Fallback optimization due to error in processing.",
-                effectiveness_score=50.0
+            rationale_parts: List[str] = []
+            next_part = asyncio.ensure_future(rationale_stream.__anext__())
+            pending = {contents_task, next_part}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if contents_task in done:
+                    contents = contents_task.result()
+                    for component in components:
+                        component.content = contents[COMPONENT_VALUES[component.type]]
+                    yield "components", {
+                        "components": [
+                            {"type": COMPONENT_VALUES[c.type], "position": c.position, "content": c.content}
+                            for c in components
+                        ]
+                    }
+                if next_part in done:
+                    try:
+                        part = next_part.result()
+                    except StopAsyncIteration:
+                        yield "rationale", {"rationale": "".join(rationale_parts)}
+                    else:
+                        rationale_parts.append(part)
+                        yield "rationale_delta", {"delta": part}
+                        next_part = asyncio.ensure_future(rationale_stream.__anext__())
+                        pending.add(next_part)
+            rationale = "".join(rationale_parts)
+            
+            full_prompt = self.meta_llm.assemble_prompt(components, presorted=True)
+            
+            if save:
+                write = functools.partial(
+                    self._save_to_db,
+                    user_prompt=request.user_prompt,
+                    optimized_prompt=full_prompt,
+                    components=components,
+                    target_model=request.target_model,
+                    effectiveness_score=effectiveness_score,
+                    rationale=rationale
+                )
+                if background_tasks is not None:
+                    background_tasks.add_task(write)
+                else:
+                    await anyio.to_thread.run_sync(write)
+            
+            result = OptimizedPrompt(
+                components=components,
+                full_prompt=full_prompt,
+                rationale=rationale,
+                effectiveness_score=effectiveness_score
+            )
+        except Exception as e:
+            logger.error(f"Error in prompt optimization: {str(e)}")
+            if strict:
+                raise
+            result = self.fallback_result(request)
+        finally:
+            # Don't leave LLM calls running if the consumer stops early
+            for task in pending:
+                task.cancel()
+            # Close the rationale stream (and its HTTP response) now rather than when it is garbage collected;
+            # the cancelled read has to finish first, since a running generator can't be closed
+            await asyncio.gather(*pending, return_exceptions=True)
+            if rationale_stream is not None:
+                await rationale_stream.aclose()
+        yield "result", result
+    
+    def optimize_batch(self, requests: List[OptimizationRequest]) -> List[OptimizedPrompt]:
+        """Optimize many prompts through the LLM provider's Batch API, for offline bulk jobs
+        
+        Runs two batch jobs, the task analyses and then the component contents and rationales,
+        so this blocks for up to twice the batch completion window. Results are in request order.
+        """
+        analyses = self.meta_llm.analyze_tasks_batch([request.user_prompt for request in requests])
+        
+        structures: List[Optional[Tuple[List[PromptComponent], float]]] = []
+        for request, task_analysis in zip(requests, analyses):
+            try:
+                structures.append(self._solve_structure(request, task_analysis))
+            except Exception as e:
+                logger.error(f"Error solving prompt structure: {str(e)}")
+                structures.append(None)
+        
+        generated = iter(self.meta_llm.generate_batch([
+            (structure[0], task_analysis, request.user_prompt, structure[1])
+            for request, task_analysis, structure in zip(requests, analyses, structures)
+            if structure is not None
+        ]))
+        
+        results = []
+        with SessionLocal() as db:
+            for request, structure in zip(requests, structures):
+                if structure is None:
+                    results.append(self.fallback_result(request))
+                    continue
+                components, effectiveness_score = structure
+                contents, rationale = next(generated)
+                for component in components:
+                    component.content = contents[COMPONENT_VALUES[component.type]]
+                full_prompt = self.meta_llm.assemble_prompt(components, presorted=True)
+                
+                self._save_to_db(
+                    user_prompt=request.user_prompt,
+                    optimized_prompt=full_prompt,
+                    components=components,
+                    target_model=request.target_model,
+                    effectiveness_score=effectiveness_score,
+                    rationale=rationale,
+                    db=db
+                )
+                results.append(OptimizedPrompt(
+                    components=components,
+                    full_prompt=full_prompt,
+                    rationale=rationale,
+                    effectiveness_score=effectiveness_score
+                ))
+        return results
+    
+    def _solve_structure(self, request: OptimizationRequest,
+                         task_analysis: Dict[str, Any]) -> Tuple[List[PromptComponent], float]:
+        """Return fresh components and the effectiveness score for the request's targets"""
+        # Use provided tasks/behaviors or detected ones if not specified
+        target_tasks = request.target_tasks or task_analysis["detected_tasks"]
+        target_behaviors = request.target_behaviors or task_analysis["detected_behaviors"]
+        domain = request.domain or task_analysis.get("domain_hint")
+        
+        # Check cache for similar structure requests
+        cache_key = self._generate_cache_key(target_tasks, target_behaviors, request.target_model, domain)
+        with optimization_cache_lock:
+            cached = optimization_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Cache hit for structure optimization: {cache_key}")
+            components, effectiveness_score = cached
+        else:
+            # Use ASP Engine to get optimal prompt structure
+            components, effectiveness_score = self.asp_engine.solve(
+                target_tasks=target_tasks,
+                target_behaviors=target_behaviors,
+                target_model=request.target_model,
+                domain=domain
             )
+            # Cache the result; the LRU cache evicts the least recently used entry when full
+            with optimization_cache_lock:
+                optimization_cache[cache_key] = (components, effectiveness_score)
+        # Callers fill in the content, so hand out copies to avoid modifying cached values
+        return [copy.copy(comp) for comp in components], effectiveness_score
+    
+    def fallback_result(self, request: OptimizationRequest) -> OptimizedPrompt:
+        """Return a simplified fallback response"""
+        fallback_component = PromptComponent(
+            type=ComponentType.INSTRUCTION,
+            content=f"Please respond to the following query: {request.user_prompt}",
+            position=1
+        )
+        return OptimizedPrompt(
+            components=[fallback_component],
+            full_prompt=fallback_component.content,
+            rationale=FALLBACK_RATIONALE,
+            effectiveness_score=50.0
+        )
     
     def _generate_cache_key(self, 
                           target_tasks: List[TaskType], 
@@ -109,10 +319,25 @@ class PromptOptimizer:
                           target_model: str,
                           domain: Optional[str]) -> str:
         """Generate a cache key based on optimization parameters"""
-        tasks_str = ",".join(sorted([t.value for t in target_tasks]))
-        behaviors_str = ",".join(sorted([b.value for b in target_behaviors]))
-        return f"{tasks_str}|{behaviors_str}|{target_model}|{domain or 'none'}"
+        task_mask = 0
+        for task in target_tasks:
+            task_mask |= TASK_BITS[task]
+        behavior_mask = 0
+        for behavior in target_behaviors:
+            behavior_mask |= BEHAVIOR_BITS[behavior]
+        return f"{task_mask}|{behavior_mask}|{target_model}|{domain or 'none'}"
         
+    def save_result(self, request: OptimizationRequest, result: OptimizedPrompt) -> Optional[int]:
+        """Save a finished optimization to the history, e.g. one served from a response cache"""
+        return self._save_to_db(
+            user_prompt=request.user_prompt,
+            optimized_prompt=result.full_prompt,
+            components=result.components,
+            target_model=request.target_model,
+            effectiveness_score=result.effectiveness_score,
+            rationale=result.rationale
+        )
+    
     def _save_to_db(
         self,
         user_prompt: str,
@@ -120,12 +345,16 @@ class PromptOptimizer:
         components: List[PromptComponent],
         target_model: str,
         effectiveness_score: float,
-        rationale: str
+        rationale: str,
+        db: Optional[Session] = None
     ) -> Optional[int]:
-        """Save optimized prompt to database"""
-        # This fix is needed to make the test work - the original implementation works fine
-        # but the testing approach requires this pattern to simulate exceptions properly
-        db = SessionLocal()
+        """Save optimized prompt to database
+        
+        Uses the caller's session if one is given (and leaves it open), otherwise a new one from the pool.
+        """
+        owns_session = db is None
+        if owns_session:
+            db = SessionLocal()
         try:
             # Create OptimizedPromptDB record
             timestamp = datetime.datetime.now().isoformat()
@@ -141,26 +370,30 @@ class PromptOptimizer:
             # If an exception is raised during add, we'll catch it below
             db.add(db_prompt)
             db.flush()  # Get the ID assigned to db_prompt
+            # Read it now; after commit the expired instance would be reloaded with another SELECT
+            prompt_id = db_prompt.id
             
-            # Create PromptComponentDB records
-            for component in components:
-                db_component = PromptComponentDB(
-                    prompt_id=db_prompt.id,
-                    component_type=component.type.value,
-                    content=component.content,
-                    position=component.position
-                )
-                db.add(db_component)
+            # Create PromptComponentDB records with a single executemany INSERT
+            if components:
+                db.execute(insert(PromptComponentDB), [
+                    {
+                        "prompt_id": prompt_id,
+                        "component_type": COMPONENT_VALUES[component.type],
+                        "content": component.content,
+                        "position": component.position,
+                    }
+                    for component in components
+                ])
             
             db.commit()
-            prompt_id = db_prompt.id
             return prompt_id
         except Exception as e:
             db.rollback()
             logger.error(f"Error saving to database: {str(e)}")
             return None
         finally:
-            db.close()
+            if owns_session:
+                db.close()
     
     def provide_feedback(self, 
                         component_type: ComponentType, 
@@ -171,9 +404,60 @@ class PromptOptimizer:
             self.asp_engine.update_efficacy(component_type, task_or_behavior, effectiveness)
             
             # Clear the cache since efficacy values have changed
-            optimization_cache.clear()
+            with optimization_cache_lock:
+                optimization_cache.clear()
             
             return True
         except Exception as e:
             logger.error(f"Error providing feedback: {str(e)}")
             return False
+    
+    def queue_feedback(self, 
+                      component_type: ComponentType, 
+                      task_or_behavior: Union[TaskType, BehaviorType], 
+                      effectiveness: float) -> bool:
+        """Apply feedback to the ASP engine right away and buffer it for a batched database write"""
+        try:
+            item = (component_type, task_or_behavior, effectiveness)
+            self.asp_engine.apply_efficacy([item])
+            
+            # Clear the cache since efficacy values have changed
+            with optimization_cache_lock:
+                optimization_cache.clear()
+            
+            with self._feedback_lock:
+                if len(self._pending_feedback) == self._pending_feedback.maxlen:
+                    logger.warning("Feedback buffer full, dropping the oldest unsaved entry")
+                self._pending_feedback.append(item)
+            
+            return True
+        except Exception as e:
+            logger.error(f"Error queueing feedback: {str(e)}")
+            return False
+    
+    def flush_feedback(self, batch_size: int = FEEDBACK_BATCH_SIZE) -> int:
+        """Persist buffered feedback in batches and return the number of entries written
+        
+        Entries awaiting a retry are written first. A batch that fails to save moves to the retry
+        buffer, where the oldest entries are dropped once it is full, and the error is re-raised.
+        """
+        written = 0
+        while True:
+            with self._feedback_lock:
+                batch = [self._retry_feedback.popleft() for _ in range(min(batch_size, len(self._retry_feedback)))]
+                count = min(batch_size - len(batch), len(self._pending_feedback))
+                batch.extend(self._pending_feedback.popleft() for _ in range(count))
+            if not batch:
+                return written
+            
+            try:
+                self.asp_engine.persist_efficacy(batch)
+            except Exception:
+                with self._feedback_lock:
+                    retries = batch + list(self._retry_feedback)
+                    dropped = len(retries) - FEEDBACK_RETRY_SIZE
+                    if dropped > 0:
+                        logger.warning(f"Feedback retry buffer full, dropping the {dropped} oldest unsaved entries")
+                    self._retry_feedback = deque(retries[max(dropped, 0):], maxlen=FEEDBACK_RETRY_SIZE)
+                raise
+            written += len(batch)
@@ -0,0 +1,59 @@
+from typing import Callable
+import asyncio
+import os
+import threading
+import time
+
+# Account-level LLM budgets; the defaults match gpt-4o-mini's lowest paid tier
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+
+
+class RateLimiter:
+    """Request and token budgets that refill continuously over a minute
+    
+    Each call reserves one request and its estimated tokens up front. Budgets may go
+    negative, so callers queue up in order and each waits until its reservation is
+    covered instead of being sent early and rejected with a 429.
+    """
+    
+    def __init__(self, requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+                 timer: Callable[[], float] = time.monotonic):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._timer = timer
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = timer()
+        self._lock = threading.Lock()
+    
+    def reserve(self, tokens: int) -> float:
+        """Take one request and the given tokens from the budgets, returning seconds to wait before sending"""
+        with self._lock:
+            now = self._timer()
+            elapsed = now - self._updated
+            self._updated = now
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+            
+            # A request bigger than the whole budget could never fit, so it only waits for a full one
+            self._requests -= 1
+            self._tokens -= min(tokens, self.tokens_per_minute)
+            return max(
+                0.0,
+                -self._requests * 60 / self.requests_per_minute,
+                -self._tokens * 60 / self.tokens_per_minute,
+            )
+    
+    def acquire(self, tokens: int) -> None:
+        """Block the calling thread until the request fits the budgets"""
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+    
+    async def acquire_async(self, tokens: int) -> None:
+        """Async variant of acquire"""
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
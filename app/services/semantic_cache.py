@@ -0,0 +1,83 @@
+from typing import Generic, Optional, Sequence, Tuple, TypeVar
+import math
+import operator
+import threading
+from collections import OrderedDict
+
+# Entries kept before the least recently used one is evicted. A lookup scans every entry in
+# pure Python, so this bounds its cost along with the embedding size.
+SEMANTIC_CACHE_SIZE = 256
+# Minimum cosine similarity for a stored entry to count as a hit
+SEMANTIC_CACHE_THRESHOLD = 0.92
+
+V = TypeVar("V")
+
+
+class SemanticCache(Generic[V]):
+    """In-memory LRU cache keyed by embedding vectors
+    
+    A lookup returns the value of the most similar stored key if its cosine
+    similarity reaches the threshold. Keys are L2-normalized on the way in, so
+    similarity is a plain dot product. The scan is linear and CPU-bound, so async
+    callers should run it in a worker thread.
+    """
+    
+    def __init__(self, maxsize: int = SEMANTIC_CACHE_SIZE, threshold: float = SEMANTIC_CACHE_THRESHOLD):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, Tuple[Tuple[float, ...], V]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def get(self, embedding: Sequence[float]) -> Optional[V]:
+        """Return the value stored under the most similar key, or None below the threshold"""
+        query = _normalize(embedding)
+        if query is None:
+            return None
+        
+        # Scan a snapshot so concurrent lookups and inserts don't wait on each other
+        with self._lock:
+            entries = list(self._entries.items())
+        
+        best_id, best_score = None, self.threshold
+        for entry_id, (key, _) in entries:
+            score = sum(map(operator.mul, query, key))
+            if score >= best_score:
+                best_id, best_score = entry_id, score
+        if best_id is None:
+            return None
+        
+        with self._lock:
+            entry = self._entries.get(best_id)
+            if entry is None:
+                # Evicted while scanning
+                return None
+            self._entries.move_to_end(best_id)
+            return entry[1]
+    
+    def put(self, embedding: Sequence[float], value: V) -> None:
+        """Store a value, evicting the least recently used entry when full"""
+        key = _normalize(embedding)
+        if key is None:
+            return
+        
+        with self._lock:
+            self._entries[self._next_id] = (key, value)
+            self._next_id += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def _normalize(embedding: Sequence[float]) -> Optional[Tuple[float, ...]]:
+    """Scale a vector to unit length; zero vectors can't be compared and give None"""
+    norm = math.sqrt(sum(x * x for x in embedding))
+    if norm == 0:
+        return None
+    return tuple(x / norm for x in embedding)
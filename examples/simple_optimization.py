@@ -1,11 +1,13 @@
-import requests
-import json
+import urllib3
+import orjson
 import os
+import sys
 from dotenv import load_dotenv
 try:
     from colorama import init, Fore, Style
-    # Initialize colorama for Windows support
-    init()
+    # Only Windows consoles need colorama to translate ANSI codes; elsewhere it would just wrap stdout
+    if sys.platform == "win32":
+        init()
     HAS_COLORAMA = True
 except ImportError:
     HAS_COLORAMA = False
@@ -16,29 +18,34 @@ load_dotenv()
 # API endpoint
 API_URL = "http://localhost:8000/api/v1"
 
+# Fail fast when the server can't be reached; optimizations wait on LLM calls, so reads get longer
+TIMEOUT = urllib3.Timeout(connect=2.0, read=30.0)
+# Retry only failed connections and 503s, which mean the request never reached the API; the POSTs
+# aren't idempotent, so read errors and other gateway errors are not retried
+RETRIES = urllib3.Retry(total=3, read=0, other=0, backoff_factor=0.2, status_forcelist=[503],
+                        allowed_methods=None, raise_on_status=False)
+
+# Shared pool so repeated calls reuse keep-alive connections
+HTTP = urllib3.PoolManager(maxsize=4, block=True, timeout=TIMEOUT, retries=RETRIES)
+JSON_HEADERS = {"Content-Type": "application/json"}
+
 # Check if running in a terminal that can use colors
 USE_COLORS = os.isatty(1) and HAS_COLORAMA
 
-# Color codes using colorama if available
-class Colors:
-    if USE_COLORS:
-        HEADER = Fore.MAGENTA + Style.BRIGHT
-        BLUE = Fore.BLUE
-        GREEN = Fore.GREEN
-        WARNING = Fore.YELLOW
-        FAIL = Fore.RED
-        RESET = Style.RESET_ALL
-        BOLD = Style.BRIGHT
-        UNDERLINE = '\033[4m'  # Colorama doesn't have underline, using ANSI
-    else:
-        HEADER = ''
-        BLUE = ''
-        GREEN = ''
-        WARNING = ''
-        FAIL = ''
-        RESET = ''
-        BOLD = ''
-        UNDERLINE = ''
+# Color codes using colorama if available, chosen once at import
+HEADER, BLUE, GREEN, WARNING, FAIL, RESET, BOLD, UNDERLINE = (
+    Fore.MAGENTA + Style.BRIGHT,
+    Fore.BLUE,
+    Fore.GREEN,
+    Fore.YELLOW,
+    Fore.RED,
+    Style.RESET_ALL,
+    Style.BRIGHT,
+    '\033[4m',  # Colorama doesn't have underline, using ANSI
+) if USE_COLORS else ('',) * 8
+
+# Prefix for the "=== ... ===" section headers
+H_BOLD = HEADER + BOLD
 
 # Example prompt optimization request
 request_data = {
@@ -49,103 +56,173 @@ request_data = {
     "domain": "education"
 }
 
-def optimize_prompt():
-    """Send optimization request to the API"""
-    print(f"{Colors.BLUE}Sending optimization request...{Colors.RESET}")
-    
-    response = requests.post(
-        f"{API_URL}/optimize",
-        json=request_data,
-        headers={"Content-Type": "application/json"}
-    )
-    
-    if response.status_code == 200:
-        result = response.json()
-        print(f"\n{Colors.HEADER}{Colors.BOLD}=== Optimized Prompt ==={Colors.RESET}\n")
-        print(f"{Colors.GREEN}{result['full_prompt']}{Colors.RESET}")
-        
-        print(f"\n{Colors.HEADER}{Colors.BOLD}=== Rationale ==={Colors.RESET}\n")
-        print(result["rationale"])
-        
-        print(f"\n{Colors.BOLD}Effectiveness Score: {Colors.GREEN}{result['effectiveness_score']:.2f}{Colors.RESET}\n")
-        
-        print(f"\n{Colors.HEADER}{Colors.BOLD}=== Component Structure ==={Colors.RESET}\n")
-        for component in result["components"]:
-            print(f"{Colors.BLUE}[{component['position']}]{Colors.RESET} {Colors.BOLD}{component['type']}{Colors.RESET}")
+# Example feedback on a component's effectiveness
+feedback_data = {
+    "component_type": "instruction",
+    "behavior_type": "precision",
+    "effectiveness": 0.85
+}
+
+# The example payloads never change, so they are encoded once
+OPTIMIZE_BODY = orjson.dumps(request_data)
+ANALYZE_BODY = orjson.dumps({"text": request_data["user_prompt"]})
+FEEDBACK_BODY = orjson.dumps(feedback_data)
+BATCH_BODY = orjson.dumps({"ops": [
+    {"op": "optimize", "body": request_data},
+    {"op": "analyze", "body": {"text": request_data["user_prompt"]}},
+    {"op": "feedback", "body": feedback_data},
+]})
+
+def post(endpoint, body, **kwargs):
+    """POST an encoded JSON body to an API endpoint over the shared pool"""
+    return HTTP.request("POST", f"{API_URL}/{endpoint}", body=body, headers=JSON_HEADERS, **kwargs)
+
+def read(response):
+    """Return a response's status and decoded body (raw text if it isn't JSON)"""
+    try:
+        return response.status, orjson.loads(response.data)
+    except orjson.JSONDecodeError:
+        return response.status, response.data.decode()
+
+def write(lines):
+    """Write several lines to stdout in one call instead of one print per line"""
+    sys.stdout.write("\n".join(lines) + "\n")
+
+def show_error(status, body):
+    write([f"{FAIL}Error: {status}{RESET}", str(body)])
+
+def structure_lines(components, effectiveness_score):
+    return [
+        f"\n{BOLD}Effectiveness Score: {GREEN}{effectiveness_score:.2f}{RESET}\n",
+        f"\n{H_BOLD}=== Component Structure ==={RESET}\n",
+        *[f"{BLUE}[{component['position']}]{RESET} {BOLD}{component['type']}{RESET}" for component in components],
+    ]
+
+def show_optimization(status, result):
+    """Print an optimization response"""
+    if status == 200:
+        write([
+            f"\n{H_BOLD}=== Optimized Prompt ==={RESET}\n",
+            f"{GREEN}{result['full_prompt']}{RESET}",
+            f"\n{H_BOLD}=== Rationale ==={RESET}\n",
+            result["rationale"],
+            *structure_lines(result["components"], result["effectiveness_score"]),
+        ])
     else:
-        print(f"{Colors.FAIL}Error: {response.status_code}{Colors.RESET}")
-        print(response.text)
+        show_error(status, result)
 
-def analyze_prompt():
-    """Send analysis request to the API"""
-    print(f"{Colors.BLUE}Analyzing prompt...{Colors.RESET}")
-    
-    response = requests.post(
-        f"{API_URL}/analyze",
-        json={"text": request_data["user_prompt"]},
-        headers={"Content-Type": "application/json"}
-    )
-    
-    if response.status_code == 200:
-        result = response.json()
-        print(f"\n{Colors.HEADER}{Colors.BOLD}=== Prompt Analysis ==={Colors.RESET}\n")
-        
+def show_analysis(status, result):
+    """Print an analysis response"""
+    if status == 200:
         tasks = ', '.join(result['detected_tasks'])
         behaviors = ', '.join(result['detected_behaviors'])
         
-        print(f"{Colors.BOLD}Detected Tasks:{Colors.RESET} {Colors.GREEN}{tasks}{Colors.RESET}")
-        print(f"{Colors.BOLD}Detected Behaviors:{Colors.RESET} {Colors.GREEN}{behaviors}{Colors.RESET}")
+        write([
+            f"\n{H_BOLD}=== Prompt Analysis ==={RESET}\n",
+            f"{BOLD}Detected Tasks:{RESET} {GREEN}{tasks}{RESET}",
+            f"{BOLD}Detected Behaviors:{RESET} {GREEN}{behaviors}{RESET}",
+        ])
     else:
-        print(f"{Colors.FAIL}Error: {response.status_code}{Colors.RESET}")
-        print(response.text)
+        show_error(status, result)
+
+def show_feedback(status, result):
+    """Print a feedback response"""
+    # Feedback is accepted immediately and saved in the background
+    if status in (200, 202):
+        write([f"\n{H_BOLD}=== Feedback Result ==={RESET}\n", f"{GREEN}{result['message']}{RESET}"])
+    else:
+        show_error(status, result)
+
+def optimize_prompt():
+    """Send optimization request to the API, printing each part as it is streamed back"""
+    print(f"{BLUE}Sending optimization request...{RESET}")
+    
+    # Each line of the stream is one JSON event, so parts print as soon as the server has them
+    response = post("optimize/stream", OPTIMIZE_BODY, preload_content=False)
+    try:
+        if response.status != 200:
+            show_error(*read(response))
+            return
+        
+        rationale_started = False
+        for line in response:
+            if not line.strip():
+                continue
+            event = orjson.loads(line)
+            if event["event"] == "structure":
+                write(structure_lines(event["components"], event["effectiveness_score"]))
+            elif event["event"] == "rationale_delta":
+                if not rationale_started:
+                    write([f"\n{H_BOLD}=== Rationale ==={RESET}\n"])
+                    rationale_started = True
+                sys.stdout.write(event["delta"])
+                sys.stdout.flush()
+            elif event["event"] == "rationale":
+                if rationale_started:
+                    write([""])
+                else:
+                    write([f"\n{H_BOLD}=== Rationale ==={RESET}\n", event["rationale"]])
+            elif event["event"] == "result":
+                write([f"\n{H_BOLD}=== Optimized Prompt ==={RESET}\n", f"{GREEN}{event['result']['full_prompt']}{RESET}"])
+    finally:
+        response.release_conn()
+
+def analyze_prompt():
+    """Send analysis request to the API"""
+    print(f"{BLUE}Analyzing prompt...{RESET}")
+    show_analysis(*read(post("analyze", ANALYZE_BODY)))
 
 def provide_feedback():
     """Send feedback to the API"""
-    feedback_data = {
-        "component_type": "instruction",
-        "behavior_type": "precision",
-        "effectiveness": 0.85
-    }
-    
-    print(f"{Colors.BLUE}Sending feedback...{Colors.RESET}")
-    
-    response = requests.post(
-        f"{API_URL}/feedback",
-        json=feedback_data,
-        headers={"Content-Type": "application/json"}
-    )
+    print(f"{BLUE}Sending feedback...{RESET}")
+    show_feedback(*read(post("feedback", FEEDBACK_BODY)))
+
+def run_all():
+    """Send all example requests in a single batch, then print the results in menu order"""
+    print(f"{BLUE}Sending batch request...{RESET}")
+    status, body = read(post("batch", BATCH_BODY))
+    if status != 200:
+        show_error(status, body)
+        return
     
-    if response.status_code == 200:
-        result = response.json()
-        print(f"\n{Colors.HEADER}{Colors.BOLD}=== Feedback Result ==={Colors.RESET}\n")
-        print(f"{Colors.GREEN}{result['message']}{Colors.RESET}")
-    else:
-        print(f"{Colors.FAIL}Error: {response.status_code}{Colors.RESET}")
-        print(response.text)
+    for show, result in zip((show_optimization, show_analysis, show_feedback), body["results"]):
+        show(result["status_code"], result["body"])
+
+# Menu choices and the action each one runs
+ACTIONS = {"1": optimize_prompt, "2": analyze_prompt, "3": provide_feedback, "4": run_all}
+
+def run(action):
+    """Run a menu action, reporting a timeout or unreachable server instead of crashing"""
+    try:
+        action()
+    except urllib3.exceptions.HTTPError as e:
+        print(f"{WARNING}Request failed: {e}{RESET}")
 
 def main():
-    print(f"\n{Colors.HEADER}{Colors.BOLD}InferPrompt API Client{Colors.RESET}\n")
-    print(f"{Colors.BOLD}1.{Colors.RESET} Optimize a prompt")
-    print(f"{Colors.BOLD}2.{Colors.RESET} Analyze a prompt")
-    print(f"{Colors.BOLD}3.{Colors.RESET} Provide feedback")
-    print(f"{Colors.BOLD}4.{Colors.RESET} Exit")
+    print(f"\n{H_BOLD}InferPrompt API Client{RESET}\n")
     
-    choice = input(f"\n{Colors.BLUE}Enter your choice (1-4):{Colors.RESET} ")
-    
-    if choice == "1":
-        optimize_prompt()
-    elif choice == "2":
-        analyze_prompt()
-    elif choice == "3":
-        provide_feedback()
-    elif choice == "4":
-        print(f"{Colors.GREEN}Exiting...{Colors.RESET}")
-        return
-    else:
-        print(f"{Colors.WARNING}Invalid choice. Please try again.{Colors.RESET}")
-    
-    input(f"\n{Colors.BLUE}Press Enter to continue...{Colors.RESET}")
-    main()
+    while True:
+        print(f"{BOLD}1.{RESET} Optimize a prompt")
+        print(f"{BOLD}2.{RESET} Analyze a prompt")
+        print(f"{BOLD}3.{RESET} Provide feedback")
+        print(f"{BOLD}4.{RESET} Run all")
+        print(f"{BOLD}5.{RESET} Exit")
+        
+        choice = input(f"\n{BLUE}Enter your choice (1-5):{RESET} ")
+        
+        if choice == "5":
+            print(f"{GREEN}Exiting...{RESET}")
+            break
+        elif choice in ACTIONS:
+            run(ACTIONS[choice])
+        else:
+            print(f"{WARNING}Invalid choice. Please try again.{RESET}")
+        
+        input(f"\n{BLUE}Press Enter to continue...{RESET}")
 
 if __name__ == "__main__":
-    main()
+    # --all sends every example request in one batch instead of showing the interactive menu
+    if "--all" in sys.argv[1:]:
+        run(run_all)
+    else:
+        main()
@@ -2,16 +2,24 @@ import os
 import sys
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 import logging
+from unittest.mock import patch
 
 # Add the project root to the path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+# Use an in-memory SQLite database for testing; set before the app builds its engine so
+# nothing ever opens the working-tree database
+TEST_DATABASE_URL = "sqlite:///:memory:"
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
 from app.main import app
+from app.models import database
 from app.models.database import Base, get_db
-from app.models.prompt import ComponentType, TaskType, BehaviorType
+from app.models.prompt import TaskType, BehaviorType
 from app.services.meta_llm import MetaLLMAnalyzer
 from app.core.asp_engine import ASPEngine
 from app.services.prompt_optimizer import PromptOptimizer
@@ -19,30 +27,56 @@ from app.services.prompt_optimizer import PromptOptimizer
 # Disable logging during tests
 logging.disable(logging.CRITICAL)
 
-# Use an in-memory SQLite database for testing
-TEST_DATABASE_URL = "sqlite:///:memory:"
-engine = create_engine(TEST_DATABASE_URL)
+# Share one connection across threads so requests served by the test client see the same database
+engine = create_engine(TEST_DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Create the tables
-Base.metadata.create_all(bind=engine)
+# pysqlite defers BEGIN until the first write, which breaks SAVEPOINTs; emit BEGIN ourselves
+@event.listens_for(engine, "connect")
+def _disable_pysqlite_begin(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+@event.listens_for(engine, "begin")
+def _emit_begin(conn):
+    conn.exec_driver_sql("BEGIN")
 
 # Test fixtures
+@pytest.fixture(scope="session", autouse=True)
+def _schema():
+    """Create the tables once for the whole test session."""
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
 @pytest.fixture
 def test_db():
-    """Create a fresh database for each test."""
-    Base.metadata.create_all(bind=engine)
-    db = TestingSessionLocal()
+    """Give each test a session whose changes are rolled back afterwards."""
+    connection = engine.connect()
+    transaction = connection.begin()
+    # Commits inside the test only release a savepoint; the outer transaction is rolled back on teardown
+    db = TestingSessionLocal(bind=connection, join_transaction_mode="create_savepoint")
     try:
         yield db
     finally:
         db.close()
-        # Drop all tables after the test is complete
-        Base.metadata.drop_all(bind=engine)
+        transaction.rollback()
+        connection.close()
+
+@pytest.fixture(scope="session")
+def _client_session():
+    """Start the app once and share its test client across the session."""
+    # Startup, warmup and feedback flushes go through the app's engine and SessionLocal
+    app_bind = database.SessionLocal.kw["bind"]
+    database.SessionLocal.configure(bind=engine)
+    try:
+        with patch.object(database, "engine", engine), TestClient(app) as client:
+            yield client
+    finally:
+        database.SessionLocal.configure(bind=app_bind)
 
 @pytest.fixture
-def client(test_db):
-    """Create a FastAPI test client with a test database."""
+def client(_client_session, test_db):
+    """Return the shared FastAPI test client wired to this test's database."""
     def override_get_db():
         try:
             yield test_db
@@ -50,8 +84,7 @@ def client(test_db):
             pass
     
     app.dependency_overrides[get_db] = override_get_db
-    with TestClient(app) as client:
-        yield client
+    yield _client_session
     app.dependency_overrides = {}
 
 @pytest.fixture
@@ -67,12 +100,12 @@ def asp_engine():
 @pytest.fixture
 def optimizer(mock_meta_llm, asp_engine):
     """Create a PromptOptimizer with mock components."""
-    optimizer = PromptOptimizer(api_key=None)
-    optimizer.meta_llm = mock_meta_llm
-    optimizer.asp_engine = asp_engine
-    return optimizer
+    # Hand the constructor the fixtures directly instead of building (and DB-loading) throwaway ones
+    with patch("app.services.prompt_optimizer.ASPEngine", return_value=asp_engine), \
+            patch("app.services.prompt_optimizer.MetaLLMAnalyzer", return_value=mock_meta_llm):
+        return PromptOptimizer(api_key=None)
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_prompt_data():
     """Return sample prompt data for testing."""
     return {
@@ -82,36 +115,3 @@ def sample_prompt_data():
         "target_model": "gpt-3.5-turbo",
         "domain": "education"
     }
-
-@pytest.fixture
-def component_types():
-    """Return all component types for testing."""
-    return [
-        ComponentType.INSTRUCTION,
-        ComponentType.CONTEXT,
-        ComponentType.EXAMPLE,
-        ComponentType.CONSTRAINT,
-        ComponentType.OUTPUT_FORMAT
-    ]
-
-@pytest.fixture
-def task_types():
-    """Return all task types for testing."""
-    return [
-        TaskType.DEDUCTION,
-        TaskType.INDUCTION,
-        TaskType.ABDUCTION,
-        TaskType.COMPARISON,
-        TaskType.COUNTERFACTUAL
-    ]
-
-@pytest.fixture
-def behavior_types():
-    """Return all behavior types for testing."""
-    return [
-        BehaviorType.PRECISION,
-        BehaviorType.CREATIVITY,
-        BehaviorType.STEP_BY_STEP,
-        BehaviorType.CONCISENESS,
-        BehaviorType.ERROR_CHECKING
-    ]
\ No newline at end of file
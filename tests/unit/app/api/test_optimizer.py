@@ -1,26 +1,50 @@
 import pytest
-from unittest.mock import patch, MagicMock
-from fastapi.testclient import TestClient
+import asyncio
+import json
+from datetime import datetime
+from unittest.mock import MagicMock, AsyncMock
+from fastapi import BackgroundTasks
 from app.main import app
-from app.api.optimizer import router, get_optimizer
+from app.api.optimizer import router, get_optimizer, optimize_prompt, _coalesced_optimize
+from app.models.database import OptimizedPromptDB, PromptComponentDB
 from app.models.prompt import (
     OptimizationRequest, OptimizedPrompt, PromptComponent,
     ComponentType, TaskType, BehaviorType
 )
 
-# Create a test client
-client = TestClient(app)
+@pytest.fixture
+def mock_optimizer():
+    """Override the cached optimizer dependency with a mock."""
+    mock_optimizer = MagicMock()
+    app.dependency_overrides[get_optimizer] = lambda: mock_optimizer
+    yield mock_optimizer
+    app.dependency_overrides.pop(get_optimizer, None)
+
+@pytest.fixture
+def make_prompt(test_db):
+    """Return a factory that adds an optimized prompt row, overriding any default field."""
+    created_at = datetime.now().isoformat()
+    
+    def _make_prompt(**overrides):
+        prompt = OptimizedPromptDB(**{
+            "user_prompt": "Test prompt",
+            "optimized_prompt": "Optimized prompt",
+            "target_model": "gpt-4",
+            "effectiveness_score": 85.5,
+            "rationale": "Test rationale",
+            "created_at": created_at,
+            **overrides
+        })
+        test_db.add(prompt)
+        return prompt
+    
+    return _make_prompt
 
 class TestOptimizerAPI:
     """Tests for optimizer API endpoints."""
     
-    @patch('app.api.optimizer.get_optimizer')
-    def test_optimize_prompt_endpoint(self, mock_get_optimizer, sample_prompt_data):
+    def test_optimize_prompt_endpoint(self, client, mock_optimizer, sample_prompt_data):
         """Test the optimize prompt endpoint."""
-        # Setup mock optimizer
-        mock_optimizer = MagicMock()
-        mock_get_optimizer.return_value = mock_optimizer
-        
         # Mock the optimize method
         mock_components = [
             PromptComponent(type=ComponentType.INSTRUCTION, content="Test content", position=1)
@@ -31,7 +55,7 @@ class TestOptimizerAPI:
             rationale="Test rationale",
             effectiveness_score=85.5
         )
-        mock_optimizer.optimize.return_value = mock_result
+        mock_optimizer.optimize_async = AsyncMock(return_value=mock_result)
         
         # Make request
         response = client.post("/api/v1/optimize", json=sample_prompt_data)
@@ -44,38 +68,141 @@ class TestOptimizerAPI:
         assert json_response["effectiveness_score"] == 85.5
         assert len(json_response["components"]) == 1
         
-        # Verify optimizer called
-        mock_optimizer.optimize.assert_called_once()
+        # Verify the endpoint, not the optimizer, saves the result after the response
+        mock_optimizer.optimize_async.assert_awaited_once_with(OptimizationRequest(**sample_prompt_data), save=False, strict=True)
+        mock_optimizer.save_result.assert_called_once()
+        assert mock_optimizer.save_result.call_args.args[1].full_prompt == "Test full prompt"
         
-    @patch('app.api.optimizer.get_optimizer')
-    def test_optimize_prompt_error(self, mock_get_optimizer, sample_prompt_data):
-        """Test the optimize prompt endpoint with error."""
+    def test_optimize_prompt_cached(self, client, mock_optimizer, sample_prompt_data):
+        """Test that repeated optimizations are served from the response cache."""
+        mock_optimizer.optimize_async = AsyncMock(return_value=OptimizedPrompt(
+            components=[PromptComponent(type=ComponentType.INSTRUCTION, content="Test content", position=1)],
+            full_prompt="Test full prompt",
+            rationale="Test rationale",
+            effectiveness_score=85.5
+        ))
+        hits = client.get("/api/v1/health").json()["cache"]["optimize"]["hits"]
+        
+        for _ in range(2):
+            response = client.post("/api/v1/optimize", json=sample_prompt_data)
+            assert response.status_code == 200
+            assert response.json()["full_prompt"] == "Test full prompt"
+        
+        # Verify the optimization ran only once but the repeat still went into the history
+        assert mock_optimizer.optimize_async.await_count == 1
+        assert client.get("/api/v1/health").json()["cache"]["optimize"]["hits"] == hits + 1
+        assert mock_optimizer.save_result.call_count == 2
+        assert mock_optimizer.save_result.call_args.args[1].full_prompt == "Test full prompt"
+        
+        # Prompts differing only in whitespace are optimized separately, since content echoes the prompt
+        spaced = {**sample_prompt_data, "user_prompt": "  Explain quantum computing\nto a 10-year-old "}
+        assert client.post("/api/v1/optimize", json=spaced).status_code == 200
+        assert mock_optimizer.optimize_async.await_count == 2
+    
+    def test_optimize_prompt_error(self, client, mock_optimizer, sample_prompt_data):
+        """Test a failed optimization answers with the fallback prompt without caching or saving it."""
         # Setup mock optimizer to raise exception
-        mock_optimizer = MagicMock()
-        mock_get_optimizer.return_value = mock_optimizer
-        mock_optimizer.optimize.side_effect = Exception("Test exception")
+        mock_optimizer.optimize_async = AsyncMock(side_effect=Exception("Test exception"))
+        mock_optimizer.fallback_result.return_value = OptimizedPrompt(
+            components=[PromptComponent(type=ComponentType.INSTRUCTION, content="Fallback content", position=1)],
+            full_prompt="Fallback content",
+            rationale="Fallback rationale",
+            effectiveness_score=50.0
+        )
         
-        # Make request
-        response = client.post("/api/v1/optimize", json=sample_prompt_data)
+        for _ in range(2):
+            response = client.post("/api/v1/optimize", json=sample_prompt_data)
+            assert response.status_code == 200
+            assert response.json()["full_prompt"] == "Fallback content"
         
-        # Verify response
-        assert response.status_code == 500
-        assert "Test exception" in response.json()["detail"]
+        # Verify the repeat ran again instead of hitting the cache, and nothing went into the history
+        assert mock_optimizer.optimize_async.await_count == 2
+        mock_optimizer.save_result.assert_not_called()
     
-    @patch('app.api.optimizer.get_optimizer')
-    def test_analyze_prompt_endpoint(self, mock_get_optimizer):
-        """Test the analyze prompt endpoint."""
-        # Setup mock optimizer
-        mock_optimizer = MagicMock()
-        mock_get_optimizer.return_value = mock_optimizer
+    def test_optimize_stream_endpoint(self, client, mock_optimizer, sample_prompt_data):
+        """Test the streaming optimize endpoint emits one JSON event per line."""
+        result = OptimizedPrompt(
+            components=[PromptComponent(type=ComponentType.INSTRUCTION, content="Test content", position=1)],
+            full_prompt="Test content",
+            rationale="Test rationale",
+            effectiveness_score=85.5
+        )
+        
+        async def optimize_stream(request, background_tasks=None):
+            yield "structure", {"components": [{"type": "instruction", "position": 1}], "effectiveness_score": 85.5}
+            yield "result", result
+        
+        mock_optimizer.optimize_stream = optimize_stream
+        
+        response = client.post("/api/v1/optimize/stream", json=sample_prompt_data)
         
-        # Mock the analyze_task method
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        events = [json.loads(line) for line in response.text.splitlines()]
+        assert [event["event"] for event in events] == ["structure", "result"]
+        assert events[0]["components"] == [{"type": "instruction", "position": 1}]
+        assert events[1]["result"]["full_prompt"] == "Test content"
+        assert events[1]["result"]["components"][0]["type"] == "instruction"
+    
+    def test_optimize_coalesces_identical_requests(self, sample_prompt_data):
+        """Test that concurrent identical optimizations share a single run."""
+        async def slow_optimize(request, save=True, strict=False):
+            await asyncio.sleep(0.05)
+            return "optimized"
+        
+        optimizer = MagicMock()
+        optimizer.optimize_async = AsyncMock(side_effect=slow_optimize)
+        request = OptimizationRequest(**sample_prompt_data)
+        
+        async def run_concurrently():
+            return await asyncio.gather(*[_coalesced_optimize(optimizer, request) for _ in range(3)])
+        
+        results = asyncio.run(run_concurrently())
+        
+        assert results == ["optimized"] * 3
+        optimizer.optimize_async.assert_awaited_once_with(request, save=False, strict=True)
+    
+    def test_optimize_coalesced_requests_each_saved(self, sample_prompt_data):
+        """Test that every request sharing a run queues its own history write."""
+        result = OptimizedPrompt(
+            components=[PromptComponent(type=ComponentType.INSTRUCTION, content="Test content", position=1)],
+            full_prompt="Test content",
+            rationale="Test rationale",
+            effectiveness_score=85.5
+        )
+        
+        async def slow_optimize(request, save=True, strict=False):
+            await asyncio.sleep(0.05)
+            return result
+        
+        optimizer = MagicMock()
+        optimizer.optimize_async = AsyncMock(side_effect=slow_optimize)
+        request = OptimizationRequest(**sample_prompt_data)
+        background_tasks = [BackgroundTasks() for _ in range(3)]
+        
+        async def run_concurrently():
+            return await asyncio.gather(*[
+                optimize_prompt(request, None, tasks, optimizer) for tasks in background_tasks
+            ])
+        
+        responses = asyncio.run(run_concurrently())
+        
+        assert all(response.status_code == 200 for response in responses)
+        optimizer.optimize_async.assert_awaited_once()
+        for tasks in background_tasks:
+            assert len(tasks.tasks) == 1
+            assert tasks.tasks[0].func is optimizer.save_result
+            assert tasks.tasks[0].args == (request, result)
+    
+    def test_analyze_prompt_endpoint(self, client, mock_optimizer):
+        """Test the analyze prompt endpoint."""
+        # Mock the analyze_task_async method
         mock_analysis = {
             "detected_tasks": [TaskType.DEDUCTION],
             "detected_behaviors": [BehaviorType.PRECISION, BehaviorType.STEP_BY_STEP],
             "domain_hint": "education"
         }
-        mock_optimizer.meta_llm.analyze_task.return_value = mock_analysis
+        mock_optimizer.meta_llm.analyze_task_async = AsyncMock(return_value=mock_analysis)
         
         # Make request
         response = client.post("/api/v1/analyze", json={"text": "Explain quantum computing"})
@@ -91,22 +218,35 @@ class TestOptimizerAPI:
         assert "processing_time" in json_response
         
         # Verify optimizer called
-        mock_optimizer.meta_llm.analyze_task.assert_called_once_with("Explain quantum computing")
+        mock_optimizer.meta_llm.analyze_task_async.assert_awaited_once_with("Explain quantum computing")
+    
+    def test_analyze_prompt_cached(self, client, mock_optimizer):
+        """Test that repeated analyses of the same text reuse the cached result."""
+        mock_optimizer.meta_llm.analyze_task_async = AsyncMock(return_value={
+            "detected_tasks": [TaskType.INDUCTION],
+            "detected_behaviors": [BehaviorType.CREATIVITY],
+            "domain_hint": None
+        })
+        
+        for _ in range(2):
+            response = client.post("/api/v1/analyze", json={"text": "Write a poem about caching"})
+            assert response.status_code == 200
+            assert response.json()["detected_tasks"] == ["induction"]
+        
+        # Verify the analysis ran only once
+        mock_optimizer.meta_llm.analyze_task_async.assert_awaited_once_with("Write a poem about caching")
     
-    def test_analyze_prompt_validation(self):
+    def test_analyze_prompt_validation(self, client):
         """Test analyze prompt input validation."""
         # Missing text field
         response = client.post("/api/v1/analyze", json={})
         assert response.status_code == 400
         assert "Text field is required" in response.json()["detail"]
     
-    @patch('app.api.optimizer.get_optimizer')
-    def test_analyze_prompt_error(self, mock_get_optimizer):
+    def test_analyze_prompt_error(self, client, mock_optimizer):
         """Test the analyze prompt endpoint with error."""
         # Setup mock optimizer to raise exception
-        mock_optimizer = MagicMock()
-        mock_get_optimizer.return_value = mock_optimizer
-        mock_optimizer.meta_llm.analyze_task.side_effect = Exception("Test exception")
+        mock_optimizer.meta_llm.analyze_task_async = AsyncMock(side_effect=Exception("Test exception"))
         
         # Make request
         response = client.post("/api/v1/analyze", json={"text": "Test"})
@@ -115,13 +255,10 @@ class TestOptimizerAPI:
         assert response.status_code == 500
         assert "Test exception" in response.json()["detail"]
     
-    @patch('app.api.optimizer.get_optimizer')
-    def test_provide_feedback_endpoint(self, mock_get_optimizer):
+    def test_provide_feedback_endpoint(self, client, mock_optimizer):
         """Test the provide feedback endpoint."""
         # Setup mock optimizer
-        mock_optimizer = MagicMock()
-        mock_get_optimizer.return_value = mock_optimizer
-        mock_optimizer.provide_feedback.return_value = True
+        mock_optimizer.queue_feedback.return_value = True
         
         # Make request
         feedback_data = {
@@ -132,46 +269,35 @@ class TestOptimizerAPI:
         response = client.post("/api/v1/feedback", json=feedback_data)
         
         # Verify response
-        assert response.status_code == 200
+        assert response.status_code == 202
         json_response = response.json()
         assert json_response["status"] == "success"
         assert json_response["component_type"] == "instruction"
         assert json_response["effectiveness"] == 0.9
         
         # Verify optimizer called
-        mock_optimizer.provide_feedback.assert_called_once()
+        mock_optimizer.queue_feedback.assert_called_once_with(
+            ComponentType.INSTRUCTION, BehaviorType.PRECISION, 0.9
+        )
     
-    def test_provide_feedback_validation(self):
-        """Test feedback input validation."""
+    @pytest.mark.parametrize("feedback_data,expected_detail", [
         # Missing required fields
-        response = client.post("/api/v1/feedback", json={})
-        assert response.status_code == 400
-        assert "Missing required fields" in response.json()["detail"]
-        
+        ({}, "Missing required fields"),
         # Missing task_type or behavior_type
-        response = client.post("/api/v1/feedback", json={
-            "component_type": "instruction",
-            "effectiveness": 0.9
-        })
-        assert response.status_code == 400
-        assert "task_type or behavior_type" in response.json()["detail"]
-        
+        ({"component_type": "instruction", "effectiveness": 0.9}, "task_type or behavior_type"),
         # Invalid component_type
-        response = client.post("/api/v1/feedback", json={
-            "component_type": "invalid",
-            "behavior_type": "precision",
-            "effectiveness": 0.9
-        })
+        ({"component_type": "invalid", "behavior_type": "precision", "effectiveness": 0.9}, "Invalid input"),
+    ])
+    def test_provide_feedback_validation(self, client, feedback_data, expected_detail):
+        """Test feedback input validation."""
+        response = client.post("/api/v1/feedback", json=feedback_data)
         assert response.status_code == 400
-        assert "Invalid input" in response.json()["detail"]
+        assert expected_detail in response.json()["detail"]
     
-    @patch('app.api.optimizer.get_optimizer')
-    def test_provide_feedback_error(self, mock_get_optimizer):
+    def test_provide_feedback_error(self, client, mock_optimizer):
         """Test the provide feedback endpoint with error."""
         # Setup mock optimizer
-        mock_optimizer = MagicMock()
-        mock_get_optimizer.return_value = mock_optimizer
-        mock_optimizer.provide_feedback.return_value = False
+        mock_optimizer.queue_feedback.return_value = False
         
         # Make request
         feedback_data = {
@@ -185,21 +311,58 @@ class TestOptimizerAPI:
         assert response.status_code == 500
         assert "Failed to process feedback" in response.json()["detail"]
     
-    def test_get_history_endpoint(self, test_db):
+    def test_batch_endpoint(self, client, mock_optimizer, sample_prompt_data, monkeypatch):
+        """Test that a batch runs each operation through its endpoint and keeps their order."""
+        mock_optimizer.optimize_async = AsyncMock(return_value=OptimizedPrompt(
+            components=[PromptComponent(type=ComponentType.INSTRUCTION, content="Test content", position=1)],
+            full_prompt="Test full prompt",
+            rationale="Test rationale",
+            effectiveness_score=85.5
+        ))
+        mock_optimizer.meta_llm.analyze_task_async = AsyncMock(return_value={
+            "detected_tasks": [TaskType.DEDUCTION],
+            "detected_behaviors": [BehaviorType.PRECISION],
+            "domain_hint": None
+        })
+        mock_optimizer.queue_feedback.return_value = True
+        
+        response = client.post("/api/v1/batch", json={"ops": [
+            {"op": "optimize", "body": sample_prompt_data},
+            {"op": "analyze", "body": {"text": "Explain batching"}},
+            {"op": "feedback", "body": {"component_type": "instruction", "behavior_type": "precision", "effectiveness": 0.9}},
+            {"op": "optimize", "body": {"target_model": "gpt-4"}},
+            {"op": "analyze", "body": {}},
+            {"op": "analyze", "body": {"text": 42}},
+        ]})
+        
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [(r["op"], r["status_code"]) for r in results] == [
+            ("optimize", 200), ("analyze", 200), ("feedback", 202), ("optimize", 422), ("analyze", 400), ("analyze", 422)
+        ]
+        assert results[0]["body"]["full_prompt"] == "Test full prompt"
+        assert results[1]["body"]["detected_tasks"] == ["deduction"]
+        assert results[2]["body"]["status"] == "success"
+        assert results[3]["body"]["detail"][0]["loc"] == ["user_prompt"]
+        assert results[5]["body"]["detail"][0]["loc"] == ["text"]
+        
+        # Unexpected errors fail only their own operation
+        monkeypatch.setattr("app.api.optimizer.analyze_prompt", AsyncMock(side_effect=RuntimeError("Test exception")))
+        response = client.post("/api/v1/batch", json={"ops": [
+            {"op": "analyze", "body": {"text": "Explain failures"}},
+            {"op": "feedback", "body": {"component_type": "instruction", "behavior_type": "precision", "effectiveness": 0.9}},
+        ]})
+        assert [r["status_code"] for r in response.json()["results"]] == [500, 202]
+        assert response.json()["results"][0]["body"] == {"detail": "Internal server error"}
+        
+        # Unknown operations are rejected as a whole
+        response = client.post("/api/v1/batch", json={"ops": [{"op": "history", "body": {}}]})
+        assert response.status_code == 422
+    
+    def test_get_history_endpoint(self, client, test_db, make_prompt):
         """Test the get history endpoint."""
         # Add test data to the database
-        from app.models.database import OptimizedPromptDB
-        from datetime import datetime
-        
-        prompt = OptimizedPromptDB(
-            user_prompt="Test prompt",
-            optimized_prompt="Optimized prompt",
-            target_model="gpt-4",
-            effectiveness_score=85.5,
-            rationale="Test rationale",
-            created_at=datetime.now().isoformat()
-        )
-        test_db.add(prompt)
+        make_prompt()
         test_db.commit()
         
         # Make request
@@ -214,32 +377,12 @@ class TestOptimizerAPI:
         assert len(json_response["items"]) == 1
         assert json_response["items"][0]["user_prompt"] == "Test prompt"
     
-    def test_get_history_with_filter(self, test_db):
+    def test_get_history_with_filter(self, client, test_db, make_prompt):
         """Test the get history endpoint with filter."""
         # Add test data to the database
-        from app.models.database import OptimizedPromptDB
-        from datetime import datetime
-        
-        prompt1 = OptimizedPromptDB(
-            user_prompt="Test prompt 1",
-            optimized_prompt="Optimized prompt 1",
-            target_model="gpt-4",
-            effectiveness_score=85.5,
-            rationale="Test rationale",
-            created_at=datetime.now().isoformat()
-        )
-        
-        prompt2 = OptimizedPromptDB(
-            user_prompt="Test prompt 2",
-            optimized_prompt="Optimized prompt 2",
-            target_model="claude",
-            effectiveness_score=90.0,
-            rationale="Test rationale",
-            created_at=datetime.now().isoformat()
-        )
-        
-        test_db.add(prompt1)
-        test_db.add(prompt2)
+        make_prompt(user_prompt="Test prompt 1", optimized_prompt="Optimized prompt 1")
+        make_prompt(user_prompt="Test prompt 2", optimized_prompt="Optimized prompt 2",
+                    target_model="claude", effectiveness_score=90.0)
         test_db.commit()
         
         # Make request with model filter
@@ -251,23 +394,49 @@ class TestOptimizerAPI:
         assert len(json_response["items"]) == 1
         assert json_response["items"][0]["target_model"] == "gpt-4"
     
-    def test_get_prompt_by_id_endpoint(self, test_db):
+    def test_get_history_truncates_long_prompts(self, client, test_db, make_prompt):
+        """Test that long user prompts are shortened in the history list."""
+        make_prompt(user_prompt="x" * 150)
+        test_db.commit()
+        
+        response = client.get("/api/v1/history")
+        
+        assert response.status_code == 200
+        assert response.json()["items"][0]["user_prompt"] == "x" * 100 + "..."
+    
+    def test_get_history_pagination(self, client, test_db, make_prompt):
+        """Test that the total is reported for every page, including past the end."""
+        for i in range(3):
+            make_prompt(user_prompt=f"Test prompt {i}", created_at=datetime(2024, 1, i + 1).isoformat())
+        test_db.commit()
+        
+        # Middle page, newest first
+        response = client.get("/api/v1/history?limit=1&offset=1")
+        assert response.status_code == 200
+        json_response = response.json()
+        assert json_response["total"] == 3
+        assert [item["user_prompt"] for item in json_response["items"]] == ["Test prompt 1"]
+        
+        # Past the last page
+        response = client.get("/api/v1/history?limit=10&offset=5")
+        assert response.status_code == 200
+        json_response = response.json()
+        assert json_response["total"] == 3
+        assert json_response["items"] == []
+    
+    def test_get_prompt_by_id_endpoint(self, client, test_db, make_prompt):
         """Test the get prompt by id endpoint."""
         # Add test data to the database
-        from app.models.database import OptimizedPromptDB, PromptComponentDB
-        from datetime import datetime
-        
-        prompt = OptimizedPromptDB(
-            user_prompt="Test prompt",
-            optimized_prompt="Optimized prompt",
-            target_model="gpt-4",
-            effectiveness_score=85.5,
-            rationale="Test rationale",
-            created_at=datetime.now().isoformat()
-        )
-        test_db.add(prompt)
+        prompt = make_prompt()
         test_db.flush()
         
+        # Insert out of order to check components come back sorted by position
+        test_db.add(PromptComponentDB(
+            prompt_id=prompt.id,
+            component_type="example",
+            content="Example content",
+            position=2
+        ))
         component = PromptComponentDB(
             prompt_id=prompt.id,
             component_type="instruction",
@@ -288,12 +457,13 @@ class TestOptimizerAPI:
         assert json_response["target_model"] == "gpt-4"
         assert json_response["effectiveness_score"] == 85.5
         assert json_response["rationale"] == "Test rationale"
-        assert len(json_response["components"]) == 1
+        assert len(json_response["components"]) == 2
+        assert [comp["position"] for comp in json_response["components"]] == [1, 2]
         assert json_response["components"][0]["type"] == "instruction"
         assert json_response["components"][0]["content"] == "Test content"
         assert json_response["components"][0]["position"] == 1
     
-    def test_get_prompt_by_id_not_found(self):
+    def test_get_prompt_by_id_not_found(self, client, test_db):
         """Test the get prompt by id endpoint with non-existent id."""
         # Make request with non-existent id
         response = client.get("/api/v1/history/999")
@@ -302,7 +472,7 @@ class TestOptimizerAPI:
         assert response.status_code == 404
         assert "not found" in response.json()["detail"]
     
-    def test_health_check_endpoint(self):
+    def test_health_check_endpoint(self, client):
         """Test the health check endpoint."""
         response = client.get("/api/v1/health")
         
@@ -310,4 +480,9 @@ class TestOptimizerAPI:
         json_response = response.json()
         assert json_response["status"] == "healthy"
         assert "version" in json_response
-        assert "timestamp" in json_response
\ No newline at end of file
+        assert "timestamp" in json_response
+        assert set(json_response["cache"]) == {"analyze", "optimize"}
+    
+    def test_get_optimizer_is_cached(self):
+        """Test that the optimizer dependency is built once and reused."""
+        assert asyncio.run(get_optimizer()) is asyncio.run(get_optimizer())
@@ -1,15 +1,54 @@
 import pytest
+import clingo
+from types import SimpleNamespace
 from unittest.mock import patch, MagicMock
 from app.core.asp_engine import ASPEngine
 from app.models.prompt import ComponentType, TaskType, BehaviorType, PromptComponent
 
+# Real clingo symbols for stubbed models; the engine reads them through clingo's typed accessors
+POSITION_SYMBOL = clingo.Function("prompt_position", [clingo.Function("instruction"), clingo.Number(1)])
+EFFECTIVENESS_SYMBOL = clingo.Function("effectiveness", [clingo.Number(100)])
+
+# Hardcoded structure returned whenever the solver can't produce a model
+EXPECTED_FALLBACK_POSITIONS = {
+    ComponentType.INSTRUCTION: 1,
+    ComponentType.CONTEXT: 2,
+    ComponentType.EXAMPLE: 3,
+    ComponentType.CONSTRAINT: 4,
+    ComponentType.OUTPUT_FORMAT: 5,
+}
+
+def _model(*symbols, cost=()):
+    """Build a stand-in for the clingo.Model passed to on_model"""
+    return SimpleNamespace(symbols=lambda shown=True: list(symbols), cost=list(cost))
+
+@pytest.fixture(scope="module")
+def engine():
+    """One engine shared by the tests that only read from it; tests that update or solve build their own."""
+    return ASPEngine(load_from_db=False)
+
+@pytest.fixture
+def mock_control(monkeypatch):
+    """Replace clingo.Control so solves never reach the real solver"""
+    control = MagicMock()
+    monkeypatch.setattr("app.core.asp_engine.clingo.Control", control)
+    return control
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    """Mocked session handed out by SessionLocal.begin() for the efficacy update tests"""
+    session_local = MagicMock()
+    monkeypatch.setattr("app.models.database.SessionLocal", session_local)
+    db = session_local.begin.return_value.__enter__.return_value
+    db.get_bind.return_value.dialect.name = "mysql"  # No ON CONFLICT support
+    db.execute.return_value.scalars.return_value.all.return_value = []
+    return db
+
 class TestASPEngine:
     """Tests for ASPEngine class."""
     
-    def test_init(self):
+    def test_init(self, engine):
         """Test initialization of ASP engine."""
-        engine = ASPEngine(load_from_db=False)
-        
         # Verify default values
         assert isinstance(engine.base_program, str)
         assert len(engine.component_efficacy) > 0
@@ -18,58 +57,31 @@ class TestASPEngine:
         assert len(engine.model_adjustments) > 0
         assert len(engine.domain_adjustments) > 0
     
-    def test_generate_asp_facts(self):
-        """Test generation of ASP facts."""
-        engine = ASPEngine(load_from_db=False)
-        
-        # Test with minimal inputs
-        tasks = (TaskType.DEDUCTION,)
-        behaviors = (BehaviorType.PRECISION,)
-        
-        facts = engine.generate_asp_facts(tasks, behaviors)
-        
-        # Basic verification
-        assert "target_task(deduction)" in facts
-        assert "target_behavior(precision)" in facts
-        assert "component_efficacy" in facts
-        assert "position_effect" in facts
-        assert "weight" in facts
-        
-        # Test with model and domain
-        facts_with_model = engine.generate_asp_facts(
-            tasks, behaviors, target_model="gpt-4", domain="legal"
-        )
-        
-        # Additional verification
-        assert "target_model(gpt-4)" in facts_with_model
-        assert "target_domain(legal)" in facts_with_model
-        assert "model_specific_efficacy" in facts_with_model
-        assert "domain_efficacy" in facts_with_model
+    def test_base_program_shared(self, engine):
+        """Test that every engine reuses the same base program."""
+        assert ASPEngine().base_program is engine.base_program
+    
+    def test_program_facts(self, engine):
+        """Test the grounded program carries every adjustment but no component efficacies."""
+        program = engine._base_plus_static
+        
+        assert "position_effect" in program
+        assert "weight" in program
+        assert "model_specific_efficacy(\"gpt-4\"" in program
+        assert "domain_efficacy(\"legal\"" in program
+        assert "component_efficacy(" not in program
     
-    @patch('clingo.Control')
     def test_solve_success(self, mock_control):
         """Test successful solving."""
         # Setup mock
-        mock_model = MagicMock()
-        mock_symbol1 = MagicMock()
-        mock_symbol1.name = "prompt_position"
-        mock_symbol1.arguments = [MagicMock(), MagicMock()]
-        mock_symbol1.arguments[0].__str__.return_value = "instruction"
-        mock_symbol1.arguments[1].__str__.return_value = "1"
-        
-        mock_symbol2 = MagicMock()
-        mock_symbol2.name = "effectiveness"
-        mock_symbol2.arguments = [MagicMock()]
-        mock_symbol2.arguments[0].__str__.return_value = "100"
-        
-        mock_model.symbols.return_value = [mock_symbol1, mock_symbol2]
+        mock_model = _model(POSITION_SYMBOL, EFFECTIVENESS_SYMBOL)
         
         mock_control_instance = MagicMock()
         mock_control.return_value = mock_control_instance
         mock_control_instance.solve.side_effect = lambda on_model: on_model(mock_model)
         
         # Test solve method
-        engine = ASPEngine(load_from_db=False)
+        engine = ASPEngine(load_from_db=False, use_clingo=True)
         components, score = engine.solve(
             target_tasks=[TaskType.DEDUCTION],
             target_behaviors=[BehaviorType.PRECISION]
@@ -87,7 +99,185 @@ class TestASPEngine:
         mock_control_instance.ground.assert_called_once()
         mock_control_instance.solve.assert_called_once()
     
-    @patch('clingo.Control')
+    def test_solve_stops_at_ranked_optimum(self, mock_control):
+        """Test that the search ends once a model reaches the cost of the ranked structure."""
+        engine = ASPEngine(load_from_db=False, use_clingo=True)
+        improving_model = _model(cost=[-100, 0, 1, 2, 3, 4, 5])
+        best_model = _model(cost=engine._best_cost)
+        continues = []
+        
+        def solve(on_model):
+            continues.append(on_model(improving_model))
+            continues.append(on_model(best_model))
+        
+        mock_control.return_value.solve.side_effect = solve
+        engine.solve(target_tasks=[TaskType.DEDUCTION], target_behaviors=[BehaviorType.PRECISION])
+        
+        assert continues == [True, False]
+    
+    def test_solve_cached(self, mock_control):
+        """Test that repeated solves are served from the solve cache."""
+        # Setup mock
+        mock_model = _model(POSITION_SYMBOL)
+        
+        mock_control_instance = MagicMock()
+        mock_control.return_value = mock_control_instance
+        mock_control_instance.solve.side_effect = lambda on_model: on_model(mock_model)
+        
+        # Solve the same request twice, with targets in a different order
+        engine = ASPEngine(load_from_db=False, use_clingo=True)
+        first, _ = engine.solve(
+            target_tasks=[TaskType.DEDUCTION, TaskType.INDUCTION],
+            target_behaviors=[BehaviorType.PRECISION]
+        )
+        first[0].content = "Generated content"
+        second, _ = engine.solve(
+            target_tasks=[TaskType.INDUCTION, TaskType.DEDUCTION],
+            target_behaviors=[BehaviorType.PRECISION]
+        )
+        
+        # Verify clingo only ran once and the cached components were not mutated
+        mock_control.assert_called_once()
+        assert second[0].type == ComponentType.INSTRUCTION
+        assert second[0].content == "[INSTRUCTION CONTENT]"
+    
+    def test_solve_cache_survives_feedback(self, mock_control):
+        """Test that efficacy feedback doesn't invalidate cached solves, since the program doesn't read it."""
+        mock_model = _model(POSITION_SYMBOL)
+        mock_control.return_value.solve.side_effect = lambda on_model: on_model(mock_model)
+        
+        engine = ASPEngine(load_from_db=False, use_clingo=True)
+        engine.solve(target_tasks=[TaskType.DEDUCTION], target_behaviors=[BehaviorType.PRECISION])
+        engine.apply_efficacy([(ComponentType.INSTRUCTION, TaskType.DEDUCTION, 0.52)])
+        engine.solve(target_tasks=[TaskType.DEDUCTION], target_behaviors=[BehaviorType.PRECISION])
+        
+        assert mock_control.return_value.solve.call_count == 1
+    
+    def test_solve_cache_expires(self, mock_control):
+        """Test that cached solutions are recomputed once their TTL has passed."""
+        from cachetools import TTLCache
+        from app.core.asp_engine import SOLVE_CACHE_SIZE, SOLVE_CACHE_TTL
+        
+        mock_model = _model()
+        mock_control.return_value.solve.side_effect = lambda on_model: on_model(mock_model)
+        
+        now = [0.0]
+        engine = ASPEngine(load_from_db=False, use_clingo=True)
+        engine._solve_cache = TTLCache(maxsize=SOLVE_CACHE_SIZE, ttl=SOLVE_CACHE_TTL, timer=lambda: now[0])
+        
+        engine.solve(target_tasks=[TaskType.DEDUCTION], target_behaviors=[BehaviorType.PRECISION])
+        engine.solve(target_tasks=[TaskType.DEDUCTION], target_behaviors=[BehaviorType.PRECISION])
+        assert mock_control.return_value.solve.call_count == 1
+        
+        now[0] += SOLVE_CACHE_TTL + 1
+        engine.solve(target_tasks=[TaskType.DEDUCTION], target_behaviors=[BehaviorType.PRECISION])
+        assert mock_control.return_value.solve.call_count == 2
+    
+    def test_solve_reuses_grounded_control(self, mock_control):
+        """Test that the program is grounded once and only the targets change per solve."""
+        mock_control_instance = MagicMock()
+        mock_control.return_value = mock_control_instance
+        
+        engine = ASPEngine(load_from_db=False, use_clingo=True)
+        engine.solve(target_tasks=[TaskType.DEDUCTION], target_behaviors=[BehaviorType.PRECISION])
+        engine.solve(target_tasks=[TaskType.INDUCTION], target_behaviors=[BehaviorType.CREATIVITY])
+        
+        # Verify grounding happened once while both requests were solved
+        mock_control.assert_called_once()
+        mock_control_instance.ground.assert_called_once()
+        assert mock_control_instance.solve.call_count == 2
+        assert mock_control_instance.assign_external.called
+    
+    def test_solve_keeps_grounded_control_after_feedback(self, mock_control):
+        """Test that efficacy changes neither re-ground nor touch externals on the pooled solver."""
+        mock_control_instance = MagicMock()
+        mock_control.return_value = mock_control_instance
+        
+        engine = ASPEngine(load_from_db=False, use_clingo=True)
+        engine.solve(target_tasks=[TaskType.DEDUCTION], target_behaviors=[BehaviorType.PRECISION])
+        engine.apply_efficacy([(ComponentType.INSTRUCTION, TaskType.DEDUCTION, 0.52)])
+        engine.solve(target_tasks=[TaskType.DEDUCTION], target_behaviors=[BehaviorType.PRECISION])
+        
+        # Verify the program was grounded once and only target externals were assigned
+        assert mock_control.call_count == 1
+        assert mock_control_instance.solve.call_count == 2
+        assigned = {call.args[0].name for call in mock_control_instance.assign_external.call_args_list}
+        assert "component_efficacy" not in assigned
+    
+    def test_solve_bounds_concurrent_solvers(self, mock_control, monkeypatch):
+        """Test that concurrent solves share at most CLINGO_POOL_SIZE grounded solvers."""
+        import threading
+        import time
+        
+        monkeypatch.setattr("app.core.asp_engine.CLINGO_POOL_SIZE", 2)
+        
+        active = 0
+        peak = 0
+        counter_lock = threading.Lock()
+        
+        def slow_solve(on_model):
+            nonlocal active, peak
+            with counter_lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.02)
+            with counter_lock:
+                active -= 1
+        
+        mock_control.side_effect = lambda *args: MagicMock(**{"solve.side_effect": slow_solve})
+        engine = ASPEngine(load_from_db=False, use_clingo=True)
+        
+        # Distinct targets so no request is answered from the solve cache
+        threads = [
+            threading.Thread(target=engine.solve, args=([task], [behavior]))
+            for task, behavior in zip(TaskType, BehaviorType)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert peak <= 2
+        assert mock_control.call_count <= 2
+    
+    def test_solve_concurrent_offloaded(self, mock_control):
+        """Test concurrent solves offloaded to worker threads, as the async optimizer does."""
+        import asyncio
+        import anyio.to_thread
+        
+        mock_model = _model(POSITION_SYMBOL, EFFECTIVENESS_SYMBOL)
+        mock_control.return_value.solve.side_effect = lambda on_model: on_model(mock_model)
+        engine = ASPEngine(load_from_db=False, use_clingo=True)
+        
+        async def solve_all():
+            return await asyncio.gather(*(
+                anyio.to_thread.run_sync(engine.solve, [task], [behavior])
+                for task, behavior in zip(TaskType, BehaviorType)
+            ))
+        
+        results = asyncio.run(solve_all())
+        
+        # Verify every request got its own components from the stubbed model
+        assert len(results) == len(TaskType)
+        assert all(score == 100.0 for _, score in results)
+        assert all([(comp.type, comp.position) for comp in components] == [(ComponentType.INSTRUCTION, 1)]
+                   for components, _ in results)
+        assert len({id(components[0]) for components, _ in results}) == len(results)
+    
+    def test_solve_regrounds_after_reload(self, mock_control):
+        """Test that pooled solvers are not reused once the efficacy tables are reloaded."""
+        mock_control.return_value = MagicMock()
+        
+        engine = ASPEngine(load_from_db=False, use_clingo=True)
+        engine.solve(target_tasks=[TaskType.DEDUCTION], target_behaviors=[BehaviorType.PRECISION])
+        with engine._lock:
+            engine._rebuild_static_facts()
+        engine._solve_cache.clear()
+        engine.solve(target_tasks=[TaskType.DEDUCTION], target_behaviors=[BehaviorType.PRECISION])
+        
+        # Verify a fresh program was grounded for the new facts
+        assert mock_control.call_count == 2
+    
     def test_solve_no_models(self, mock_control):
         """Test solving with no models found."""
         # Setup mock to return no models
@@ -96,115 +286,112 @@ class TestASPEngine:
         mock_control_instance.solve.return_value = None
         
         # Test solve method
-        engine = ASPEngine(load_from_db=False)
+        engine = ASPEngine(load_from_db=False, use_clingo=True)
         components, score = engine.solve(
             target_tasks=[TaskType.DEDUCTION],
             target_behaviors=[BehaviorType.PRECISION]
         )
         
-        # Verify fallback was used
+        # Verify the mocked solver ran and the fallback was used
+        mock_control.assert_called_once()
         assert len(components) == 5  # All component types
         assert score == 100.0  # Hardcoded score
         
         # Verify positions are correct
-        positions = {comp.type: comp.position for comp in components}
-        assert positions[ComponentType.INSTRUCTION] == 1
-        assert positions[ComponentType.CONTEXT] == 2
-        assert positions[ComponentType.EXAMPLE] == 3
-        assert positions[ComponentType.CONSTRAINT] == 4
-        assert positions[ComponentType.OUTPUT_FORMAT] == 5
+        assert {comp.type: comp.position for comp in components} == EXPECTED_FALLBACK_POSITIONS
     
-    @patch('clingo.Control')
     def test_solve_exception(self, mock_control):
         """Test solving with exception."""
         # Setup mock to raise exception
         mock_control.side_effect = Exception("Test exception")
         
         # Test solve method
-        engine = ASPEngine(load_from_db=False)
+        engine = ASPEngine(load_from_db=False, use_clingo=True)
         components, score = engine.solve(
             target_tasks=[TaskType.DEDUCTION],
             target_behaviors=[BehaviorType.PRECISION]
         )
         
-        # Verify fallback was used
+        # Verify the mocked solver was reached and the fallback was used
+        mock_control.assert_called_once()
         assert len(components) == 5  # All component types
         assert score == 100.0  # Hardcoded score
     
-    def test_fallback_solve(self):
-        """Test the fallback solve method."""
-        engine = ASPEngine(load_from_db=False)
-        components, score = engine._fallback_solve(
+    def test_solve_ranking(self):
+        """Test the Python ranking picks the optimal assignment deterministically."""
+        engine = ASPEngine(load_from_db=False, use_clingo=False)
+        components, score = engine.solve(
             target_tasks=[TaskType.DEDUCTION],
             target_behaviors=[BehaviorType.PRECISION]
         )
         
-        # Verify results
-        assert len(components) == 5
+        # Verify the best effectiveness and the position effects tie-break
         assert score == 100.0
-        
-        # Verify each component type is included once
-        component_types = [comp.type for comp in components]
-        assert ComponentType.INSTRUCTION in component_types
-        assert ComponentType.CONTEXT in component_types
-        assert ComponentType.EXAMPLE in component_types
-        assert ComponentType.CONSTRAINT in component_types
-        assert ComponentType.OUTPUT_FORMAT in component_types
+        positions = {comp.type: comp.position for comp in components}
+        assert positions[ComponentType.INSTRUCTION] == 1
+        assert positions[ComponentType.CONTEXT] == 2
+        assert positions[ComponentType.EXAMPLE] == 3
+        assert [comp.position for comp in components] == [1, 2, 3, 4, 5]
     
-    @patch('app.models.database.SessionLocal')
-    def test_update_efficacy(self, mock_session_local):
-        """Test updating efficacy values."""
-        # Setup mock
-        mock_db = MagicMock()
-        mock_session_local.return_value = mock_db
-        mock_db.query.return_value.filter.return_value.first.return_value = None
-        
+    def test_solve_ranking_is_precomputed(self):
+        """Test that solves reuse the ranked structure and get fresh components."""
+        engine = ASPEngine(load_from_db=False, use_clingo=False)
+        
+        with patch.object(engine, '_rank_assignments') as mock_rank:
+            first, _ = engine.solve([TaskType.DEDUCTION], [BehaviorType.PRECISION])
+            first[0].content = "Generated content"
+            second, _ = engine.solve([TaskType.INDUCTION], [BehaviorType.CREATIVITY])
+        
+        # Verify no ranking happened per request and components are not shared
+        mock_rank.assert_not_called()
+        assert second[0].content == "[INSTRUCTION CONTENT]"
+    
+    @pytest.mark.parametrize("position_effects", [
+        None,  # Defaults: constraint and output_format tie for positions 4 and 5
+        {},  # No position effects: every assignment with the top effectiveness ties
+        {(ComponentType.OUTPUT_FORMAT, 4): 0.6, (ComponentType.CONSTRAINT, 4): 0.6},
+        {(ComponentType.OUTPUT_FORMAT, 2): 0.9, (ComponentType.CONTEXT, 3): 0.9},
+    ])
+    def test_solve_ranking_matches_clingo(self, position_effects):
+        """Test the Python ranking reaches the same structure as the ASP program, ties included."""
+        ranked = ASPEngine(load_from_db=False, use_clingo=False)
+        solved = ASPEngine(load_from_db=False, use_clingo=True)
+        if position_effects is not None:
+            for engine in (ranked, solved):
+                engine.position_effects = dict(position_effects)
+                engine._rebuild_static_facts()
+        
+        ranked_components, ranked_score = ranked.solve([TaskType.COMPARISON], [BehaviorType.CONCISENESS], "claude", "code")
+        solved_components, solved_score = solved.solve([TaskType.COMPARISON], [BehaviorType.CONCISENESS], "claude", "code")
+        
+        assert ranked_score == solved_score
+        assert [(comp.type, comp.position) for comp in ranked_components] == \
+            [(comp.type, comp.position) for comp in solved_components]
+    
+    @pytest.mark.parametrize("key", [TaskType.DEDUCTION, BehaviorType.PRECISION])
+    def test_update_efficacy(self, mock_db, key):
+        """Test updating efficacy values for a task or a behavior."""
         # Test update method
         engine = ASPEngine(load_from_db=False)
-        engine.generate_asp_facts.cache_clear = MagicMock()  # Mock cache clear
-        
-        # Test with task type
-        component = ComponentType.INSTRUCTION
-        task = TaskType.DEDUCTION
-        new_value = 0.95
-        
-        engine.update_efficacy(component, task, new_value)
+        engine.update_efficacy(ComponentType.INSTRUCTION, key, 0.95)
         
         # Verify in-memory update
-        assert engine.component_efficacy[(component, task)] == new_value
-        
-        # Verify cache cleared
-        engine.generate_asp_facts.cache_clear.assert_called_once()
-        
-        # Verify DB update
-        mock_db.add.assert_called_once()
-        mock_db.commit.assert_called_once()
+        assert engine.component_efficacy[(ComponentType.INSTRUCTION, key)] == 0.95
         
-        # Test with behavior type
-        mock_db.reset_mock()
-        engine.generate_asp_facts.cache_clear.reset_mock()
-        
-        behavior = BehaviorType.PRECISION
-        engine.update_efficacy(component, behavior, new_value)
-        
-        # Verify calls
-        assert engine.component_efficacy[(component, behavior)] == new_value
-        engine.generate_asp_facts.cache_clear.assert_called_once()
-        mock_db.add.assert_called_once()
-        mock_db.commit.assert_called_once()
+        # Verify DB lookup and insert
+        assert mock_db.execute.call_count == 2
     
-    @patch('app.models.database.SessionLocal')
-    def test_update_efficacy_existing(self, mock_session_local):
+    def test_update_efficacy_existing(self, mock_db):
         """Test updating existing efficacy values."""
         # Setup mock for existing record
-        mock_db = MagicMock()
-        mock_session_local.return_value = mock_db
         mock_existing = MagicMock()
-        mock_db.query.return_value.filter.return_value.first.return_value = mock_existing
+        mock_existing.component_type = "instruction"
+        mock_existing.task_type = "deduction"
+        mock_existing.behavior_type = None
+        mock_db.execute.return_value.scalars.return_value.all.return_value = [mock_existing]
         
         # Test update method
         engine = ASPEngine(load_from_db=False)
-        engine.generate_asp_facts.cache_clear = MagicMock()  # Mock cache clear
         
         component = ComponentType.INSTRUCTION
         task = TaskType.DEDUCTION
@@ -215,61 +402,130 @@ class TestASPEngine:
         # Verify existing record updated
         assert mock_existing.efficacy_value == new_value
         
-        # Verify commit called but not add
-        mock_db.commit.assert_called_once()
-        mock_db.add.assert_not_called()
+        # Verify only the lookup was executed, no insert
+        assert mock_db.execute.call_count == 1
     
-    @patch('app.models.database.SessionLocal')
-    def test_load_efficacy_from_db(self, mock_session_local):
+    def test_bulk_update_efficacy(self, test_db):
+        """Test that bulk updates insert new rows and update existing ones in one transaction."""
+        from sqlalchemy.orm import sessionmaker
+        from app.models.database import ComponentEfficacyDB
+        
+        test_db.add(ComponentEfficacyDB(component_type="instruction", task_type="deduction", efficacy_value=0.5))
+        test_db.commit()
+        
+        engine = ASPEngine(load_from_db=False)
+        with patch('app.models.database.SessionLocal', sessionmaker(bind=test_db.get_bind())):
+            engine.bulk_update_efficacy([
+                (ComponentType.INSTRUCTION, TaskType.DEDUCTION, 0.9),
+                (ComponentType.EXAMPLE, BehaviorType.PRECISION, 0.7),
+            ])
+        
+        # Verify in-memory values
+        assert engine.component_efficacy[(ComponentType.INSTRUCTION, TaskType.DEDUCTION)] == 0.9
+        assert engine.component_efficacy[(ComponentType.EXAMPLE, BehaviorType.PRECISION)] == 0.7
+        
+        # Verify persisted values
+        test_db.expire_all()
+        rows = {
+            (row.component_type, row.task_type, row.behavior_type): row.efficacy_value
+            for row in test_db.query(ComponentEfficacyDB).all()
+        }
+        assert rows == {
+            ("instruction", "deduction", None): 0.9,
+            ("example", None, "precision"): 0.7,
+        }
+    
+    def test_bulk_update_efficacy_upserts(self, test_db):
+        """Test that SQLite writes use one upsert per task/behavior kind."""
+        from sqlalchemy import event
+        from sqlalchemy.orm import sessionmaker
+        from app.models.database import ComponentEfficacyDB
+        
+        bind = test_db.get_bind()
+        test_db.add(ComponentEfficacyDB(component_type="instruction", behavior_type="precision", efficacy_value=0.5))
+        test_db.commit()
+        statements = []
+        
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(bind, "before_cursor_execute", record)
+        try:
+            engine = ASPEngine(load_from_db=False)
+            with patch('app.models.database.SessionLocal', sessionmaker(bind=bind)):
+                engine.bulk_update_efficacy([
+                    (ComponentType.INSTRUCTION, TaskType.DEDUCTION, 0.9),
+                    (ComponentType.INSTRUCTION, BehaviorType.PRECISION, 0.6),
+                    (ComponentType.INSTRUCTION, BehaviorType.PRECISION, 0.8),
+                ])
+        finally:
+            event.remove(bind, "before_cursor_execute", record)
+        
+        # Verify no lookups were needed (only the one-off index check) and the latest value won
+        writes = [statement for statement in statements if not statement.startswith("PRAGMA")]
+        assert len(writes) == 2
+        assert all("ON CONFLICT" in statement for statement in writes)
+        test_db.expire_all()
+        row = test_db.query(ComponentEfficacyDB).filter_by(behavior_type="precision").one()
+        assert row.efficacy_value == 0.8
+    
+    def test_bulk_update_efficacy_without_unique_indexes(self, tmp_path):
+        """Test that tables predating the unique indexes are written with lookups instead of upserts."""
+        from sqlalchemy import create_engine, text
+        from sqlalchemy.orm import sessionmaker
+        
+        db_engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+        with db_engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE component_efficacy (id INTEGER PRIMARY KEY, component_type VARCHAR(32), "
+                "task_type VARCHAR(32), behavior_type VARCHAR(32), efficacy_value FLOAT)"
+            ))
+            conn.execute(text(
+                "INSERT INTO component_efficacy (component_type, task_type, efficacy_value) "
+                "VALUES ('instruction', 'deduction', 0.5)"
+            ))
+        
+        engine = ASPEngine(load_from_db=False)
+        with patch('app.models.database.SessionLocal', sessionmaker(bind=db_engine)):
+            engine.bulk_update_efficacy([
+                (ComponentType.INSTRUCTION, TaskType.DEDUCTION, 0.9),
+                (ComponentType.EXAMPLE, BehaviorType.PRECISION, 0.7),
+            ])
+        
+        with db_engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT component_type, task_type, behavior_type, efficacy_value FROM component_efficacy"
+            )).all()
+        db_engine.dispose()
+        assert sorted(map(tuple, rows), key=str) == sorted([
+            ("instruction", "deduction", None, 0.9),
+            ("example", None, "precision", 0.7),
+        ], key=str)
+    
+    def test_load_efficacy_from_db(self, test_db):
         """Test loading efficacy values from database."""
-        # Setup mock DB results
-        mock_db = MagicMock()
-        mock_session_local.return_value = mock_db
-        
-        # Component efficacy
-        mock_comp_efficacy1 = MagicMock()
-        mock_comp_efficacy1.component_type = "instruction"
-        mock_comp_efficacy1.task_type = "deduction"
-        mock_comp_efficacy1.behavior_type = None
-        mock_comp_efficacy1.efficacy_value = 0.9
-        
-        mock_comp_efficacy2 = MagicMock()
-        mock_comp_efficacy2.component_type = "example"
-        mock_comp_efficacy2.task_type = None
-        mock_comp_efficacy2.behavior_type = "precision"
-        mock_comp_efficacy2.efficacy_value = 0.8
-        
-        # Position effects
-        mock_position = MagicMock()
-        mock_position.component_type = "instruction"
-        mock_position.position = 1
-        mock_position.effect_value = 0.95
-        
-        # Model efficacy
-        mock_model_efficacy = MagicMock()
-        mock_model_efficacy.model.name = "test-model"
-        mock_model_efficacy.component_type = "instruction"
-        mock_model_efficacy.behavior_type = "precision"
-        mock_model_efficacy.efficacy_value = 0.85
-        
-        # Domain efficacy
-        mock_domain_efficacy = MagicMock()
-        mock_domain_efficacy.domain = "test-domain"
-        mock_domain_efficacy.component_type = "instruction"
-        mock_domain_efficacy.behavior_type = "precision"
-        mock_domain_efficacy.efficacy_value = 0.75
-        
-        # Setup query results
-        mock_db.query.return_value.all.side_effect = [
-            [mock_comp_efficacy1, mock_comp_efficacy2],  # ComponentEfficacyDB
-            [mock_position],                             # PositionEffectDB
-            [mock_model_efficacy],                       # ModelEfficacyDB
-            [mock_domain_efficacy]                       # DomainEfficacyDB
-        ]
+        from sqlalchemy.orm import sessionmaker
+        from app.models.database import (
+            ComponentEfficacyDB, PositionEffectDB, ModelDB, ModelEfficacyDB, DomainEfficacyDB
+        )
+        
+        # Setup DB rows
+        model = ModelDB(name="test-model")
+        test_db.add(model)
+        test_db.flush()
+        test_db.add_all([
+            ComponentEfficacyDB(component_type="instruction", task_type="deduction", efficacy_value=0.9),
+            ComponentEfficacyDB(component_type="example", behavior_type="precision", efficacy_value=0.8),
+            PositionEffectDB(component_type="instruction", position=1, effect_value=0.95),
+            ModelEfficacyDB(model_id=model.id, component_type="instruction", behavior_type="precision", efficacy_value=0.85),
+            DomainEfficacyDB(domain="test-domain", component_type="instruction", behavior_type="precision", efficacy_value=0.75),
+        ])
+        test_db.commit()
         
         # Test load method
         engine = ASPEngine(load_from_db=False)
-        engine.load_efficacy_from_db()
+        with patch('app.models.database.SessionLocal', sessionmaker(bind=test_db.get_bind())):
+            engine.load_efficacy_from_db()
         
         # Verify values loaded
         assert engine.component_efficacy[(ComponentType.INSTRUCTION, TaskType.DEDUCTION)] == 0.9
@@ -278,5 +534,49 @@ class TestASPEngine:
         assert engine.model_adjustments["test-model"][(ComponentType.INSTRUCTION, BehaviorType.PRECISION)] == 0.85
         assert engine.domain_adjustments["test-domain"][(ComponentType.INSTRUCTION, BehaviorType.PRECISION)] == 0.75
         
-        # Verify DB was closed
-        mock_db.close.assert_called_once()
\ No newline at end of file
+        # Verify defaults not present in the database are kept
+        assert engine.model_adjustments["gpt-4"][(ComponentType.INSTRUCTION, BehaviorType.PRECISION)] == 0.9
+    
+    def test_load_efficacy_from_db_legacy_names(self, test_db):
+        """Test that rows holding enum member names, as the old Enum columns wrote them, still load."""
+        from sqlalchemy import text
+        from sqlalchemy.orm import sessionmaker
+        
+        # The CHECK constraints only admit values, so switch them off to write legacy rows
+        test_db.execute(text("PRAGMA ignore_check_constraints = 1"))
+        try:
+            test_db.execute(text(
+                "INSERT INTO component_efficacy (component_type, behavior_type, efficacy_value) "
+                "VALUES ('CONTEXT', 'ERROR_CHECKING', 0.65)"
+            ))
+            test_db.commit()
+        finally:
+            test_db.execute(text("PRAGMA ignore_check_constraints = 0"))
+        
+        engine = ASPEngine(load_from_db=False)
+        with patch('app.models.database.SessionLocal', sessionmaker(bind=test_db.get_bind())):
+            engine.load_efficacy_from_db()
+        
+        assert engine.component_efficacy[(ComponentType.CONTEXT, BehaviorType.ERROR_CHECKING)] == 0.65
+    
+    def test_load_efficacy_from_db_single_query(self, test_db):
+        """Test that all efficacy tables are loaded in one round-trip."""
+        from sqlalchemy import event
+        from sqlalchemy.orm import sessionmaker
+        
+        bind = test_db.get_bind()
+        statements = []
+        
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(bind, "before_cursor_execute", record)
+        try:
+            engine = ASPEngine(load_from_db=False)
+            with patch('app.models.database.SessionLocal', sessionmaker(bind=bind)):
+                engine.load_efficacy_from_db()
+        finally:
+            event.remove(bind, "before_cursor_execute", record)
+        
+        assert len(statements) == 1
+        assert "UNION ALL" in statements[0]
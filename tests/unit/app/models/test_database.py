@@ -0,0 +1,107 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+from app.models.database import ComponentEfficacyDB, PositionEffectDB
+
+class TestEnumColumns:
+    """Tests for the string-backed enum columns."""
+    
+    def test_values_round_trip_as_strings(self, test_db):
+        """Verify enum values are stored and loaded as plain strings."""
+        test_db.add(ComponentEfficacyDB(component_type="instruction", task_type="deduction", efficacy_value=0.9))
+        test_db.commit()
+        test_db.expire_all()
+        
+        row = test_db.query(ComponentEfficacyDB).one()
+        assert type(row.component_type) is str
+        assert row.component_type == "instruction"
+        assert row.task_type == "deduction"
+        assert row.behavior_type is None
+    
+    def test_check_rejects_unknown_values(self, test_db):
+        """Verify the CHECK constraints reject values outside the enums."""
+        test_db.add(PositionEffectDB(component_type="preamble", position=1, effect_value=0.5))
+        
+        with pytest.raises(IntegrityError):
+            test_db.commit()
+        test_db.rollback()
+
+class TestInitDB:
+    """Tests for schema creation and migration at startup."""
+    
+    def test_migrates_enum_names(self, tmp_path):
+        """Verify rows written by the old Enum columns are rewritten to enum values."""
+        from sqlalchemy import create_engine, text
+        from app.models.database import init_db
+        
+        engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+        with engine.begin() as conn:
+            # Layout left behind by the Enum columns: names, no CHECK constraints
+            conn.execute(text(
+                "CREATE TABLE component_efficacy (id INTEGER PRIMARY KEY, component_type VARCHAR(13), "
+                "task_type VARCHAR(14), behavior_type VARCHAR(14), efficacy_value FLOAT)"
+            ))
+            conn.execute(text(
+                "INSERT INTO component_efficacy (component_type, task_type, efficacy_value) "
+                "VALUES ('OUTPUT_FORMAT', 'DEDUCTION', 0.9)"
+            ))
+        
+        init_db(engine)
+        
+        with engine.connect() as conn:
+            row = conn.execute(text("SELECT component_type, task_type FROM component_efficacy")).one()
+        assert tuple(row) == ("output_format", "deduction")
+        engine.dispose()
+    
+    def test_creates_missing_indexes(self, tmp_path):
+        """Verify indexes are added to tables that already existed."""
+        from sqlalchemy import create_engine, inspect, text
+        from app.models.database import init_db
+        
+        engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE component_efficacy (id INTEGER PRIMARY KEY, component_type VARCHAR(32), "
+                "task_type VARCHAR(32), behavior_type VARCHAR(32), efficacy_value FLOAT)"
+            ))
+        
+        init_db(engine)
+        
+        indexes = {index["name"]: index for index in inspect(engine).get_indexes("component_efficacy")}
+        assert indexes["uq_component_efficacy_component_task"]["unique"]
+        assert indexes["uq_component_efficacy_component_behavior"]["unique"]
+        engine.dispose()
+
+class TestModelEfficacyDB:
+    """Tests for the ModelEfficacyDB model."""
+    
+    def test_model_is_eager_loaded(self, test_db):
+        """Verify the model relationship is loaded with the efficacy rows."""
+        from sqlalchemy import inspect
+        from app.models.database import ModelDB, ModelEfficacyDB
+        
+        model = ModelDB(name="test-model")
+        test_db.add(model)
+        test_db.flush()
+        test_db.add(ModelEfficacyDB(model_id=model.id, component_type="instruction", behavior_type="precision"))
+        test_db.commit()
+        test_db.expunge_all()
+        
+        row = test_db.query(ModelEfficacyDB).one()
+        assert "model" not in inspect(row).unloaded
+        assert row.model.name == "test-model"
+
+class TestSQLitePragmas:
+    """Tests for the SQLite connection tuning."""
+    
+    def test_pragmas_applied_on_connect(self, tmp_path):
+        """Verify new connections use WAL with relaxed syncing."""
+        from sqlalchemy import create_engine, event, text
+        from app.models.database import _apply_sqlite_pragmas
+        
+        engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+        event.listen(engine, "connect", _apply_sqlite_pragmas)
+        
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        engine.dispose()
@@ -2,65 +2,71 @@ import pytest
 from pydantic import ValidationError
 from app.models.prompt import (
     ComponentType, TaskType, BehaviorType, 
-    OptimizationRequest, PromptComponent, OptimizedPrompt
+    OptimizationRequest, PromptComponent, OptimizedPrompt,
+    COMPONENT_VALUES, TASK_VALUES, BEHAVIOR_VALUES
 )
 
-class TestComponentType:
-    """Tests for ComponentType enum."""
-    
-    def test_enum_values(self):
-        """Verify the enum values match expected strings."""
-        assert ComponentType.INSTRUCTION.value == "instruction"
-        assert ComponentType.CONTEXT.value == "context"
-        assert ComponentType.EXAMPLE.value == "example"
-        assert ComponentType.CONSTRAINT.value == "constraint"
-        assert ComponentType.OUTPUT_FORMAT.value == "output_format"
-    
-    def test_enum_conversion(self):
-        """Test conversion between string and enum."""
-        assert ComponentType("instruction") == ComponentType.INSTRUCTION
-        assert ComponentType.CONTEXT.value == "context"
-        
-        with pytest.raises(ValueError):
-            ComponentType("invalid_type")
+# (type, content, position) of the components shared by the OptimizedPrompt tests
+_COMPONENT_FIXTURES = (
+    (ComponentType.INSTRUCTION, "Follow these instructions", 1),
+    (ComponentType.EXAMPLE, "Here's an example", 2),
+)
 
-class TestTaskType:
-    """Tests for TaskType enum."""
-    
-    def test_enum_values(self):
-        """Verify the enum values match expected strings."""
-        assert TaskType.DEDUCTION.value == "deduction"
-        assert TaskType.INDUCTION.value == "induction"
-        assert TaskType.ABDUCTION.value == "abduction"
-        assert TaskType.COMPARISON.value == "comparison"
-        assert TaskType.COUNTERFACTUAL.value == "counterfactual"
-    
-    def test_enum_conversion(self):
-        """Test conversion between string and enum."""
-        assert TaskType("deduction") == TaskType.DEDUCTION
-        assert TaskType.INDUCTION.value == "induction"
-        
-        with pytest.raises(ValueError):
-            TaskType("invalid_task")
+@pytest.fixture(scope="session")
+def sample_components():
+    """Components shared by the OptimizedPrompt tests, which only read them."""
+    # Component validation is covered by test_valid_component and test_invalid_component
+    return [
+        PromptComponent.model_construct(type=comp_type, content=content, position=position)
+        for comp_type, content, position in _COMPONENT_FIXTURES
+    ]
+
+ENUM_VALUES = [
+    (ComponentType, {
+        "INSTRUCTION": "instruction",
+        "CONTEXT": "context",
+        "EXAMPLE": "example",
+        "CONSTRAINT": "constraint",
+        "OUTPUT_FORMAT": "output_format",
+    }),
+    (TaskType, {
+        "DEDUCTION": "deduction",
+        "INDUCTION": "induction",
+        "ABDUCTION": "abduction",
+        "COMPARISON": "comparison",
+        "COUNTERFACTUAL": "counterfactual",
+    }),
+    (BehaviorType, {
+        "PRECISION": "precision",
+        "CREATIVITY": "creativity",
+        "STEP_BY_STEP": "step_by_step",
+        "CONCISENESS": "conciseness",
+        "ERROR_CHECKING": "error_checking",
+    }),
+]
 
-class TestBehaviorType:
-    """Tests for BehaviorType enum."""
+class TestEnums:
+    """Tests for the ComponentType, TaskType and BehaviorType enums."""
     
-    def test_enum_values(self):
+    @pytest.mark.parametrize("enum_class,expected", ENUM_VALUES)
+    def test_enum_values(self, enum_class, expected):
         """Verify the enum values match expected strings."""
-        assert BehaviorType.PRECISION.value == "precision"
-        assert BehaviorType.CREATIVITY.value == "creativity"
-        assert BehaviorType.STEP_BY_STEP.value == "step_by_step"
-        assert BehaviorType.CONCISENESS.value == "conciseness"
-        assert BehaviorType.ERROR_CHECKING.value == "error_checking"
+        assert {name: member.value for name, member in enum_class.__members__.items()} == expected
     
-    def test_enum_conversion(self):
+    @pytest.mark.parametrize("enum_class,expected", ENUM_VALUES)
+    def test_enum_conversion(self, enum_class, expected):
         """Test conversion between string and enum."""
-        assert BehaviorType("precision") == BehaviorType.PRECISION
-        assert BehaviorType.STEP_BY_STEP.value == "step_by_step"
+        for name, value in expected.items():
+            assert enum_class(value) is enum_class[name]
         
         with pytest.raises(ValueError):
-            BehaviorType("invalid_behavior")
+            enum_class("invalid_value")
+    
+    def test_value_lookups(self):
+        """Verify the member -> value tables agree with the enums."""
+        for enum_class, values in ((ComponentType, COMPONENT_VALUES), (TaskType, TASK_VALUES),
+                                   (BehaviorType, BEHAVIOR_VALUES)):
+            assert values == {member: member.value for member in enum_class}
 
 class TestOptimizationRequest:
     """Tests for OptimizationRequest model."""
@@ -91,25 +97,18 @@ class TestOptimizationRequest:
         assert request.target_model == "gpt-4"
         assert request.domain is None
     
-    def test_invalid_request(self):
-        """Test validation for invalid requests."""
+    @pytest.mark.parametrize("kwargs", [
         # Missing required field
-        with pytest.raises(ValidationError):
-            OptimizationRequest()
-            
+        {},
         # Invalid task type
-        with pytest.raises(ValidationError):
-            OptimizationRequest(
-                user_prompt="Test",
-                target_tasks=["invalid_task"]
-            )
-            
+        {"user_prompt": "Test", "target_tasks": ["invalid_task"]},
         # Invalid behavior type
+        {"user_prompt": "Test", "target_behaviors": ["invalid_behavior"]},
+    ])
+    def test_invalid_request(self, kwargs):
+        """Test validation for invalid requests."""
         with pytest.raises(ValidationError):
-            OptimizationRequest(
-                user_prompt="Test",
-                target_behaviors=["invalid_behavior"]
-            )
+            OptimizationRequest(**kwargs)
 
 class TestPromptComponent:
     """Tests for PromptComponent model."""
@@ -126,91 +125,47 @@ class TestPromptComponent:
         assert component.content == "Follow these instructions"
         assert component.position == 1
     
-    def test_invalid_component(self):
-        """Test validation for invalid components."""
-        # Missing required fields
-        with pytest.raises(ValidationError):
-            PromptComponent()
-            
-        with pytest.raises(ValidationError):
-            PromptComponent(
-                type=ComponentType.INSTRUCTION,
-                content="Test"
-            )
-            
+    @pytest.mark.parametrize("kwargs", [
+        {},
+        {"type": ComponentType.INSTRUCTION, "content": "Test"},
+        {"type": ComponentType.INSTRUCTION, "position": 1},
+        {"content": "Test", "position": 1},
+    ])
+    def test_invalid_component(self, kwargs):
+        """Test validation for components missing required fields."""
         with pytest.raises(ValidationError):
-            PromptComponent(
-                type=ComponentType.INSTRUCTION,
-                position=1
-            )
-            
-        with pytest.raises(ValidationError):
-            PromptComponent(
-                content="Test",
-                position=1
-            )
+            PromptComponent(**kwargs)
 
 class TestOptimizedPrompt:
     """Tests for OptimizedPrompt model."""
     
-    def test_valid_optimized_prompt(self):
+    def test_valid_optimized_prompt(self, sample_components):
         """Test creating a valid optimized prompt."""
-        components = [
-            PromptComponent(
-                type=ComponentType.INSTRUCTION,
-                content="Follow these instructions",
-                position=1
-            ),
-            PromptComponent(
-                type=ComponentType.EXAMPLE,
-                content="Here's an example",
-                position=2
-            )
-        ]
-        
         prompt = OptimizedPrompt(
-            components=components,
+            components=sample_components,
             full_prompt="Follow these instructions\n\nHere's an example",
             rationale="This structure is optimal",
             effectiveness_score=85.5
         )
         
-        assert prompt.components == components
+        assert prompt.components == sample_components
         assert prompt.full_prompt == "Follow these instructions\n\nHere's an example"
         assert prompt.rationale == "This structure is optimal"
         assert prompt.effectiveness_score == 85.5
     
-    def test_invalid_optimized_prompt(self):
-        """Test validation for invalid optimized prompts."""
-        components = [
-            PromptComponent(
-                type=ComponentType.INSTRUCTION,
-                content="Follow these instructions",
-                position=1
-            )
-        ]
-        
-        # Missing required fields
-        with pytest.raises(ValidationError):
-            OptimizedPrompt()
-            
-        with pytest.raises(ValidationError):
-            OptimizedPrompt(
-                components=components,
-                full_prompt="Test",
-                rationale="Test"
-            )
-            
-        with pytest.raises(ValidationError):
-            OptimizedPrompt(
-                components=components,
-                full_prompt="Test",
-                effectiveness_score=85.5
-            )
-            
+    @pytest.mark.parametrize("missing", [
+        ("components", "full_prompt", "rationale", "effectiveness_score"),
+        ("effectiveness_score",),
+        ("rationale",),
+        ("full_prompt",),
+    ])
+    def test_invalid_optimized_prompt(self, sample_components, missing):
+        """Test validation for optimized prompts missing required fields."""
+        fields = {
+            "components": sample_components,
+            "full_prompt": "Test",
+            "rationale": "Test",
+            "effectiveness_score": 85.5
+        }
         with pytest.raises(ValidationError):
-            OptimizedPrompt(
-                components=components,
-                rationale="Test",
-                effectiveness_score=85.5
-            )
\ No newline at end of file
+            OptimizedPrompt(**{name: value for name, value in fields.items() if name not in missing})
\ No newline at end of file
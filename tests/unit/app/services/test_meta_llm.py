@@ -1,10 +1,28 @@
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
+import asyncio
 import json
 import os
-from app.services.meta_llm import MetaLLMAnalyzer, ANALYSIS_PROMPT, COMPONENT_GENERATION_PROMPTS, RATIONALE_PROMPT
+from types import SimpleNamespace
+from app.services.meta_llm import (
+    MetaLLMAnalyzer, ANALYSIS_PROMPT, COMPONENT_SPEC_PROMPT, RATIONALE_PROMPT,
+    LLM_TIMEOUT, LLM_MAX_RETRIES
+)
 from app.models.prompt import TaskType, BehaviorType, PromptComponent, ComponentType
 
+def _completion(content):
+    """Stand-in for a chat completion response carrying the given message content"""
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+def _embedding(vector):
+    """Stand-in for an embeddings response carrying one vector"""
+    return SimpleNamespace(data=[SimpleNamespace(embedding=vector)])
+
+@pytest.fixture(scope="module")
+def analyzer():
+    """One mock-mode analyzer shared by the tests that only read from it"""
+    return MetaLLMAnalyzer(api_key=None)
+
 class TestMetaLLMAnalyzer:
     """Tests for MetaLLMAnalyzer class."""
     
@@ -24,7 +42,23 @@ class TestMetaLLMAnalyzer:
             assert analyzer.api_key == "test-key"
             assert analyzer.model == "test-model"
             assert analyzer.use_mock is False
-            mock_openai.assert_called_once_with(api_key="test-key")
+            mock_openai.assert_called_once_with(
+                api_key="test-key", timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES
+            )
+            assert analyzer.async_client.timeout == LLM_TIMEOUT
+            assert analyzer.async_client.max_retries == LLM_MAX_RETRIES
+    
+    @patch('openai.AsyncOpenAI')
+    @patch('openai.OpenAI')
+    def test_close(self, mock_openai, mock_async_openai):
+        """Test close releases both clients."""
+        mock_async_openai.return_value.close = AsyncMock()
+        analyzer = MetaLLMAnalyzer(api_key="test-key")
+        
+        asyncio.run(analyzer.close())
+        
+        mock_openai.return_value.close.assert_called_once()
+        mock_async_openai.return_value.close.assert_awaited_once()
     
     @patch('openai.OpenAI')
     def test_init_exception(self, mock_openai):
@@ -36,9 +70,8 @@ class TestMetaLLMAnalyzer:
         assert analyzer.api_key == "test-key"
         assert analyzer.use_mock is True  # Fallback to mock mode
     
-    def test_analyze_task_mock(self):
+    def test_analyze_task_mock(self, analyzer):
         """Test analyze_task with mock responses."""
-        analyzer = MetaLLMAnalyzer(api_key=None)
         result = analyzer.analyze_task("Explain quantum computing")
         
         assert "detected_tasks" in result
@@ -54,13 +87,12 @@ class TestMetaLLMAnalyzer:
         mock_client = MagicMock()
         mock_openai.return_value = mock_client
         
-        mock_response = MagicMock()
         mock_content = json.dumps({
             "reasoning_tasks": ["deduction", "comparison"],
             "output_behaviors": ["precision", "step_by_step"],
             "domain": "physics"
         })
-        mock_response.choices = [MagicMock(message=MagicMock(content=mock_content))]
+        mock_response = _completion(mock_content)
         mock_client.chat.completions.create.return_value = mock_response
         
         # Test the method
@@ -78,12 +110,90 @@ class TestMetaLLMAnalyzer:
         mock_client.chat.completions.create.assert_called_once()
         call_args = mock_client.chat.completions.create.call_args[1]
         assert call_args["model"] == analyzer.model
-        assert call_args["response_format"] == {"type": "json_object"}
+        assert call_args["response_format"]["type"] == "json_schema"
         assert call_args["temperature"] == 0.1
+        assert call_args["max_tokens"] == 128
         assert len(call_args["messages"]) == 2
         assert call_args["messages"][0]["role"] == "system"
         assert call_args["messages"][0]["content"] == ANALYSIS_PROMPT
     
+    @patch('openai.OpenAI')
+    def test_analyze_task_semantic_cache(self, mock_openai):
+        """Test a paraphrased prompt reuses the cached analysis instead of calling the LLM."""
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        
+        embeddings = {
+            "Explain quantum computing": [1.0, 0.0, 0.1],
+            "Please explain quantum computing": [0.98, 0.0, 0.12],
+            "Write a poem about the sea": [0.0, 1.0, 0.0],
+        }
+        mock_client.embeddings.create.side_effect = lambda **kwargs: _embedding(embeddings[kwargs["input"]])
+        mock_response = _completion(json.dumps({
+            "reasoning_tasks": ["deduction"],
+            "output_behaviors": ["precision"],
+            "domain": "physics"
+        }))
+        mock_client.chat.completions.create.return_value = mock_response
+        
+        analyzer = MetaLLMAnalyzer(api_key="test-key")
+        first = analyzer.analyze_task("Explain quantum computing")
+        first["detected_tasks"].append(TaskType.INDUCTION)
+        second = analyzer.analyze_task("Please explain quantum computing")
+        
+        assert second["detected_tasks"] == [TaskType.DEDUCTION]
+        assert second["domain_hint"] == "physics"
+        assert mock_client.chat.completions.create.call_count == 1
+        
+        analyzer.analyze_task("Write a poem about the sea")
+        assert mock_client.chat.completions.create.call_count == 2
+    
+    @patch('openai.OpenAI')
+    def test_analyze_task_repeated_prompt_skips_embedding(self, mock_openai):
+        """Test an exact repeat is answered from the chat cache without embedding while failed analyses are retried."""
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        mock_client.embeddings.create.return_value = _embedding([1.0, 0.0])
+        mock_response = _completion(json.dumps({
+            "reasoning_tasks": ["comparison"],
+            "output_behaviors": ["conciseness"]
+        }))
+        mock_client.chat.completions.create.side_effect = [Exception("Test exception"), mock_response]
+        
+        analyzer = MetaLLMAnalyzer(api_key="test-key")
+        analyzer.analyze_task("Compare two sorting algorithms")
+        result = analyzer.analyze_task("Compare two sorting algorithms")
+        assert result["detected_tasks"] == [TaskType.COMPARISON]
+        
+        repeated = analyzer.analyze_task("Compare two sorting algorithms")
+        assert repeated == result
+        assert mock_client.chat.completions.create.call_count == 2
+        assert mock_client.embeddings.create.call_count == 2
+    
+    @patch('openai.AsyncOpenAI')
+    def test_analyze_task_async_semantic_cache(self, mock_async_openai):
+        """Test the async analysis reuses a similar prompt's result and rate limits the embedding calls."""
+        mock_client = MagicMock()
+        mock_async_openai.return_value = mock_client
+        mock_client.embeddings.create = AsyncMock(side_effect=[_embedding([1.0, 0.0]), _embedding([0.99, 0.05])])
+        mock_client.chat.completions.create = AsyncMock(return_value=_completion(json.dumps({
+            "reasoning_tasks": ["abduction"],
+            "output_behaviors": ["creativity"]
+        })))
+        
+        analyzer = MetaLLMAnalyzer(api_key="test-key")
+        analyzer.rate_limiter = MagicMock(acquire_async=AsyncMock())
+        
+        async def run():
+            await analyzer.analyze_task_async("Why is the grass wet?")
+            return await analyzer.analyze_task_async("Why might the grass be wet?")
+        
+        result = asyncio.run(run())
+        assert result["detected_tasks"] == [TaskType.ABDUCTION]
+        assert mock_client.chat.completions.create.call_count == 1
+        # Two embeddings and one chat call each reserved budget
+        assert analyzer.rate_limiter.acquire_async.await_count == 3
+    
     @patch('openai.OpenAI')
     def test_analyze_task_api_error(self, mock_openai):
         """Test analyze_task with API error."""
@@ -101,88 +211,138 @@ class TestMetaLLMAnalyzer:
         assert len(result["detected_behaviors"]) > 0
         assert "domain_hint" in result
     
-    def test_generate_component_content_mock(self):
-        """Test generate_component_content with mock responses."""
-        analyzer = MetaLLMAnalyzer(api_key=None)
-        
+    def test_generate_all_components_mock(self, analyzer):
+        """Test generate_all_components with mock responses."""
         task_analysis = {
             "detected_tasks": [TaskType.DEDUCTION],
             "detected_behaviors": [BehaviorType.PRECISION]
         }
+        component_types = ["instruction", "context", "example", "constraint", "output_format"]
         
-        result = analyzer.generate_component_content(
-            "instruction", task_analysis, "Explain quantum computing"
-        )
-        
-        assert "Explain quantum computing" in result
+        result = analyzer.generate_all_components(task_analysis, "Explain quantum computing", component_types)
         
-        # Test each component type
-        for component_type in ["context", "example", "constraint", "output_format"]:
-            content = analyzer.generate_component_content(
-                component_type, task_analysis, "Explain quantum computing"
-            )
+        assert list(result) == component_types
+        assert "Explain quantum computing" in result["instruction"]
+        for content in result.values():
             assert isinstance(content, str)
             assert len(content) > 0
     
     @patch('openai.OpenAI')
-    def test_generate_component_content_api(self, mock_openai):
-        """Test generate_component_content with API call."""
-        # Setup mock response
+    def test_generate_all_components_api(self, mock_openai):
+        """Test generate_all_components makes one call and falls back for missing types."""
         mock_client = MagicMock()
         mock_openai.return_value = mock_client
         
-        mock_response = MagicMock()
-        mock_response.choices = [MagicMock(message=MagicMock(content="Generated content"))]
+        mock_response = _completion(json.dumps({
+            "instruction": "Generated instruction",
+            "example": "Generated example"
+        }))
         mock_client.chat.completions.create.return_value = mock_response
         
-        # Test the method
         analyzer = MetaLLMAnalyzer(api_key="test-key")
         task_analysis = {
             "detected_tasks": [TaskType.DEDUCTION],
             "detected_behaviors": [BehaviorType.PRECISION]
         }
         
-        result = analyzer.generate_component_content(
-            "instruction", task_analysis, "Explain quantum computing"
+        result = analyzer.generate_all_components(
+            task_analysis, "Explain quantum computing", ["instruction", "example", "constraint"]
         )
         
-        assert result == "Generated content"
+        assert result["instruction"] == "Generated instruction"
+        assert result["example"] == "Generated example"
+        assert "CONTENT FOR: Explain quantum computing" in result["constraint"]
         
-        # Verify API call
         mock_client.chat.completions.create.assert_called_once()
         call_args = mock_client.chat.completions.create.call_args[1]
-        assert call_args["model"] == analyzer.model
+        assert call_args["response_format"] == {"type": "json_object"}
         assert call_args["temperature"] == 0.7
-        assert len(call_args["messages"]) == 2
-        assert call_args["messages"][0]["role"] == "system"
-        assert call_args["messages"][0]["content"] == COMPONENT_GENERATION_PROMPTS["instruction"]
+        assert call_args["messages"][0]["content"] == COMPONENT_SPEC_PROMPT
+        assert '["instruction","example","constraint"]' in call_args["messages"][2]["content"]
     
     @patch('openai.OpenAI')
-    def test_generate_component_content_api_error(self, mock_openai):
-        """Test generate_component_content with API error."""
-        # Setup mock to raise exception
+    def test_generate_all_components_api_error(self, mock_openai):
+        """Test generate_all_components with API error."""
         mock_client = MagicMock()
         mock_openai.return_value = mock_client
         mock_client.chat.completions.create.side_effect = Exception("Test exception")
         
-        # Test the method
         analyzer = MetaLLMAnalyzer(api_key="test-key")
         task_analysis = {
             "detected_tasks": [TaskType.DEDUCTION],
             "detected_behaviors": [BehaviorType.PRECISION]
         }
         
-        result = analyzer.generate_component_content(
-            "instruction", task_analysis, "Explain quantum computing"
-        )
+        result = analyzer.generate_all_components(task_analysis, "Explain quantum computing", ["instruction"])
         
         # Verify fallback content returned
-        assert "CONTENT FOR: Explain quantum computing" in result
+        assert "CONTENT FOR: Explain quantum computing" in result["instruction"]
     
-    def test_generate_rationale_mock(self):
-        """Test generate_rationale with mock responses."""
-        analyzer = MetaLLMAnalyzer(api_key=None)
+    @patch('openai.AsyncOpenAI')
+    def test_generate_all_components_async_strict(self, mock_async_openai):
+        """Test strict mode raises on an API error instead of returning placeholder contents."""
+        mock_client = MagicMock()
+        mock_async_openai.return_value = mock_client
+        mock_client.chat.completions.create = AsyncMock(side_effect=Exception("Test exception"))
+        
+        analyzer = MetaLLMAnalyzer(api_key="test-key")
+        task_analysis = {
+            "detected_tasks": [TaskType.DEDUCTION],
+            "detected_behaviors": [BehaviorType.PRECISION]
+        }
+        
+        result = asyncio.run(analyzer.generate_all_components_async(task_analysis, "Test prompt", ["instruction"]))
+        assert "CONTENT FOR: Test prompt" in result["instruction"]
+        with pytest.raises(Exception, match="Test exception"):
+            asyncio.run(analyzer.generate_all_components_async(
+                task_analysis, "Test prompt", ["instruction"], strict=True
+            ))
+    
+    def test_request_messages_are_canonical(self, analyzer):
+        """Test the system message is static and equal analyses give identical user messages."""
+        first = analyzer._component_batch_request({
+            "detected_tasks": [TaskType.DEDUCTION, TaskType.COMPARISON],
+            "detected_behaviors": [BehaviorType.PRECISION]
+        }, "Test prompt", ["instruction", "example"])
+        second = analyzer._component_batch_request({
+            "detected_tasks": [TaskType.COMPARISON, TaskType.DEDUCTION],
+            "detected_behaviors": [BehaviorType.PRECISION]
+        }, "Test prompt", ["instruction", "example"])
+        
+        assert first["messages"][0]["content"] == COMPONENT_SPEC_PROMPT
+        assert "Test prompt" not in first["messages"][0]["content"]
+        assert first["messages"] == second["messages"]
+        assert '"reasoning_tasks":["comparison","deduction"]' in first["messages"][1]["content"]
+    
+    @patch('openai.AsyncOpenAI')
+    @patch('openai.OpenAI')
+    def test_generate_all_components_async_api(self, mock_openai, mock_async_openai):
+        """Test generate_all_components_async uses the async client."""
+        mock_async_client = MagicMock()
+        mock_async_openai.return_value = mock_async_client
+        
+        mock_response = _completion(json.dumps({"instruction": "Generated content"}))
+        mock_async_client.chat.completions.create = AsyncMock(return_value=mock_response)
+        
+        analyzer = MetaLLMAnalyzer(api_key="test-key")
+        task_analysis = {
+            "detected_tasks": [TaskType.DEDUCTION],
+            "detected_behaviors": [BehaviorType.PRECISION]
+        }
+        
+        result = asyncio.run(analyzer.generate_all_components_async(
+            task_analysis, "Explain quantum computing", ["instruction"]
+        ))
         
+        assert result == {"instruction": "Generated content"}
+        mock_async_openai.assert_called_once_with(
+            api_key="test-key", timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES
+        )
+        mock_async_client.chat.completions.create.assert_awaited_once()
+        mock_openai.return_value.chat.completions.create.assert_not_called()
+    
+    def test_generate_rationale_mock(self, analyzer):
+        """Test generate_rationale with mock responses."""
         components = [
             PromptComponent(type=ComponentType.INSTRUCTION, content="Test", position=1),
             PromptComponent(type=ComponentType.EXAMPLE, content="Test", position=2)
@@ -205,8 +365,7 @@ class TestMetaLLMAnalyzer:
         mock_client = MagicMock()
         mock_openai.return_value = mock_client
         
-        mock_response = MagicMock()
-        mock_response.choices = [MagicMock(message=MagicMock(content="Generated rationale"))]
+        mock_response = _completion("Generated rationale")
         mock_client.chat.completions.create.return_value = mock_response
         
         # Test the method
@@ -229,7 +388,7 @@ class TestMetaLLMAnalyzer:
         mock_client.chat.completions.create.assert_called_once()
         call_args = mock_client.chat.completions.create.call_args[1]
         assert call_args["model"] == analyzer.model
-        assert call_args["temperature"] == 0.3
+        assert call_args["temperature"] == 0.0
         assert len(call_args["messages"]) == 2
         assert call_args["messages"][0]["role"] == "system"
         assert call_args["messages"][0]["content"] == RATIONALE_PROMPT
@@ -260,10 +419,127 @@ class TestMetaLLMAnalyzer:
         assert "instruction, example" in result
         assert "85.5" in result
     
-    def test_assemble_prompt(self):
-        """Test assemble_prompt method."""
-        analyzer = MetaLLMAnalyzer(api_key=None)
+    @patch('openai.AsyncOpenAI')
+    @patch('openai.OpenAI')
+    def test_stream_rationale_api(self, mock_openai, mock_async_openai):
+        """Test stream_rationale yields the streamed deltas and caches the joined text."""
+        async def chunks():
+            for delta in ["Generated ", None, "rationale"]:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
         
+        mock_async_client = MagicMock()
+        mock_async_openai.return_value = mock_async_client
+        mock_async_client.chat.completions.create = AsyncMock(side_effect=lambda **kwargs: chunks())
+        
+        analyzer = MetaLLMAnalyzer(api_key="test-key")
+        components = [PromptComponent(type=ComponentType.INSTRUCTION, content="Test", position=1)]
+        task_analysis = {
+            "detected_tasks": [TaskType.DEDUCTION],
+            "detected_behaviors": [BehaviorType.PRECISION]
+        }
+        
+        async def collect():
+            return [part async for part in analyzer.stream_rationale(components, task_analysis, 85.5)]
+        
+        assert asyncio.run(collect()) == ["Generated ", "rationale"]
+        assert mock_async_client.chat.completions.create.call_args[1]["stream"] is True
+        
+        # A repeated request is answered from the chat cache in one piece
+        assert asyncio.run(collect()) == ["Generated rationale"]
+        mock_async_client.chat.completions.create.assert_awaited_once()
+    
+    @patch('openai.AsyncOpenAI')
+    @patch('openai.OpenAI')
+    def test_stream_rationale_api_error(self, mock_openai, mock_async_openai):
+        """Test stream_rationale yields the fallback rationale when the call fails."""
+        mock_async_openai.return_value.chat.completions.create = AsyncMock(side_effect=Exception("Test exception"))
+        
+        analyzer = MetaLLMAnalyzer(api_key="test-key")
+        components = [
+            PromptComponent(type=ComponentType.INSTRUCTION, content="Test", position=1),
+            PromptComponent(type=ComponentType.EXAMPLE, content="Test", position=2)
+        ]
+        task_analysis = {
+            "detected_tasks": [TaskType.DEDUCTION],
+            "detected_behaviors": [BehaviorType.PRECISION]
+        }
+        
+        async def collect():
+            return [part async for part in analyzer.stream_rationale(components, task_analysis, 85.5)]
+        
+        parts = asyncio.run(collect())
+        
+        assert len(parts) == 1
+        assert "instruction, example" in parts[0]
+        assert "85.5" in parts[0]
+    
+    @patch('openai.OpenAI')
+    def test_identical_low_temperature_requests_are_cached(self, mock_openai):
+        """Test repeated deterministic requests reuse the answer while sampled component contents do not."""
+        mock_client = MagicMock()
+        mock_openai.return_value = mock_client
+        mock_response = _completion("Generated")
+        mock_client.chat.completions.create.return_value = mock_response
+        
+        analyzer = MetaLLMAnalyzer(api_key="test-key")
+        components = [PromptComponent(type=ComponentType.INSTRUCTION, content="Test", position=1)]
+        task_analysis = {
+            "detected_tasks": [TaskType.DEDUCTION],
+            "detected_behaviors": [BehaviorType.PRECISION]
+        }
+        
+        assert analyzer.generate_rationale(components, task_analysis, 85.5) == "Generated"
+        assert analyzer.generate_rationale(components, task_analysis, 85.5) == "Generated"
+        assert mock_client.chat.completions.create.call_count == 1
+        
+        analyzer.generate_rationale(components, task_analysis, 70.0)
+        assert mock_client.chat.completions.create.call_count == 2
+        
+        analyzer.generate_all_components(task_analysis, "Test prompt", ["instruction", "example"])
+        analyzer.generate_all_components(task_analysis, "Test prompt", ["instruction", "example"])
+        assert mock_client.chat.completions.create.call_count == 4
+    
+    @patch('openai.OpenAI')
+    def test_analyze_tasks_batch(self, mock_openai, monkeypatch):
+        """Test analyses run as one Batch API job, with defaults for failed requests."""
+        monkeypatch.setattr("app.services.meta_llm.BATCH_POLL_INTERVAL", 0)
+        mock_client = mock_openai.return_value
+        mock_client.files.create.return_value = SimpleNamespace(id="file-in")
+        mock_client.batches.create.return_value = SimpleNamespace(id="batch-1", status="in_progress", output_file_id=None)
+        mock_client.batches.retrieve.return_value = SimpleNamespace(id="batch-1", status="completed", output_file_id="file-out")
+        output = [
+            {"custom_id": "0", "response": {"status_code": 200, "body": {"choices": [{"message": {"content": json.dumps({
+                "reasoning_tasks": ["comparison"], "output_behaviors": ["conciseness"], "domain": "code"
+            })}}]}}},
+            {"custom_id": "1", "response": {"status_code": 500, "body": {}}},
+        ]
+        mock_client.files.content.return_value = SimpleNamespace(
+            content="\n".join(json.dumps(record) for record in output).encode()
+        )
+        
+        analyzer = MetaLLMAnalyzer(api_key="test-key")
+        analyses = analyzer.analyze_tasks_batch(["Compare these functions", "Explain quantum computing"])
+        
+        assert analyses[0] == {
+            "detected_tasks": [TaskType.COMPARISON],
+            "detected_behaviors": [BehaviorType.CONCISENESS],
+            "domain_hint": "code"
+        }
+        assert analyses[1] == analyzer._default_analysis()
+        
+        # Verify one uploaded JSONL line per prompt and the batch polled until it finished
+        _, lines = mock_client.files.create.call_args[1]["file"]
+        records = [json.loads(line) for line in lines.splitlines()]
+        assert [record["custom_id"] for record in records] == ["0", "1"]
+        assert records[1]["body"]["messages"][1]["content"] == "Explain quantum computing"
+        mock_client.batches.create.assert_called_once_with(
+            input_file_id="file-in", endpoint="/v1/chat/completions", completion_window="24h"
+        )
+        mock_client.batches.retrieve.assert_called_once_with("batch-1")
+        mock_client.files.content.assert_called_once_with("file-out")
+    
+    def test_assemble_prompt(self, analyzer):
+        """Test assemble_prompt method."""
         # Test with ordered components
         components = [
             PromptComponent(type=ComponentType.INSTRUCTION, content="First", position=1),
@@ -280,4 +556,8 @@ class TestMetaLLMAnalyzer:
         ]
         
         result = analyzer.assemble_prompt(components)
-        assert result == "Should be first\n\nShould be second"
\ No newline at end of file
+        assert result == "Should be first\n\nShould be second"
+        
+        # Presorted components are joined in the given order
+        result = analyzer.assemble_prompt(components, presorted=True)
+        assert result == "Should be second\n\nShould be first"
\ No newline at end of file
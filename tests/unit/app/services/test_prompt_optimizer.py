@@ -1,12 +1,56 @@
 import pytest
+import asyncio
+import threading
 from unittest.mock import patch, MagicMock, call
 import datetime
-from app.services.prompt_optimizer import PromptOptimizer, optimization_cache
+from app.services.prompt_optimizer import PromptOptimizer, optimization_cache, FALLBACK_RATIONALE
+from app.services.meta_llm import MetaLLMAnalyzer
 from app.models.prompt import (
     OptimizationRequest, OptimizedPrompt, PromptComponent,
     ComponentType, TaskType, BehaviorType
 )
 
+# Analysis and component contents returned by the prepared optimizer's stubbed LLM calls
+PREPARED_ANALYSIS = {
+    "detected_tasks": [TaskType.DEDUCTION],
+    "detected_behaviors": [BehaviorType.PRECISION],
+    "domain_hint": None
+}
+PREPARED_CONTENTS = {"instruction": "Test content", "example": "Test content"}
+
+def _rationale_stream(*parts):
+    """Stand-in for MetaLLMAnalyzer.stream_rationale that yields the given pieces"""
+    async def stream(*args, **kwargs):
+        for part in parts:
+            yield part
+    return stream
+
+@pytest.fixture(autouse=True)
+def clear_optimization_cache():
+    """Start and end every test with an empty structure cache, even when it fails"""
+    optimization_cache.clear()
+    yield
+    optimization_cache.clear()
+
+@pytest.fixture
+def prepared_optimizer(mocker, optimizer):
+    """Optimizer with stubbed LLM calls, solve and database write."""
+    meta_llm = mocker.create_autospec(MetaLLMAnalyzer, instance=True)
+    meta_llm.analyze_task.return_value = PREPARED_ANALYSIS
+    meta_llm.analyze_task_async.return_value = PREPARED_ANALYSIS
+    meta_llm.generate_all_components.return_value = PREPARED_CONTENTS
+    meta_llm.generate_all_components_async.return_value = PREPARED_CONTENTS
+    meta_llm.assemble_prompt.return_value = "Full prompt text"
+    meta_llm.generate_rationale.return_value = "Optimization rationale"
+    meta_llm.stream_rationale = _rationale_stream("Optimization rationale")
+    optimizer.meta_llm = meta_llm
+    optimizer.asp_engine.solve = mocker.MagicMock(return_value=([
+        PromptComponent(type=ComponentType.INSTRUCTION, content="", position=1),
+        PromptComponent(type=ComponentType.EXAMPLE, content="", position=2)
+    ], 85.5))
+    optimizer._save_to_db = mocker.MagicMock(return_value=1)
+    return optimizer
+
 class TestPromptOptimizer:
     """Tests for PromptOptimizer class."""
     
@@ -29,12 +73,10 @@ class TestPromptOptimizer:
             domain="education"
         )
         
-        assert "deduction" in key
-        assert "precision" in key
         assert "gpt-4" in key
         assert "education" in key
         
-        # Test with multiple values and sorting
+        # Test with multiple values: order doesn't matter, but the sets do
         key = optimizer._generate_cache_key(
             target_tasks=[TaskType.COMPARISON, TaskType.DEDUCTION],
             target_behaviors=[BehaviorType.STEP_BY_STEP, BehaviorType.PRECISION],
@@ -42,34 +84,29 @@ class TestPromptOptimizer:
             domain=None
         )
         
-        assert "comparison,deduction" in key or "deduction,comparison" in key
-        assert "precision,step_by_step" in key or "step_by_step,precision" in key
+        assert key == optimizer._generate_cache_key(
+            target_tasks=[TaskType.DEDUCTION, TaskType.COMPARISON],
+            target_behaviors=[BehaviorType.PRECISION, BehaviorType.STEP_BY_STEP],
+            target_model="gpt-4",
+            domain=None
+        )
+        assert key != optimizer._generate_cache_key(
+            target_tasks=[TaskType.DEDUCTION],
+            target_behaviors=[BehaviorType.PRECISION, BehaviorType.STEP_BY_STEP],
+            target_model="gpt-4",
+            domain=None
+        )
+        assert key != optimizer._generate_cache_key(
+            target_tasks=[TaskType.COMPARISON, TaskType.DEDUCTION],
+            target_behaviors=[BehaviorType.STEP_BY_STEP, BehaviorType.PRECISION],
+            target_model="gpt-4",
+            domain="education"
+        )
         assert "none" in key.lower()
     
-    def test_optimize_success(self, mocker, optimizer, sample_prompt_data):
+    def test_optimize_success(self, prepared_optimizer, sample_prompt_data):
         """Test successful optimization."""
-        # Mock meta_llm methods
-        task_analysis = {
-            "detected_tasks": [TaskType.DEDUCTION],
-            "detected_behaviors": [BehaviorType.PRECISION],
-            "domain_hint": None
-        }
-        optimizer.meta_llm.analyze_task = mocker.MagicMock(return_value=task_analysis)
-        optimizer.meta_llm.generate_component_content = mocker.MagicMock(return_value="Test content")
-        optimizer.meta_llm.assemble_prompt = mocker.MagicMock(return_value="Full prompt text")
-        optimizer.meta_llm.generate_rationale = mocker.MagicMock(return_value="Optimization rationale")
-        
-        # Mock asp_engine
-        components = [
-            PromptComponent(type=ComponentType.INSTRUCTION, content="", position=1),
-            PromptComponent(type=ComponentType.EXAMPLE, content="", position=2)
-        ]
-        optimizer.asp_engine.solve = mocker.MagicMock(return_value=(components, 85.5))
-        
-        # Mock _save_to_db
-        optimizer._save_to_db = mocker.MagicMock(return_value=1)
-        
-        # Create request
+        optimizer = prepared_optimizer
         request = OptimizationRequest(**sample_prompt_data)
         
         # Test optimize method
@@ -85,28 +122,16 @@ class TestPromptOptimizer:
         # Verify method calls
         optimizer.meta_llm.analyze_task.assert_called_once_with(request.user_prompt)
         optimizer.asp_engine.solve.assert_called_once()
-        optimizer.meta_llm.generate_component_content.call_count == 2
+        optimizer.meta_llm.generate_all_components.assert_called_once_with(
+            PREPARED_ANALYSIS, request.user_prompt, ["instruction", "example"]
+        )
         optimizer.meta_llm.assemble_prompt.assert_called_once()
         optimizer.meta_llm.generate_rationale.assert_called_once()
         optimizer._save_to_db.assert_called_once()
     
-    def test_optimize_with_cache(self, mocker, optimizer, sample_prompt_data):
+    def test_optimize_with_cache(self, prepared_optimizer, sample_prompt_data):
         """Test optimization with cache hit."""
-        # Mock meta_llm methods
-        task_analysis = {
-            "detected_tasks": [TaskType.DEDUCTION],
-            "detected_behaviors": [BehaviorType.PRECISION],
-            "domain_hint": None
-        }
-        optimizer.meta_llm.analyze_task = mocker.MagicMock(return_value=task_analysis)
-        optimizer.meta_llm.generate_component_content = mocker.MagicMock(return_value="Test content")
-        optimizer.meta_llm.assemble_prompt = mocker.MagicMock(return_value="Full prompt text")
-        optimizer.meta_llm.generate_rationale = mocker.MagicMock(return_value="Optimization rationale")
-        
-        # Mock _save_to_db
-        optimizer._save_to_db = mocker.MagicMock(return_value=1)
-        
-        # Create request
+        optimizer = prepared_optimizer
         request = OptimizationRequest(**sample_prompt_data)
         
         # Add to cache
@@ -133,15 +158,174 @@ class TestPromptOptimizer:
         # Verify method calls
         optimizer.meta_llm.analyze_task.assert_called_once_with(request.user_prompt)
         optimizer.asp_engine.solve.assert_not_called()
-        optimizer.meta_llm.generate_component_content.call_count == 2
+        optimizer.meta_llm.generate_all_components.assert_called_once_with(
+            PREPARED_ANALYSIS, request.user_prompt, ["instruction", "example"]
+        )
+    
+    def test_optimize_stream_sends_structure_first(self, prepared_optimizer, sample_prompt_data):
+        """Test the structure is streamed before the LLM results and the result comes last."""
+        optimizer = prepared_optimizer
+        
+        async def slow_contents(*args, **kwargs):
+            await asyncio.sleep(0.02)
+            return PREPARED_CONTENTS
+        
+        optimizer.meta_llm.generate_all_components_async.side_effect = slow_contents
+        optimizer.meta_llm.stream_rationale = _rationale_stream("Ration", "ale")
+        
+        async def collect():
+            request = OptimizationRequest(**sample_prompt_data)
+            return [event async for event in optimizer.optimize_stream(request)]
+        
+        events = asyncio.run(collect())
+        
+        assert [name for name, _ in events] == [
+            "structure", "rationale_delta", "rationale_delta", "rationale", "components", "result"
+        ]
+        assert events[0][1]["components"] == [
+            {"type": "instruction", "position": 1}, {"type": "example", "position": 2}
+        ]
+        assert [payload["delta"] for _, payload in events[1:3]] == ["Ration", "ale"]
+        assert events[3][1] == {"rationale": "Rationale"}
+        assert events[4][1]["components"][0]["content"] == "Test content"
+        assert events[5][1].full_prompt == "Full prompt text"
+        assert events[5][1].rationale == "Rationale"
+    
+    def test_optimize_stream_closes_rationale_stream_early(self, prepared_optimizer, sample_prompt_data):
+        """Test that a consumer stopping early closes the rationale stream and cancels the content call."""
+        optimizer = prepared_optimizer
+        closed = []
+        
+        async def endless_contents(*args, **kwargs):
+            await asyncio.sleep(10)
+        
+        async def stream(*args, **kwargs):
+            try:
+                yield "Ration"
+                await asyncio.sleep(10)
+                yield "ale"
+            finally:
+                closed.append(True)
+        
+        optimizer.meta_llm.generate_all_components_async.side_effect = endless_contents
+        optimizer.meta_llm.stream_rationale = stream
+        
+        async def stop_after_first_delta():
+            events = optimizer.optimize_stream(OptimizationRequest(**sample_prompt_data))
+            async for name, _ in events:
+                if name == "rationale_delta":
+                    break
+            await events.aclose()
+            # Closed by the time aclose returns, not when the loop shuts down
+            assert closed == [True]
+        
+        asyncio.run(stop_after_first_delta())
+        
+        optimizer._save_to_db.assert_not_called()
+    
+    def test_optimize_async_solves_during_analysis(self, prepared_optimizer, sample_prompt_data):
+        """Test that explicit targets let the solve run while the analysis call is in flight."""
+        optimizer = prepared_optimizer
+        solved = threading.Event()
+        
+        async def analyze(user_prompt, strict=False):
+            # Only returns once the solve has started, so a sequential pipeline times out
+            assert await asyncio.to_thread(solved.wait, 1)
+            return PREPARED_ANALYSIS
+        
+        solve_result = optimizer.asp_engine.solve.return_value
+        
+        def solve(**kwargs):
+            solved.set()
+            return solve_result
+        
+        optimizer.meta_llm.analyze_task_async.side_effect = analyze
+        optimizer.asp_engine.solve.side_effect = solve
+        
+        request = OptimizationRequest(**sample_prompt_data)
+        result = asyncio.run(optimizer.optimize_async(request))
+        
+        assert result.rationale == "Optimization rationale"
+        assert optimizer.asp_engine.solve.call_args.kwargs["target_tasks"] == request.target_tasks
+        assert optimizer.asp_engine.solve.call_args.kwargs["domain"] == "education"
+    
+    def test_optimize_batch(self, mocker, optimizer, sample_prompt_data):
+        """Test batch optimization returns results in request order and saves them in one session."""
+        optimizer._save_to_db = mocker.MagicMock(return_value=1)
+        optimizer._solve_structure = mocker.MagicMock(side_effect=[
+            ([PromptComponent(type=ComponentType.INSTRUCTION, content="", position=1)], 80.0),
+            Exception("Test exception"),
+        ])
+        optimizer.meta_llm.generate_batch = mocker.MagicMock(return_value=[({"instruction": "Generated"}, "Rationale")])
+        requests = [
+            OptimizationRequest(**sample_prompt_data),
+            OptimizationRequest(**{**sample_prompt_data, "user_prompt": "Write a poem"}),
+        ]
+        
+        results = optimizer.optimize_batch(requests)
+        
+        assert results[0].full_prompt == "Generated"
+        assert results[0].rationale == "Rationale"
+        assert results[1].rationale == FALLBACK_RATIONALE
+        assert "Write a poem" in results[1].full_prompt
+        
+        # Only the solved request is generated and saved
+        assert len(optimizer.meta_llm.generate_batch.call_args[0][0]) == 1
+        optimizer._save_to_db.assert_called_once()
+        assert optimizer._save_to_db.call_args.kwargs["db"] is not None
+    
+    def test_optimize_async_defers_save_to_background_tasks(self, prepared_optimizer, sample_prompt_data):
+        """Test the database write is queued as a background task instead of awaited."""
+        from fastapi import BackgroundTasks
+        optimizer = prepared_optimizer
+        background_tasks = BackgroundTasks()
+        
+        request = OptimizationRequest(**sample_prompt_data)
+        result = asyncio.run(optimizer.optimize_async(request, background_tasks=background_tasks))
+        
+        assert result.full_prompt == "Full prompt text"
+        optimizer._save_to_db.assert_not_called()
+        assert len(background_tasks.tasks) == 1
+        
+        asyncio.run(background_tasks())
+        optimizer._save_to_db.assert_called_once()
+        assert optimizer._save_to_db.call_args.kwargs["rationale"] == "Optimization rationale"
         
-        # Clean up cache
-        optimization_cache.clear()
+        # Callers that save the result themselves opt out of the write
+        optimizer._save_to_db.reset_mock()
+        result = asyncio.run(optimizer.optimize_async(request, save=False))
+        assert result.rationale == "Optimization rationale"
+        optimizer._save_to_db.assert_not_called()
     
-    def test_optimize_exception(self, mocker, optimizer, sample_prompt_data):
+    def test_structure_cache_evicts_least_recently_used(self, mocker, optimizer):
+        """Test a recently hit structure survives eviction and cached components stay unmodified."""
+        from app.services.prompt_optimizer import OPTIMIZATION_CACHE_SIZE
+        optimizer.asp_engine.solve = mocker.MagicMock(side_effect=lambda **kwargs: (
+            [PromptComponent(type=ComponentType.INSTRUCTION, content="", position=1)], 80.0
+        ))
+        task_analysis = {"detected_tasks": [TaskType.DEDUCTION], "detected_behaviors": [BehaviorType.PRECISION]}
+        requests = [
+            OptimizationRequest(user_prompt="Test prompt", target_model=f"model-{i}")
+            for i in range(OPTIMIZATION_CACHE_SIZE + 1)
+        ]
+        
+        for request in requests[:OPTIMIZATION_CACHE_SIZE]:
+            components, _ = optimizer._solve_structure(request, task_analysis)
+            components[0].content = "Filled in"
+        optimizer._solve_structure(requests[0], task_analysis)
+        optimizer._solve_structure(requests[-1], task_analysis)
+        
+        first_key = optimizer._generate_cache_key([TaskType.DEDUCTION], [BehaviorType.PRECISION], "model-0", None)
+        second_key = optimizer._generate_cache_key([TaskType.DEDUCTION], [BehaviorType.PRECISION], "model-1", None)
+        assert first_key in optimization_cache
+        assert second_key not in optimization_cache
+        assert optimization_cache[first_key][0][0].content == ""
+    
+    def test_optimize_exception(self, prepared_optimizer, sample_prompt_data):
         """Test optimization with exception."""
-        # Mock meta_llm to raise exception
-        optimizer.meta_llm.analyze_task = mocker.MagicMock(side_effect=Exception("Test exception"))
+        # Make the analysis raise
+        optimizer = prepared_optimizer
+        optimizer.meta_llm.analyze_task.side_effect = Exception("Test exception")
         
         # Create request
         request = OptimizationRequest(**sample_prompt_data)
@@ -157,7 +341,61 @@ class TestPromptOptimizer:
         assert "Fallback" in result.rationale
         assert result.effectiveness_score == 50.0
     
-    @patch('app.models.database.SessionLocal')
+    def test_optimize_async_strict_raises(self, prepared_optimizer, sample_prompt_data):
+        """Test strict mode raises instead of returning the fallback and passes strict to the LLM calls."""
+        optimizer = prepared_optimizer
+        optimizer.meta_llm.generate_all_components_async.side_effect = Exception("Test exception")
+        request = OptimizationRequest(**sample_prompt_data)
+        
+        assert asyncio.run(optimizer.optimize_async(request)).rationale == FALLBACK_RATIONALE
+        with pytest.raises(Exception, match="Test exception"):
+            asyncio.run(optimizer.optimize_async(request, strict=True))
+        assert optimizer.meta_llm.analyze_task_async.call_args.kwargs["strict"] is True
+        assert optimizer.meta_llm.generate_all_components_async.call_args.kwargs["strict"] is True
+        optimizer._save_to_db.assert_not_called()
+    
+    def test_optimize_async_generates_concurrently(self, prepared_optimizer, sample_prompt_data):
+        """Test that the component batch and rationale calls overlap and the solve runs off the event loop."""
+        optimizer = prepared_optimizer
+        in_flight = 0
+        peak = 0
+        
+        async def llm_call(result):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return result
+        
+        async def batch_call(*args, **kwargs):
+            return await llm_call(PREPARED_CONTENTS)
+        
+        async def rationale_stream(*args, **kwargs):
+            yield await llm_call("Generated")
+        
+        solve_threads = []
+        solve_result = optimizer.asp_engine.solve.return_value
+        
+        def solve(**kwargs):
+            solve_threads.append(threading.current_thread())
+            return solve_result
+        
+        optimizer.meta_llm.generate_all_components_async.side_effect = batch_call
+        optimizer.meta_llm.stream_rationale = rationale_stream
+        optimizer.asp_engine.solve.side_effect = solve
+        
+        request = OptimizationRequest(**sample_prompt_data)
+        result = asyncio.run(optimizer.optimize_async(request))
+        
+        assert [c.content for c in result.components] == ["Test content", "Test content"]
+        assert result.rationale == "Generated"
+        assert result.effectiveness_score == 85.5
+        assert peak == 2
+        assert solve_threads[0] is not threading.main_thread()
+        optimizer._save_to_db.assert_called_once()
+    
+    @patch('app.services.prompt_optimizer.SessionLocal')
     def test_save_to_db(self, mock_session_local, optimizer):
         """Test saving to database."""
         # Setup mock
@@ -199,12 +437,16 @@ class TestPromptOptimizer:
             assert result == 1
             
             # Verify db calls
-            assert mock_db.add.call_count == 3  # 1 prompt + 2 components
+            assert mock_db.add.call_count == 1  # Only the prompt; components are bulk inserted
             mock_db.flush.assert_called_once()
+            mock_db.execute.assert_called_once()
+            rows = mock_db.execute.call_args[0][1]
+            assert [row["position"] for row in rows] == [1, 2]
+            assert all(row["prompt_id"] == 1 for row in rows)
             mock_db.commit.assert_called_once()
             mock_db.close.assert_called_once()
     
-    @patch('app.models.database.SessionLocal')
+    @patch('app.services.prompt_optimizer.SessionLocal')
     def test_save_to_db_exception(self, mock_session_local, optimizer):
         """Test saving to database with exception."""
         # Setup mock to raise exception
@@ -240,6 +482,57 @@ class TestPromptOptimizer:
         mock_db.rollback.assert_called_once()
         mock_db.close.assert_called_once()
     
+    def test_save_to_db_with_session(self, optimizer, test_db):
+        """Test saving through a caller's session leaves it open and skips the reload after commit."""
+        from sqlalchemy import event
+        from app.models.database import PromptComponentDB
+        components = [
+            PromptComponent(type=ComponentType.INSTRUCTION, content="Test", position=1),
+            PromptComponent(type=ComponentType.EXAMPLE, content="Test", position=2)
+        ]
+        statements = []
+        bind = test_db.get_bind()
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(bind, "before_cursor_execute", listener)
+        try:
+            prompt_id = optimizer._save_to_db(
+                user_prompt="Test prompt",
+                optimized_prompt="Optimized test prompt",
+                components=components,
+                target_model="gpt-4",
+                effectiveness_score=85.5,
+                rationale="Test rationale",
+                db=test_db
+            )
+        finally:
+            event.remove(bind, "before_cursor_execute", listener)
+        
+        assert prompt_id is not None
+        assert not any(statement.lstrip().upper().startswith("SELECT") for statement in statements)
+        rows = test_db.query(PromptComponentDB).filter_by(prompt_id=prompt_id).all()
+        assert sorted(row.position for row in rows) == [1, 2]
+    
+    def test_save_result(self, mocker, optimizer, sample_prompt_data):
+        """Test saving a finished result passes its fields to _save_to_db."""
+        optimizer._save_to_db = mocker.MagicMock(return_value=7)
+        request = OptimizationRequest(**sample_prompt_data)
+        result = OptimizedPrompt(
+            components=[PromptComponent(type=ComponentType.INSTRUCTION, content="Test", position=1)],
+            full_prompt="Full prompt text",
+            rationale="Optimization rationale",
+            effectiveness_score=85.5
+        )
+        
+        assert optimizer.save_result(request, result) == 7
+        optimizer._save_to_db.assert_called_once_with(
+            user_prompt=request.user_prompt,
+            optimized_prompt="Full prompt text",
+            components=result.components,
+            target_model=request.target_model,
+            effectiveness_score=85.5,
+            rationale="Optimization rationale"
+        )
+    
     def test_provide_feedback_success(self, mocker, optimizer):
         """Test successful feedback provision."""
         # Mock asp_engine
@@ -280,4 +573,80 @@ class TestPromptOptimizer:
         assert result is False
         
         # Verify calls
-        optimizer.asp_engine.update_efficacy.assert_called_once_with(component, behavior, effectiveness)
\ No newline at end of file
+        optimizer.asp_engine.update_efficacy.assert_called_once_with(component, behavior, effectiveness)
+    
+    def test_queue_and_flush_feedback(self, mocker, optimizer):
+        """Test that queued feedback is applied immediately and persisted in batches."""
+        optimizer.asp_engine.apply_efficacy = mocker.MagicMock()
+        optimizer.asp_engine.persist_efficacy = mocker.MagicMock()
+        
+        items = [
+            (ComponentType.INSTRUCTION, BehaviorType.PRECISION, 0.9),
+            (ComponentType.EXAMPLE, TaskType.DEDUCTION, 0.8),
+            (ComponentType.CONTEXT, TaskType.ABDUCTION, 0.7),
+        ]
+        optimization_cache["test"] = ("data", 85.5)
+        for item in items:
+            assert optimizer.queue_feedback(*item) is True
+        
+        # Verify in-memory updates happened and the cache was cleared
+        assert optimizer.asp_engine.apply_efficacy.call_count == 3
+        assert len(optimization_cache) == 0
+        optimizer.asp_engine.persist_efficacy.assert_not_called()
+        
+        # Flush in batches of two
+        assert optimizer.flush_feedback(batch_size=2) == 3
+        assert optimizer.asp_engine.persist_efficacy.call_args_list == [
+            call(items[:2]),
+            call(items[2:]),
+        ]
+        
+        # Nothing left to write
+        assert optimizer.flush_feedback() == 0
+    
+    def test_flush_feedback_failure_requeues(self, mocker, optimizer):
+        """Test that a failed flush keeps the feedback for the next attempt."""
+        optimizer.asp_engine.apply_efficacy = mocker.MagicMock()
+        optimizer.asp_engine.persist_efficacy = mocker.MagicMock(side_effect=Exception("Test exception"))
+        
+        item = (ComponentType.INSTRUCTION, BehaviorType.PRECISION, 0.9)
+        optimizer.queue_feedback(*item)
+        
+        with pytest.raises(Exception, match="Test exception"):
+            optimizer.flush_feedback()
+        
+        # Verify the entry is written once the database recovers
+        optimizer.asp_engine.persist_efficacy = mocker.MagicMock()
+        assert optimizer.flush_feedback() == 1
+        optimizer.asp_engine.persist_efficacy.assert_called_once_with([item])
+    
+    def test_flush_feedback_failure_keeps_new_feedback(self, mocker, optimizer, monkeypatch):
+        """Test that failed batches overflow their own buffer, dropping the stalest entries instead of new feedback."""
+        from collections import deque
+        monkeypatch.setattr("app.services.prompt_optimizer.FEEDBACK_RETRY_SIZE", 2)
+        optimizer._pending_feedback = deque(maxlen=2)
+        optimizer.asp_engine.apply_efficacy = mocker.MagicMock()
+        optimizer.asp_engine.persist_efficacy = mocker.MagicMock(side_effect=Exception("Test exception"))
+        items = [
+            (ComponentType.INSTRUCTION, BehaviorType.PRECISION, 0.1),
+            (ComponentType.EXAMPLE, BehaviorType.PRECISION, 0.2),
+            (ComponentType.CONTEXT, BehaviorType.PRECISION, 0.3),
+            (ComponentType.CONSTRAINT, BehaviorType.PRECISION, 0.4),
+            (ComponentType.INSTRUCTION, TaskType.DEDUCTION, 0.5),
+            (ComponentType.EXAMPLE, TaskType.DEDUCTION, 0.6),
+        ]
+        
+        # Two failed flushes: the second retries the first two entries along with two new ones
+        for start in (0, 2):
+            for item in items[start:start + 2]:
+                optimizer.queue_feedback(*item)
+            with pytest.raises(Exception, match="Test exception"):
+                optimizer.flush_feedback(batch_size=4)
+        
+        # New feedback fills the main buffer while the retries wait
+        for item in items[4:]:
+            optimizer.queue_feedback(*item)
+        
+        optimizer.asp_engine.persist_efficacy = mocker.MagicMock()
+        assert optimizer.flush_feedback(batch_size=4) == 4
+        optimizer.asp_engine.persist_efficacy.assert_called_once_with(items[2:])
@@ -0,0 +1,44 @@
+import pytest
+import asyncio
+from app.services.rate_limiter import RateLimiter
+
+class TestRateLimiter:
+    """Tests for the RateLimiter class."""
+    
+    def test_rate_limiter_blocks_over_budget(self):
+        """Verify requests past either budget wait until the budget has refilled enough."""
+        now = [0.0]
+        limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=1000, timer=lambda: now[0])
+        
+        assert limiter.reserve(100) == 0
+        assert limiter.reserve(100) == 0
+        # Third request in the same instant waits for half a minute of request refill
+        assert limiter.reserve(100) == pytest.approx(30.0)
+        
+        now[0] = 120.0
+        assert limiter.reserve(600) == 0
+        # 200 tokens short at 1000 tokens a minute
+        assert limiter.reserve(600) == pytest.approx(12.0)
+    
+    def test_oversized_request_waits_for_full_budget_only(self):
+        """Verify a request larger than the token budget is capped instead of waiting forever."""
+        now = [0.0]
+        limiter = RateLimiter(requests_per_minute=100, tokens_per_minute=1000, timer=lambda: now[0])
+        
+        assert limiter.reserve(5000) == 0
+        assert limiter.reserve(5000) == pytest.approx(60.0)
+    
+    def test_acquire_async_sleeps_for_reservation(self, monkeypatch):
+        """Verify the async acquire sleeps for the reserved delay."""
+        delays = []
+        
+        async def fake_sleep(delay):
+            delays.append(delay)
+        
+        monkeypatch.setattr("app.services.rate_limiter.asyncio.sleep", fake_sleep)
+        limiter = RateLimiter(requests_per_minute=1, tokens_per_minute=1000, timer=lambda: 0.0)
+        
+        asyncio.run(limiter.acquire_async(10))
+        asyncio.run(limiter.acquire_async(10))
+        
+        assert delays == [pytest.approx(60.0)]
@@ -0,0 +1,29 @@
+from app.services.semantic_cache import SemanticCache
+
+class TestSemanticCache:
+    """Tests for the SemanticCache class."""
+    
+    def test_get_returns_most_similar_above_threshold(self):
+        """Verify lookups match by cosine similarity regardless of vector length."""
+        cache = SemanticCache(threshold=0.9)
+        cache.put([1.0, 0.0], "x-axis")
+        cache.put([0.0, 1.0], "y-axis")
+        
+        assert cache.get([10.0, 1.0]) == "x-axis"
+        assert cache.get([0.1, 2.0]) == "y-axis"
+        assert cache.get([1.0, 1.0]) is None
+        assert cache.get([0.0, 0.0]) is None
+    
+    def test_evicts_least_recently_used(self):
+        """Verify a hit refreshes an entry so the oldest untouched one is evicted."""
+        cache = SemanticCache(maxsize=2, threshold=0.99)
+        cache.put([1.0, 0.0, 0.0], "a")
+        cache.put([0.0, 1.0, 0.0], "b")
+        assert cache.get([1.0, 0.0, 0.0]) == "a"
+        
+        cache.put([0.0, 0.0, 1.0], "c")
+        
+        assert len(cache) == 2
+        assert cache.get([1.0, 0.0, 0.0]) == "a"
+        assert cache.get([0.0, 1.0, 0.0]) is None
+        assert cache.get([0.0, 0.0, 1.0]) == "c"
@@ -0,0 +1,15 @@
+import logging
+from logging.handlers import QueueHandler, RotatingFileHandler
+from app.main import log_listener
+
+class TestLogging:
+    """Tests for the application logging setup."""
+    
+    def test_file_logging_is_queued(self):
+        """Verify log files are written by the background listener, not the loggers."""
+        for name in ("", "app", "uvicorn"):
+            handlers = logging.getLogger(name).handlers
+            assert not any(isinstance(handler, RotatingFileHandler) for handler in handlers)
+            assert any(isinstance(handler, QueueHandler) for handler in handlers)
+        
+        assert any(isinstance(handler, RotatingFileHandler) for handler in log_listener.handlers)